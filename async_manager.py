@@ -0,0 +1,260 @@
+import json
+import asyncio
+
+import pandas as pd
+
+try:
+    import aio_pika
+except ImportError:  # необязательная зависимость: нужна только асинхронному менеджеру
+    aio_pika = None
+
+from final_manager import StorageManager
+from ingest import partition_rows, group_rows, build_batches
+
+from config import num_storages, durability, print_each_step, heartbeat_check_interval
+from config import batch_max_rows, batch_max_bytes, stream_chunk_rows, stream_queue_threshold, stream_backoff_interval
+
+
+class AsyncChannel:
+    """
+    Синхронный фасад канала aio-pika для кода StorageManager: basic_publish и queue_declare только
+    ставят операцию в очередь, а одна задача выполняет их по порядку. Поэтому сообщения уходят
+    в том же порядке, в каком их отправил код менеджера (как у pika), а обработчики не ждут сеть.
+    """
+
+    def __init__(self):
+        self.operations = asyncio.Queue()
+
+    def basic_publish(self, exchange, routing_key, body, mandatory=False):
+        self.operations.put_nowait(('publish', routing_key, body))
+
+    def queue_declare(self, queue, durable=False, passive=False):
+        self.operations.put_nowait(('declare', queue, durable))
+
+    async def run(self, channel):
+        while True:
+            operation, name, argument = await self.operations.get()
+            try:
+                if operation == 'publish':
+                    body = argument.encode() if isinstance(argument, str) else argument
+                    await channel.default_exchange.publish(aio_pika.Message(body=body), routing_key=name)
+                else:
+                    await channel.declare_queue(name, durable=argument)
+            except Exception as e:
+                print(f"[Ошибка] в отправке сообщения в {name}: {e}")
+
+
+class AsyncStorageManager(StorageManager):
+    """
+    Менеджер на одном цикле событий asyncio и асинхронном клиенте AMQP (aio-pika) вместо pika и потоков.
+    Команды клиента, ответы хранителей, heartbeat и проверка отказов обрабатываются одним циклом,
+    а LOAD - задачами, которые разбирают CSV в пуле потоков и отдают управление циклу после каждой пачки.
+    Набор команд и их обработка - те же, что у StorageManager: его код работает через AsyncChannel,
+    а таймеры (таймауты GET_RANGE / MGET, JOIN) ставятся на цикл событий.
+    """
+
+    def __init__(self, num_storages, **kwargs):
+        if aio_pika is None:
+            raise ImportError("Для асинхронного менеджера нужен пакет aio-pika (pip install aio-pika)")
+        self.amqp = None
+        self.tasks = set()  # ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+        super().__init__(num_storages, **kwargs)
+
+    def connect(self):
+        """Очереди объявляются через AsyncChannel, когда start() подключится к RabbitMQ"""
+        # call_later цикла событий принимает те же аргументы, что и у соединения pika
+        self.connection = asyncio.get_running_loop()
+        self.channel = AsyncChannel()
+
+        for queue_name in ['manager_responses', 'manager_commands', 'client_responses', 'manager_heartbeats', 'showcase_data']:
+            self.channel.queue_declare(queue=queue_name, durable=durability)
+        for i in range(self.num_storages):
+            self.channel.queue_declare(queue=f"storage-{i}", durable=durability)
+
+    def start_background(self):
+        pass  # heartbeat и проверка отказов - задачи цикла, запускаются в start()
+
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def watch_storages_async(self):
+        while True:
+            await asyncio.sleep(heartbeat_check_interval)
+            try:
+                self.check_storages(self.channel)
+            except Exception as e:
+                print(f"[Ошибка] в watch_storages: {e}")
+
+    async def consume(self, channel, queue_name, handler):
+        """Подписка на очередь: handler получает тело сообщения, как обработчики StorageManager"""
+        async def callback(message):
+            try:
+                handler(message.body)
+            except Exception as e:
+                print(f"[Ошибка] в обработке сообщения из {queue_name}: {e}")
+
+        queue = await channel.declare_queue(queue_name, durable=durability)
+        await queue.consume(callback, no_ack=True)
+
+    def launch_job(self, job):
+        """Задание - задача цикла событий со своим каналом"""
+        self.spawn(self.run_load_job_async(job))
+
+    async def run_load_job_async(self, job):
+        channel = None
+        try:
+            # В потоковом режиме - канал с подтверждениями издателя, как у StorageManager
+            channel = await self.amqp.channel(publisher_confirms=job.stream)
+
+            if job.stream:
+                response = await self.load_data_stream_async(job, channel)
+            else:
+                response = await self.load_data_async(job, channel)
+
+            self.channel.basic_publish(exchange='', routing_key='client_responses', body=json.dumps({**response, 'job': job.progress()}))
+
+        except Exception as e:
+            job.finish('failed', str(e))
+            print(f"[Ошибка] Задание {job.job_id}: {e}")
+
+        finally:
+            if channel is not None and not channel.is_closed:
+                await channel.close()
+
+    async def publish_rows_async(self, channel, storage_id, rows, job, epoch, mandatory=False):
+        """
+        То же, что publish_rows, но пачки сериализуются в пуле потоков, а каждая публикация отдает
+        управление циклу - GET, heartbeat и JOIN обрабатываются между пачками. Возвращает строки,
+        не отправленные из-за изменения кольца, или None - задание отменено.
+        """
+        loop = asyncio.get_running_loop()
+        queue_name = f"storage-{storage_id}"
+
+        step = batch_max_rows * 10
+        for start in range(0, len(rows), step):
+            if job.cancelled():
+                return None
+
+            part = rows[start:start + step]
+            if not self.begin_slice(storage_id, part, epoch):
+                return rows[start:]
+            try:
+                bodies = await loop.run_in_executor(None, lambda: list(build_batches(part, batch_max_rows, batch_max_bytes)))
+                for body in bodies:
+                    await channel.default_exchange.publish(aio_pika.Message(body=body), routing_key=queue_name, mandatory=mandatory)
+            finally:
+                self.end_slice(epoch)
+            self.get_cache.invalidate_dates(dict.fromkeys(row['date_parsed'] for row in part))
+            job.rows_published += len(part)
+
+        if print_each_step:
+            print(f"[Менеджер] Отправил {len(rows)} строк в {queue_name}")
+        return []
+
+    async def publish_partitions_async(self, channel, partitions, ring, epoch, job, stream=False):
+        """То же, что publish_partitions: строки, не успевшие уйти до изменения кольца, раскладываются по новому"""
+        while partitions:
+            unsent = []
+            for storage_id, rows in partitions.items():
+                if stream:
+                    await self.wait_for_queue_async(channel, storage_id)
+
+                # с publisher_confirms публикация завершается только после ack брокера
+                rest = await self.publish_rows_async(channel, storage_id, rows, job, epoch, mandatory=stream)
+                if rest is None:
+                    return False
+                unsent.extend(rest)
+
+            partitions = {}
+            if unsent:
+                ring, epoch = self.ring_snapshot(ring)
+                partitions = group_rows(unsent, ring)
+        return True
+
+    def job_cancelled(self, job):
+        job.finish('cancelled')
+        print(f"[Менеджер] Задание {job.job_id} отменено, отправлено {job.rows_published} строк")
+        return {"status": "CANCELLED", "message": f"Загрузка {job.file_path} отменена после {job.rows_published} строк"}
+
+    async def load_data_async(self, job, channel):
+        """LOAD: разбор файла и раскладка строк по хранителям - в пуле потоков, публикация - в цикле"""
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(None, pd.read_csv, job.file_path)
+            job.rows_total = len(data)
+            ring, epoch = self.ring_snapshot()
+            partitions = await loop.run_in_executor(None, partition_rows, data, ring)
+
+            if not await self.publish_partitions_async(channel, partitions, ring, epoch, job):
+                return self.job_cancelled(job)
+
+            job.finish('done')
+            print("[Менеджер] Данные успешно загружены и распределены!")
+            return {"status": "OK", "message": f"Файл {job.file_path} загружен"}
+
+        except Exception as e:
+            job.finish('failed', str(e))
+            print(f"[Ошибка] Не удалось загрузить файл: {e}")
+            return {"status": "ERROR", "message": f"Не удалось загрузить файл: {e}"}
+
+    async def load_data_stream_async(self, job, channel):
+        """LOAD STREAM: чанки читаются в пуле потоков, публикация ждет подтверждений брокера и разгрузки очередей"""
+        loop = asyncio.get_running_loop()
+        try:
+            reader = await loop.run_in_executor(None, lambda: pd.read_csv(job.file_path, chunksize=stream_chunk_rows))
+
+            ring = None
+            while (chunk := await loop.run_in_executor(None, next, reader, None)) is not None:
+                ring, epoch = self.ring_snapshot(ring)
+                partitions = await loop.run_in_executor(None, partition_rows, chunk, ring)
+
+                if not await self.publish_partitions_async(channel, partitions, ring, epoch, job, stream=True):
+                    return self.job_cancelled(job)
+
+                if print_each_step:
+                    print(f"[Менеджер] Потоковая загрузка {job.file_path}: отправлено {job.rows_published} строк")
+
+            job.rows_total = job.rows_published
+            job.finish('done')
+            print(f"[Менеджер] Данные успешно загружены и распределены в потоковом режиме ({job.rows_published} строк)!")
+            return {"status": "OK", "message": f"Файл {job.file_path} загружен ({job.rows_published} строк)"}
+
+        except Exception as e:
+            job.finish('failed', str(e))
+            print(f"[Ошибка] Не удалось загрузить файл: {e}")
+            return {"status": "ERROR", "message": f"Не удалось загрузить файл: {e}"}
+
+    async def wait_for_queue_async(self, channel, storage_id):
+        """Backpressure: ждет, пока очередь хранителя не станет короче stream_queue_threshold"""
+        queue_name = f"storage-{storage_id}"
+        while storage_id not in self.dead_storages:
+            queue = await channel.declare_queue(queue_name, durable=durability, passive=True)
+            if queue.declaration_result.message_count <= stream_queue_threshold:
+                return
+            await asyncio.sleep(stream_backoff_interval)
+
+    async def start(self):
+        self.amqp = await aio_pika.connect_robust(host='localhost')
+        channel = await self.amqp.channel(publisher_confirms=False)
+
+        self.spawn(self.channel.run(channel))
+        self.spawn(self.watch_storages_async())
+
+        await self.consume(channel, 'manager_heartbeats', self.on_heartbeat)
+        await self.consume(channel, 'manager_responses', lambda body: self.on_storage_message(None, None, None, body))
+        await self.consume(channel, 'manager_commands', lambda body: self.on_client_command(None, None, None, body))
+        print("[Менеджер] Ожидание команд от клиента (asyncio)...")
+
+        await asyncio.Future()  # работаем, пока процесс не остановят
+
+
+async def main():
+    manager = AsyncStorageManager(num_storages=num_storages)
+    await manager.start()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+from hashing import ConsistentHashing
+from ingest import find_date_column, parse_date_column
+
+from config import num_storages, num_vnodes, storage_weights
+
+
+def load_dates(file_paths):
+    """Читает даты (в формате '%d-%m-%Y') из всех указанных CSV"""
+    dates = []
+    for file_path in file_paths:
+        data = pd.read_csv(file_path)
+        date_column = find_date_column(data.columns)
+        if date_column is None:
+            print(f"[Ошибка] В файле {file_path} не найден столбец с датой, пропускаю")
+            continue
+        dates.append(pd.Series(parse_date_column(data[date_column]), dtype=object).dropna())
+    return pd.concat(dates, ignore_index=True) if dates else pd.Series([], dtype=object)
+
+
+def balance_report(dates, storages, vnodes, weights, dead=()):
+    """
+    Считает долю ключей (уникальных дат) и строк на каждом хранителе.
+    Возвращает словарь со статистикой по кольцу с заданным количеством виртуальных узлов.
+    """
+    ring = ConsistentHashing(storages, vnodes, weights)
+    for storage_id in dead:
+        ring.remove_storage(storage_id)
+    live = sorted(ring.storage_points)
+
+    counts = dates.value_counts()
+    owners = np.array([ring.get_storage(date) for date in counts.index])
+
+    key_counts = np.array([(owners == storage_id).sum() for storage_id in live], dtype=float)
+    row_counts = np.array([counts.to_numpy()[owners == storage_id].sum() for storage_id in live], dtype=float)
+
+    # Ожидаемая доля хранителя пропорциональна его весу
+    expected = np.array([ring.vnode_count(storage_id) for storage_id in live], dtype=float)
+    expected /= expected.sum()
+
+    key_share = key_counts / max(key_counts.sum(), 1)
+    row_share = row_counts / max(row_counts.sum(), 1)
+
+    return {
+        'storages': live,
+        'key_counts': key_counts,
+        'key_share': key_share,
+        'row_share': row_share,
+        'expected_share': expected,
+        'key_share_std': float(np.std(key_share)),
+        # Насколько самый нагруженный хранитель превышает ожидаемую долю (в процентах)
+        'hottest_over_mean': float(np.max(key_share / expected) - 1) * 100,
+    }
+
+
+def print_report(report, vnodes):
+    print(f"\nВиртуальных узлов на хранитель: {vnodes}")
+    print(f"{'хранитель':>10} {'ключей':>8} {'доля ключей':>12} {'доля строк':>11} {'ожидаемая':>10}")
+    for i, storage_id in enumerate(report['storages']):
+        print(f"{storage_id:>10} {int(report['key_counts'][i]):>8} {report['key_share'][i]:>12.2%} "
+              f"{report['row_share'][i]:>11.2%} {report['expected_share'][i]:>10.2%}")
+    print(f"Стандартное отклонение доли ключей: {report['key_share_std']:.4f}")
+    print(f"Самый нагруженный хранитель выше ожидаемой доли на {report['hottest_over_mean']:.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчет о распределении ключей по хранителям на кольце consistent hashing")
+    parser.add_argument('files', nargs='+', help="CSV-файлы с данными")
+    parser.add_argument('--storages', type=int, default=num_storages, help="количество хранителей")
+    parser.add_argument('--vnodes', type=int, nargs='+', default=[num_vnodes], help="одно или несколько значений числа виртуальных узлов")
+    parser.add_argument('--dead', type=int, nargs='*', default=[], help="id хранителей, которых считаем упавшими")
+    args = parser.parse_args()
+
+    dates = load_dates(args.files)
+    print(f"Ключей (уникальных дат): {dates.nunique()}, строк: {len(dates)}")
+
+    for vnodes in args.vnodes:
+        report = balance_report(dates, args.storages, vnodes, storage_weights, args.dead)
+        print_report(report, vnodes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import sys
+import time
+import random
+
+from heartbeat import PhiAccrualDetector
+
+from config import heartbeat_interval, heartbeat_check_interval, phi_threshold, heartbeat_acceptable_pause
+from config import main_loop_stall_timeout, replication_wait_timeout
+
+# Моделирование без брокера: сотни хранителей, у части - задержки heartbeat, как при тяжелой загрузке
+node_counts = [100, 500, 1000]
+simulated_seconds = 120
+busy_share = 0.3  # доля хранителей под загрузкой
+# до скольких секунд загрузка задерживает очередной heartbeat: в пределах heartbeat_acceptable_pause и сверх нее (паузы GC, своп)
+busy_delays = [0.4, 1.0, 2.0]
+
+
+def simulate(nodes, busy_delay, seed=0):
+    """
+    Возвращает (ложных срабатываний, среднее время проверки всех узлов в мс, время обнаружения упавшего узла,
+    время обнаружения узла, у которого завис основной цикл: его поток heartbeat завершает процесс, когда отметка
+    хода цикла старше main_loop_stall_timeout, и дальше узел обнаруживается по phi, как упавший)
+    """
+    random.seed(seed)
+    detector = PhiAccrualDetector()
+    busy = set(random.sample(range(2, nodes), int(nodes * busy_share)))
+    dead_node, dead_at = 0, simulated_seconds / 2
+    wedged_node, wedged_at = 1, simulated_seconds / 2
+
+    next_heartbeat = {}
+    exited = set()  # узлы, завершившие себя из-за зависшего основного цикла
+    for node in range(nodes):
+        detector.register(node, 0.0)
+        next_heartbeat[node] = random.uniform(0, heartbeat_interval)
+
+    false_positives = set()
+    detected_at = None
+    wedge_detected_at = None
+    check_time = 0.0
+    checks = 0
+
+    now = 0.0
+    while now < simulated_seconds:
+        now += heartbeat_check_interval
+        for node in range(nodes):
+            while next_heartbeat[node] <= now:
+                sent = next_heartbeat[node]
+                # на сколько отметка основного цикла отстала от heartbeat
+                if node == wedged_node and sent >= wedged_at:
+                    stall = sent - wedged_at
+                elif node in busy and random.random() < 0.2:
+                    stall = random.uniform(0, replication_wait_timeout)  # основной цикл ждет подтверждений реплики
+                else:
+                    stall = random.uniform(0, heartbeat_interval)
+                if stall > main_loop_stall_timeout:
+                    exited.add(node)
+
+                if not (node == dead_node and sent >= dead_at) and node not in exited:
+                    detector.heartbeat(node, sent)
+                delay = random.uniform(0, busy_delay) if node in busy and random.random() < 0.2 else random.uniform(0, 0.02)
+                next_heartbeat[node] += heartbeat_interval + delay
+
+        started = time.perf_counter()
+        suspects = [node for node in range(nodes) if detector.phi(node, now) > phi_threshold]
+        check_time += time.perf_counter() - started
+        checks += 1
+
+        for node in suspects:
+            if node == dead_node and now >= dead_at:
+                detected_at = detected_at or now
+            elif node == wedged_node and now >= wedged_at:
+                wedge_detected_at = wedge_detected_at or now
+            else:
+                false_positives.add(node)
+
+    return (len(false_positives), check_time / checks * 1000, (detected_at - dead_at) if detected_at else None,
+            (wedge_detected_at - wedged_at) if wedge_detected_at else None)
+
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or node_counts
+    print(f"Допустимая пауза heartbeat {heartbeat_acceptable_pause} с, хранитель с зависшим основным циклом завершается через {main_loop_stall_timeout} с")
+    print(f"{'хранителей':>10} {'задержка до, с':>15} {'ложных срабатываний':>20} {'проверка всех, мс':>18} {'обнаружение, с':>15} {'зависший цикл, с':>17}")
+    for busy_delay in busy_delays:
+        for nodes in counts:
+            false_positives, check_ms, detection, wedge_detection = simulate(nodes, busy_delay)
+            detection = f"{detection:.2f}" if detection is not None else 'нет'
+            wedge_detection = f"{wedge_detection:.2f}" if wedge_detection is not None else 'нет'
+            print(f"{nodes:>10} {busy_delay:>15.1f} {false_positives:>20} {check_ms:>18.3f} {detection:>15} {wedge_detection:>17}")
+
+
+if __name__ == "__main__":
+    main()
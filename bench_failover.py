@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+
+import pika
+
+from bench_restart import make_partition, timed, partition_sizes
+from columnar_store import ColumnarStore
+from hashing import ConsistentHashing
+from transfer import byte_chunks, encode_payload, decode_rows, baseline_codec
+
+from heartbeat import PhiAccrualDetector
+from segment_store import drop_store
+
+from config import num_storages, chunk_size, heartbeat_interval, heartbeat_check_interval, phi_threshold, replication_batch_rows
+from config import batch_max_rows, durability
+
+# PROMOTE меряется на настоящих процессах: нужен запущенный RabbitMQ, но не менеджер и не хранители
+# (повышенная реплика шлет менеджеру свои даты). Узел бенчмарка не пересекается с хранителями кластера
+bench_node_id = 99
+bench_queue = 'bench_failover'
+
+
+def relocate(store, dead_storage=0):
+    """
+    RELOCATE без брокера: реплика раскладывает даты по соседям кольца и шлет их сжатыми порциями LOAD_2,
+    каждый сосед применяет порцию и пересылает ее своей реплике (COPY_2). Раздел доступен только после всего этого.
+    """
+    ring = ConsistentHashing(num_storages)
+    ring.remove_storage(dead_storage)
+
+    dates = list(store.dates())
+    partitions = {}
+    for date, owner in zip(dates, ring.get_storage_many(dates).tolist()):
+        partitions.setdefault(owner, []).append(date)
+
+    targets = {storage_id: (ColumnarStore(), ColumnarStore()) for storage_id in partitions}
+    for storage_id, target_dates in partitions.items():
+        target, target_replica = targets[storage_id]
+        for payload in byte_chunks(store, target_dates):
+            request = json.loads(json.dumps({'command': 'LOAD_2', 'codec': baseline_codec, 'payload': encode_payload(payload, baseline_codec)}))
+            target.append_rows(decode_rows(request))
+            copy_2 = json.loads(json.dumps({'command': 'COPY_2', 'codec': request['codec'], 'payload': request['payload']}))
+            target_replica.append_rows(decode_rows(copy_2))
+    return targets
+
+
+def start_process(code):
+    """Процесс узла отдельной группой, чтобы остановить его вместе с порожденными (новой репликой после PROMOTE)"""
+    return subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.DEVNULL, start_new_session=True)
+
+
+def start_replica(channel, node_id, rows):
+    """Запускает процесс реплики и загружает в нее rows"""
+    drop_store(f'replica-{node_id}')
+    for queue in [f'replica-{node_id}', bench_queue]:
+        channel.queue_declare(queue=queue, durable=durability)
+        channel.queue_purge(queue=queue)
+
+    process = start_process(f'from storageNode import run_replica; run_replica({node_id})')
+    for i in range(0, len(rows), batch_max_rows):
+        channel.basic_publish(exchange='', routing_key=f'replica-{node_id}',
+                              body=json.dumps({'command': 'LOAD_BATCH', 'data': rows[i:i + batch_max_rows]}))
+
+    # Ответ на GET после всех пачек - реплика их применила
+    channel.basic_publish(exchange='', routing_key=f'replica-{node_id}',
+                          body=json.dumps({'command': 'GET', 'date': rows[-1]['date_parsed'], 'reply_to': bench_queue}))
+    wait_reply(channel.connection, channel, 'GET')
+    return process
+
+
+def stop_node(process, store_names):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass  # узел уже завершился сам (реплика после RELOCATE)
+    process.wait()
+    for name in store_names:
+        drop_store(name)
+
+
+def wait_reply(connection, channel, command, timeout=60.0):
+    """Ждет в bench_queue ответа с нужной командой, остальные (отчеты о порциях и т. п.) возвращает списком"""
+    others = []
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        _, _, body = channel.basic_get(queue=bench_queue, auto_ack=True)
+        if body is None:
+            connection.sleep(0.001)
+            continue
+        response = json.loads(body)
+        if response.get('command') == command:
+            return response, others
+        others.append(response)
+    raise RuntimeError(f"Нет ответа {command} за {timeout} с")
+
+
+def promote(connection, channel, size):
+    """
+    Повышение реплики через брокер: от отправки PROMOTE до ответа PROMOTED. За это время реплика дорабатывает
+    свою очередь, открывает соединение хранителя, запускает новую реплику и шлет даты менеджеру. Данные остаются на месте.
+    """
+    process = start_replica(channel, bench_node_id, make_partition(size))
+    try:
+        started = time.perf_counter()
+        channel.basic_publish(exchange='', routing_key=f'replica-{bench_node_id}',
+                              body=json.dumps({'command': 'PROMOTE', 'reply_to': bench_queue, 'epoch': 1}))
+        response, _ = wait_reply(connection, channel, 'PROMOTED')
+        assert response['rows'] == size
+        return time.perf_counter() - started
+    finally:
+        stop_node(process, [f'replica-{bench_node_id}', f'replica-{bench_node_id}.1'])
+
+
+def promote_offline(store):
+    """Что остается от повышения реплики без брокера: запомнить, что отдать новой реплике (для фоновой перестройки)"""
+    return [(date, store.date_row_count(date)) for date in store.dates()]
+
+
+def rebuild_replica(store, rebuild_pending):
+    """Фоновая перестройка новой реплики: строки по chunk_size дат уходят пачками REPLICATE"""
+    replica = ColumnarStore()
+    buffer = []
+    for i in range(0, len(rebuild_pending), chunk_size):
+        for date, count in rebuild_pending[i:i + chunk_size]:
+            buffer.extend(store.get(date)[:count])
+        while len(buffer) >= replication_batch_rows:
+            batch, buffer = buffer[:replication_batch_rows], buffer[replication_batch_rows:]
+            replica.append_rows(json.loads(json.dumps({'command': 'REPLICATE', 'data': batch}))['data'])
+    replica.append_rows(buffer)
+    return replica
+
+
+def detection_time():
+    """Через сколько после последнего heartbeat (при ровных heartbeat) phi превысит порог"""
+    detector = PhiAccrualDetector()
+    now = 0.0
+    detector.register(0, now)
+    for _ in range(detector.window):
+        now += heartbeat_interval
+        detector.heartbeat(0, now)
+
+    silence = 0.0
+    while detector.phi(0, now + silence) <= phi_threshold:
+        silence += heartbeat_check_interval
+    return silence
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or partition_sizes
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+    channel = connection.channel()
+
+    detection = detection_time()
+    print(f"Обнаружение падения (одинаково для обоих режимов): phi > {phi_threshold} через {detection:.2f} с после последнего heartbeat")
+    print(f"{'строк':>8} {'RELOCATE, с':>12} {'PROMOTE -> PROMOTED, с':>22} {'фоновая новая реплика, с':>25}")
+    for size in sizes:
+        store = ColumnarStore()
+        store.append_rows(make_partition(size))
+
+        relocate_time, _ = timed(lambda: relocate(store))
+        promote_time = promote(connection, channel, size)
+        rebuild_pending = promote_offline(store)
+        rebuild_time, replica = timed(lambda: rebuild_replica(store, rebuild_pending))
+        assert replica.row_count() == size
+
+        print(f"{size:>8} {relocate_time:>12.3f} {promote_time:>22.3f} {rebuild_time:>25.3f}")
+
+
+if __name__ == "__main__":
+    main()
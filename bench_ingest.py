@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import json
+import pandas as pd
+
+from hashing import ConsistentHashing
+from ingest import convert_date, find_date_column, partition_rows
+
+from config import num_storages
+
+# Файлы, на которых сравниваем старый и новый путь загрузки
+bench_files = [
+    'data/seattle-weather.csv',
+    'data/testset.csv',
+    'data/weather.csv',
+    'data/weather_prediction_dataset.csv',
+]
+
+
+def legacy_prepare(data, consistent_hashing):
+    """Старый путь load_data: iterrows + convert_date + get_storage на каждую строку"""
+    date_column = find_date_column(data.columns)
+    messages = []
+
+    for _, row in data.iterrows():
+        date_parsed = convert_date(row[date_column])
+        row['date_parsed'] = date_parsed
+        storage_id = consistent_hashing.get_storage(date_parsed)
+
+        load_request = {'command': 'LOAD', 'data': row.to_dict()}
+        messages.append((storage_id, json.dumps(load_request)))
+
+    return messages
+
+
+def vectorized_prepare(data, consistent_hashing):
+    """Новый путь load_data: разбор по столбцам и группировка по хранителям"""
+    messages = []
+
+    for storage_id, rows in partition_rows(data, consistent_hashing).items():
+        for row in rows:
+            load_request = {'command': 'LOAD', 'data': row}
+            messages.append((storage_id, json.dumps(load_request)))
+
+    return messages
+
+
+def measure(prepare, data, consistent_hashing, repeats):
+    """Лучшее время из нескольких прогонов (публикация в RabbitMQ не входит в замер)"""
+    best = None
+    messages = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        messages = prepare(data, consistent_hashing)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, messages
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    consistent_hashing = ConsistentHashing(num_storages)
+
+    print(f"{'файл':<40} {'строк':>7} {'старый, строк/с':>16} {'новый, строк/с':>15} {'ускорение':>10}")
+    for file_path in bench_files:
+        if not os.path.exists(file_path):
+            print(f"{file_path:<40} файл не найден, пропускаю")
+            continue
+
+        data = pd.read_csv(file_path)
+        rows = len(data)
+
+        legacy_time, legacy_messages = measure(legacy_prepare, data, consistent_hashing, repeats)
+        new_time, new_messages = measure(vectorized_prepare, data, consistent_hashing, repeats)
+
+        # Проверяем, что каждый хранитель получает те же строки, что и раньше
+        legacy_routes = sorted((storage_id, json.loads(body)['data']['date_parsed']) for storage_id, body in legacy_messages)
+        new_routes = sorted((storage_id, json.loads(body)['data']['date_parsed']) for storage_id, body in new_messages)
+        if legacy_routes != new_routes:
+            print(f"[Ошибка] {file_path}: маршрутизация старого и нового пути не совпадает")
+
+        print(f"{file_path:<40} {rows:>7} {rows / legacy_time:>16.0f} {rows / new_time:>15.0f} {legacy_time / new_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
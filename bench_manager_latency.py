@@ -0,0 +1,119 @@
+import sys
+import json
+import time
+import subprocess
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+import pika
+
+try:
+    import aio_pika
+except ImportError:  # необязательная зависимость: без нее меряется только менеджер на pika
+    aio_pika = None
+
+from ingest import convert_date
+
+from config import durability
+
+# Нужен запущенный RabbitMQ и хранители (python ./storageNode.py); менеджеры бенчмарк запускает сам по очереди.
+# Асинхронному менеджеру нужен пакет aio-pika (pip install aio-pika)
+managers = {'pika + потоки': 'final_manager.py', 'asyncio': 'async_manager.py'}
+get_file = 'data/seattle-weather.csv'  # загружается заранее, GET идут по его датам
+load_file = 'data/weather.csv'  # загружается во время GET
+load_repeats = 3  # сколько раз подряд загружается load_file
+get_interval = 0.005  # секунд между GET
+manager_startup = 3.0  # секунд на запуск менеджера и первые heartbeat хранителей
+drain_timeout = 60.0  # сколько секунд после LOAD ждать ответов на уже отправленные GET (они стоят в очередях хранителей за пачками)
+
+
+def send(channel, command):
+    channel.basic_publish(exchange='', routing_key='manager_commands', body=json.dumps({'command': command, 'reply_to': 'client_responses'}))
+
+
+def wait_for_jobs(connection, channel, count, timeout=120.0):
+    """Ждет итоговых сообщений count заданий LOAD"""
+    finished = 0
+    deadline = time.time() + timeout
+    while finished < count and time.time() < deadline:
+        _, _, body = channel.basic_get(queue='client_responses', auto_ack=True)
+        if body is None:
+            connection.sleep(0.01)
+        elif 'job' in json.loads(body):
+            finished += 1
+    return finished == count
+
+
+def run_workload(manager_file, dates):
+    """Запускает менеджер, грузит get_file, затем шлет GET во время LOAD load_file. Возвращает задержки GET (мс) и время LOAD"""
+    process = subprocess.Popen([sys.executable, manager_file], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+        channel = connection.channel()
+        for queue in ['manager_commands', 'client_responses']:
+            channel.queue_declare(queue=queue, durable=durability)
+            channel.queue_purge(queue=queue)
+        connection.sleep(manager_startup)
+
+        send(channel, f'LOAD {get_file}')
+        if not wait_for_jobs(connection, channel, 1):
+            raise RuntimeError(f"{manager_file}: загрузка {get_file} не завершилась")
+
+        sent = defaultdict(deque)  # дата -> время отправки GET без ответа
+        latencies = []
+        loads_finished = 0
+        load_started = time.time()
+        load_seconds = None
+
+        def on_response(ch, method, properties, body):
+            nonlocal loads_finished, load_seconds
+            response = json.loads(body)
+            if 'job' in response:
+                loads_finished += 1
+                if loads_finished == load_repeats:
+                    load_seconds = time.time() - load_started
+            elif response.get('command') == 'GET' and sent[response.get('date')]:
+                latencies.append((time.perf_counter() - sent[response['date']].popleft()) * 1000)
+
+        channel.basic_consume(queue='client_responses', on_message_callback=on_response, auto_ack=True)
+        for _ in range(load_repeats):
+            send(channel, f'LOAD {load_file}')
+
+        # GET идут, пока все LOAD не завершатся; после ждем ответов на все отправленные GET (до drain_timeout),
+        # иначе самые медленные ответы не попали бы в перцентили
+        i = 0
+        while load_seconds is None and time.time() - load_started < 300:
+            date = dates[i % len(dates)]
+            sent[date].append(time.perf_counter())
+            send(channel, f'GET {date}')
+            connection.process_data_events(time_limit=get_interval)
+            i += 1
+        drain_started = time.time()
+        while any(sent.values()) and time.time() - drain_started < drain_timeout:
+            connection.process_data_events(time_limit=0.1)
+
+        connection.close()
+        return latencies, i, load_seconds
+
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    dates = [convert_date(date) for date in pd.read_csv(get_file)['date']]
+
+    print(f"{'менеджер':>16} {'GET':>6} {'ответов':>8} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} {'макс, мс':>9} {'LOAD, с':>8}")
+    for name, manager_file in managers.items():
+        if manager_file == 'async_manager.py' and aio_pika is None:
+            print(f"{name:>16} пропущен: нет пакета aio-pika (pip install aio-pika)")
+            continue
+        latencies, gets, load_seconds = run_workload(manager_file, dates)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (float('nan'),) * 3
+        load_text = f"{load_seconds:.2f}" if load_seconds is not None else '-'
+        print(f"{name:>16} {gets:>6} {len(latencies):>8} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} {max(latencies, default=float('nan')):>9.2f} {load_text:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import os
+import gc
+import json
+import tracemalloc
+import pandas as pd
+
+from hashing import ConsistentHashing
+from ingest import partition_rows
+from columnar_store import ColumnarStore
+
+from config import num_storages
+
+# Файлы, на которых сравниваем расход памяти хранителя
+bench_files = [
+    'data/seattle-weather.csv',
+    'data/testset.csv',
+    'data/weather.csv',
+    'data/weather_prediction_dataset.csv',
+]
+
+
+def encoded_rows(file_path):
+    """Строки файла в том виде, в каком они приходят хранителю (JSON на каждую строку)"""
+    data = pd.read_csv(file_path)
+    partitions = partition_rows(data, ConsistentHashing(num_storages))
+    return [json.dumps(row) for rows in partitions.values() for row in rows]
+
+
+def build_dict_store(bodies):
+    """Старое хранилище: словарь дата -> список словарей, у каждой строки свои имена столбцов"""
+    store = {}
+    for body in bodies:
+        row = json.loads(body)
+        store.setdefault(row['date_parsed'], []).append(row)
+    return store
+
+
+def build_columnar_store(bodies):
+    """Новое хранилище: столбцовые сегменты по схемам и индекс дата -> смещения"""
+    store = ColumnarStore()
+    for body in bodies:
+        store.append(json.loads(body))
+    return store
+
+
+def measure(build, bodies):
+    """Сколько байт остается занятым построенным хранилищем"""
+    gc.collect()
+    tracemalloc.start()
+    store = build(bodies)
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    return used
+
+
+def main():
+    print(f"{'файл':<40} {'строк':>7} {'dict, байт/строку':>18} {'столбцы, байт/строку':>21} {'экономия':>9}")
+    for file_path in bench_files:
+        if not os.path.exists(file_path):
+            print(f"{file_path:<40} файл не найден, пропускаю")
+            continue
+
+        bodies = encoded_rows(file_path)
+        rows = len(bodies)
+
+        dict_bytes = measure(build_dict_store, bodies)
+        columnar_bytes = measure(build_columnar_store, bodies)
+
+        print(f"{file_path:<40} {rows:>7} {dict_bytes / rows:>18.0f} {columnar_bytes / rows:>21.0f} {dict_bytes / columnar_bytes:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import sys
+import time
+import json
+import shutil
+import tempfile
+import pandas as pd
+from datetime import datetime, timedelta
+
+import segment_store
+from segment_store import DurableStore
+from columnar_store import ColumnarStore
+from hashing import ConsistentHashing
+from ingest import partition_rows
+
+from config import num_storages, batch_max_rows, chunk_size
+
+# Размеры раздела хранителя (строк), для которых меряем время перезапуска
+partition_sizes = [10000, 50000, 200000]
+source_file = 'data/weather.csv'
+
+
+def make_partition(size):
+    """Раздел нужного размера: строки исходного файла повторяются со сдвигом дат на год"""
+    base = [row for rows in partition_rows(pd.read_csv(source_file), ConsistentHashing(num_storages)).values() for row in rows]
+    result = []
+    shift = 0
+    while len(result) < size:
+        for row in base[:size - len(result)]:
+            row = dict(row)
+            date = datetime.strptime(row['date_parsed'], '%d-%m-%Y') + timedelta(days=365 * shift)
+            row['date_parsed'] = date.strftime('%d-%m-%Y')
+            result.append(row)
+        shift += 1
+    return result
+
+
+def timed(action):
+    started = time.perf_counter()
+    result = action()
+    return time.perf_counter() - started, result
+
+
+def relocate_baseline(store):
+    """Нижняя оценка RELOCATE без брокера: чанки по chunk_size дат в JSON и обратно в новое хранилище"""
+    target = ColumnarStore()
+    items = list(store.items())
+    for i in range(0, len(items), chunk_size):
+        body = json.dumps({'command': 'LOAD_2', 'data': dict(items[i:i + chunk_size])})
+        target.update(json.loads(body)['data'])
+    return target
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or partition_sizes
+
+    # Снимки в бенчмарке делаем вручную, чтобы отдельно померить журнал и снимок
+    segment_store.snapshot_every_records = float('inf')
+
+    print(f"{'строк':>8} {'запись журнала, с':>18} {'из журнала, с':>14} {'снимок, с':>10} {'из снимка, с':>13} {'RELOCATE без брокера, с':>24}")
+    for size in sizes:
+        rows = make_partition(size)
+        directory = tempfile.mkdtemp(prefix='bench_restart_')
+        try:
+            store = DurableStore(directory)
+            write_time, _ = timed(lambda: [store.append_rows(rows[i:i + batch_max_rows]) for i in range(0, len(rows), batch_max_rows)])
+            store.log_file.close()
+
+            replay_time, restored = timed(lambda: DurableStore(directory))
+            assert restored.row_count() == size
+            restored.log_file.close()
+
+            snapshot_time, _ = timed(restored.snapshot)
+            restored.log_file.close()
+
+            restart_time, restored = timed(lambda: DurableStore(directory))
+            assert restored.row_count() == size
+            restored.log_file.close()
+
+            relocate_time, _ = timed(lambda: relocate_baseline(restored))
+
+            print(f"{size:>8} {write_time:>18.3f} {replay_time:>14.3f} {snapshot_time:>10.3f} {restart_time:>13.3f} {relocate_time:>24.3f}")
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import sys
+import json
+import time
+import random
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from showcase import Showcase
+from hashing import ConsistentHashing
+from ingest import partition_rows, build_batches
+
+from config import num_storages, batch_max_rows, batch_max_bytes
+
+# Витрина без брокера, заполненная по дню с first_day по last_day; окна запросов: день, год, 20 лет
+first_day = datetime(1990, 1, 1)
+last_day = datetime(2019, 12, 31)
+windows = {'1 день': 1, '1 год': 365, '20 лет': 20 * 365 + 5}
+default_repeats = 200
+ingest_files = ['data/seattle-weather.csv', 'data/weather.csv', 'data/weather_prediction_dataset.csv']
+
+
+def filled_showcase():
+    random.seed(0)
+    showcase = Showcase(connect=False)
+    updates = []
+    day = first_day
+    while day <= last_day:
+        for _ in range(3):  # несколько значений за день, чтобы у дней было и среднее, и количество
+            updates.append((day, random.uniform(-20, 35), 1))
+        day += timedelta(days=1)
+    showcase.merge_updates(updates)
+    return showcase
+
+
+def old_temp_range_avg(showcase, start_date, end_date):
+    """Прежний путь: весь диапазон через get_temp_range (обход дат, strftime, словарь), потом среднее"""
+    temp_range = showcase.get_temp_range(start_date, end_date)
+    data = temp_range['data']
+    return round(sum(data.values()) / len(data), showcase.accuracy)
+
+
+def rollup_temp_range_avg(showcase, start_date, end_date):
+    """Среднее по сводкам: целые годы и месяцы из сводок, края - по дням"""
+    total, days = showcase.rollups.range_sum(datetime.strptime(start_date, '%d-%m-%Y'), datetime.strptime(end_date, '%d-%m-%Y'))
+    return round(total / days, showcase.accuracy)
+
+
+def per_query_ms(query, windows_start, days, repeats):
+    started = time.perf_counter()
+    result = None
+    for start in windows_start[:repeats]:
+        end = start + timedelta(days=days - 1)
+        result = query(start.strftime('%d-%m-%Y'), end.strftime('%d-%m-%Y'))
+    return (time.perf_counter() - started) / repeats * 1000, result
+
+
+def ingest_rows_per_second(file_path):
+    """Прием витриной пачек LOAD_BATCH в том виде, в каком их пересылают хранители (с разбором JSON)"""
+    partitions = partition_rows(pd.read_csv(file_path), ConsistentHashing(num_storages))
+    bodies = [body for rows in partitions.values() for body in build_batches(rows, batch_max_rows, batch_max_bytes)]
+    rows = sum(len(part) for part in partitions.values())
+
+    showcase = Showcase(connect=False)
+    started = time.perf_counter()
+    for body in bodies:
+        showcase.process_new_data(None, None, None, body)
+    return rows, rows / (time.perf_counter() - started)
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else default_repeats
+    showcase = filled_showcase()
+    print(f"Дней в витрине: {len(showcase.data)}, запросов на окно: {repeats}")
+    print(f"{'окно':>8} {'get_temp_range + среднее, мс':>29} {'сводки, мс':>11} {'индекс, мс':>11} {'ускорение':>10}")
+
+    for name, days in windows.items():
+        span = (last_day - first_day).days - days
+        random.seed(1)
+        starts = [first_day + timedelta(days=random.randint(0, span)) for _ in range(repeats)]
+
+        old_ms, old_result = per_query_ms(lambda d1, d2: old_temp_range_avg(showcase, d1, d2), starts, days, repeats)
+        rollup_ms, rollup_result = per_query_ms(lambda d1, d2: rollup_temp_range_avg(showcase, d1, d2), starts, days, repeats)
+        new_ms, new_result = per_query_ms(lambda d1, d2: showcase.get_temp_range_avg(d1, d2)['avg_temperature'], starts, days, repeats)
+        # Прежний путь усредняет уже округленные значения дней, поэтому допускаем расхождение в последнем знаке
+        assert abs(old_result - new_result) < 2 * 10 ** -showcase.accuracy, (old_result, new_result)
+        assert abs(rollup_result - new_result) < 2 * 10 ** -showcase.accuracy, (rollup_result, new_result)
+
+        print(f"{name:>8} {old_ms:>29.3f} {rollup_ms:>11.3f} {new_ms:>11.3f} {old_ms / new_ms:>9.1f}x")
+
+    # Размер ответа temp_range за 20 лет при разной детализации
+    start, end = '01-01-2000', '31-12-2019'
+    print(f"temp_range {start} {end}:")
+    for granularity in ('day', 'month', 'year'):
+        started = time.perf_counter()
+        response = showcase.get_temp_range(start, end, granularity)
+        seconds = time.perf_counter() - started
+        print(f"{granularity:>8}: {len(response['data'])} точек, {len(json.dumps(response))} байт, {seconds * 1000:.3f} мс")
+
+    print("Прием пачек LOAD_BATCH витриной:")
+    for file_path in ingest_files:
+        rows, speed = ingest_rows_per_second(file_path)
+        print(f"{file_path:>38}: {rows} строк, {speed:.0f} строк/с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import time
+import tracemalloc
+import pandas as pd
+import pika
+
+from hashing import ConsistentHashing
+from ingest import partition_rows
+from columnar_store import ColumnarStore
+from transfer import byte_chunks, encode_payload, decode_rows, available_codecs
+from bench_failover import start_process, start_replica, stop_node, wait_reply, bench_node_id, bench_queue
+
+from config import num_storages, chunk_size, durability
+
+# С --broker RELOCATE идет по-настоящему: процесс реплики раскладывает раздел по процессам хранителей через RabbitMQ
+# (хранители кластера не нужны, у хранителей бенчмарка свои номера)
+bench_storage_ids = [100 + i for i in range(num_storages - 1)]
+
+# Файлы с разной формой данных: мало столбцов и одна строка за дату / много строк за дату / широкие строки
+bench_files = [
+    'data/seattle-weather.csv',
+    'data/weather.csv',
+    'data/weather_prediction_dataset.csv',
+]
+
+
+def partition_store(file_path):
+    """Раздел одного хранителя, который реплика передает при RELOCATE"""
+    partitions = partition_rows(pd.read_csv(file_path), ConsistentHashing(num_storages))
+    store = ColumnarStore()
+    store.append_rows(partitions[0])
+    return store
+
+
+def old_chunks(store):
+    """Старый RELOCATE: весь раздел в список, порции по chunk_size дат несжатым JSON"""
+    items = list(store.items())
+    for i in range(0, len(items), chunk_size):
+        yield json.dumps({'command': 'LOAD_2', 'data': dict(items[i:i + chunk_size])})
+
+
+def new_chunks(store, codec):
+    """Новый RELOCATE: порции по transfer_chunk_bytes байт, сжатые согласованным кодеком"""
+    for chunk_id, payload in enumerate(byte_chunks(store, list(store.dates()))):
+        yield json.dumps({'command': 'LOAD_2', 'chunk_id': chunk_id, 'codec': codec, 'payload': encode_payload(payload, codec)})
+
+
+def measure(chunks, apply):
+    """Байт в сети, самая большая порция, пиковая память отправителя и время с применением на получателе"""
+    target = ColumnarStore()
+    total = largest = count = 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    for body in chunks:
+        total += len(body)
+        largest = max(largest, len(body))
+        count += 1
+        apply(target, json.loads(body))
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'bytes': total, 'largest': largest, 'chunks': count, 'peak': peak, 'seconds': seconds, 'rows': target.row_count()}
+
+
+def relocate(connection, channel, store):
+    """
+    RELOCATE через брокер: реплика с разделом store шлет порции хранителям бенчмарка и ждет подтверждений
+    (ChunkSender). Время - от отправки RELOCATE до отчетов реплики обо всех хранителях. Возвращает время, порции, повторы и строки у хранителей
+    """
+    ring = ConsistentHashing(0, weights={storage_id: 1 for storage_id in bench_storage_ids})
+    for storage_id in bench_storage_ids:
+        ring.add_storage(storage_id)
+        channel.queue_declare(queue=f'storage-{storage_id}', durable=durability)
+        channel.queue_purge(queue=f'storage-{storage_id}')
+    storages = [start_process(f'from storageNode import start_storage; start_storage({storage_id})') for storage_id in bench_storage_ids]
+    replica = start_replica(channel, bench_node_id, [row for date in store.dates() for row in store.get(date)])
+    try:
+        targets = len(set(ring.get_storage_many(list(store.dates())).tolist()))
+        request = {'command': 'RELOCATE', 'reply_to': bench_queue, 'storage_id': bench_storage_ids[0], **ring.to_message()}
+        started = time.perf_counter()
+        channel.basic_publish(exchange='', routing_key=f'replica-{bench_node_id}', body=json.dumps(request))
+        reports = []
+        while len(reports) < targets:
+            _, _, body = channel.basic_get(queue=bench_queue, auto_ack=True)
+            if body is None:
+                if time.perf_counter() - started > 120:
+                    raise RuntimeError(f"RELOCATE: за 120 с пришло {len(reports)} отчетов из {targets}")
+                connection.sleep(0.001)
+                continue
+            response = json.loads(body)
+            if response.get('queue_name') == f'replica-{bench_node_id}':  # отчеты хранителей о порциях пропускаем
+                reports.append(response['data'])
+        seconds = time.perf_counter() - started
+        replica.wait(timeout=30)  # после RELOCATE реплика завершается сама
+
+        # Строки, которые получили хранители: GET всех дат у их новых владельцев
+        dates = list(store.dates())
+        for date, owner in zip(dates, ring.get_storage_many(dates).tolist()):
+            channel.basic_publish(exchange='', routing_key=f'storage-{owner}',
+                                  body=json.dumps({'command': 'GET', 'date': date, 'reply_to': bench_queue}))
+        rows = 0
+        for _ in dates:
+            response, _ = wait_reply(connection, channel, 'GET')
+            rows += len(response['data']) if isinstance(response['data'], list) else 0
+        return seconds, reports, rows
+    finally:
+        stop_node(replica, [f'replica-{bench_node_id}'])
+        for storage_id, process in zip(bench_storage_ids, storages):
+            stop_node(process, [f'storage-{storage_id}'])
+            channel.queue_purge(queue=f'replica-{storage_id}')  # COPY_2 для реплик хранителей бенчмарка
+
+
+def main_broker():
+    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+    channel = connection.channel()
+    print(f"{'файл':<38} {'строк':>7} {'RELOCATE, с':>12} {'строк у хранителей':>19}")
+    for file_path in bench_files:
+        if not os.path.exists(file_path):
+            print(f"{file_path:<38} файл не найден, пропускаю")
+            continue
+
+        store = partition_store(file_path)
+        seconds, reports, rows = relocate(connection, channel, store)
+        assert rows == store.row_count()
+        print(f"{file_path:<38} {store.row_count():>7} {seconds:>12.3f} {rows:>19}")
+        for report in reports:
+            print(f"    {report}")
+
+
+def main():
+    if '--broker' in sys.argv[1:]:
+        main_broker()
+        return
+
+    print(f"{'файл':<38} {'способ':<14} {'порций':>7} {'байт в сети':>12} {'макс. порция':>13} {'пик памяти':>11} {'время, с':>9}")
+    for file_path in bench_files:
+        if not os.path.exists(file_path):
+            print(f"{file_path:<38} файл не найден, пропускаю")
+            continue
+
+        store = partition_store(file_path)
+        results = [('старый (JSON)', measure(old_chunks(store), lambda target, request: target.update(request['data'])))]
+        for codec in available_codecs():
+            results.append((f'новый ({codec})', measure(new_chunks(store, codec), lambda target, request: target.append_rows(decode_rows(request)))))
+
+        for name, result in results:
+            assert result['rows'] == store.row_count()
+            print(f"{file_path:<38} {name:<14} {result['chunks']:>7} {result['bytes']:>12} {result['largest']:>13} {result['peak']:>11} {result['seconds']:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
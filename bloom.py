@@ -0,0 +1,68 @@
+import math
+import base64
+import hashlib
+
+from config import bloom_capacity, bloom_error_rate
+
+
+class BloomFilter:
+    """
+    Фильтр Блума для множества дат хранителя. Размер и число хэш-функций зависят только от
+    capacity и error_rate, поэтому фильтры с одинаковыми параметрами можно объединять (merge).
+    """
+
+    def __init__(self, capacity=bloom_capacity, error_rate=bloom_error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0  # сколько ключей добавлено (с учетом повторов)
+
+    def _positions(self, key):
+        """Позиции битов ключа: двойное хэширование от одного blake2b"""
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        """False - ключа точно нет, True - ключ, возможно, есть"""
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def merge(self, other):
+        """Объединяет с фильтром с теми же параметрами (побитовое ИЛИ)"""
+        if other.num_bits != self.num_bits or other.num_hashes != self.num_hashes:
+            raise ValueError("Нельзя объединить фильтры Блума с разными параметрами")
+        merged = int.from_bytes(self.bits, 'little') | int.from_bytes(other.bits, 'little')
+        self.bits = bytearray(merged.to_bytes(len(self.bits), 'little'))
+        self.count = max(self.count, other.count)
+
+    def fill_ratio(self):
+        """Доля установленных битов"""
+        return bin(int.from_bytes(self.bits, 'little')).count('1') / self.num_bits
+
+    def estimated_false_positive_rate(self):
+        """Теоретическая вероятность ложного срабатывания при текущем заполнении"""
+        return self.fill_ratio() ** self.num_hashes
+
+    def to_message(self):
+        """Представление для передачи в JSON"""
+        return {
+            'capacity': self.capacity,
+            'error_rate': self.error_rate,
+            'count': self.count,
+            'bits': base64.b64encode(bytes(self.bits)).decode(),
+        }
+
+    @classmethod
+    def from_message(cls, message):
+        bloom = cls(message['capacity'], message['error_rate'])
+        bloom.bits = bytearray(base64.b64decode(message['bits']))
+        bloom.count = message['count']
+        return bloom
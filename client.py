@@ -18,7 +18,7 @@ def send_command_to_manager(command):
     
     connection.close()
 
-def send_command_to_showcase(command, date1, date2):
+def send_command_to_showcase(command, date1, date2, **extra):
     connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
     channel = connection.channel()
     
@@ -30,7 +30,8 @@ def send_command_to_showcase(command, date1, date2):
         'command': command,
         'date1': date1,
         'date2': date2,
-        'reply_to': 'client_responses'  # Указываем очередь для ответа
+        'reply_to': 'client_responses',  # Указываем очередь для ответа
+        **extra  # дополнительные параметры команды (granularity для temp_range, квантили для temp_range_quantile)
     }
 
     # Отправляем сообщение в очередь 'showcase_requests'
@@ -53,7 +54,26 @@ def listen_responses():
     def callback(ch, method, properties, body):
         response = json.loads(body)
 
-        if 'node_id' in response and 'queue_name' in response:
+        if response.get('command') == 'GET_RANGE':
+            print(f"[Клиент] Получен ответ от менеджера на GET_RANGE (хранители {response['nodes']}):")
+            if isinstance(response['data'], dict):
+                for date, rows in response['data'].items():
+                    print(f"{date}: {rows}")
+            else:
+                print(response['data'])
+            if response['timed_out']:
+                print(f"Не ответили хранители {response['timed_out']}, ответ может быть неполным")
+
+        elif response.get('command') == 'MGET':
+            print(f"[Клиент] Получен ответ от менеджера на MGET (хранители {response['nodes']}):")
+            for date, rows in response['data'].items():
+                print(f"{date}: {rows}")
+            print(f"Найдены: {response['found']}")
+            print(f"Не найдены: {response['missing']}")
+            if response['timed_out']:
+                print(f"Не ответили хранители {response['timed_out']}, нет данных о датах: {response['unavailable']}")
+
+        elif 'node_id' in response and 'queue_name' in response:
             print(f"[Клиент] Получен ответ от менеджера. Данные получены от хранителя с id = {response['node_id']} (queue_name = {response['queue_name']}): {response['data']}")
 
         elif 'from' in response:
@@ -74,6 +94,21 @@ def listen_responses():
                 for key, value in response['data'].items():
                     print(f"{key}: {value}")
 
+            elif response['from'] == 'showcase3':
+                print(f"min = {response['min']}, max = {response['max']}, среднее = {response['mean']} ({response['count']} значений)")
+
+            elif response['from'] == 'showcase5':
+                print(f"перестроена по хранителям {response['nodes']}: {response['days']} дат за {response['seconds']} с")
+                if response['removed']:
+                    print(f"Удалено дней, которых нет ни у одного хранителя: {response['removed']}")
+                if response['timed_out']:
+                    print(f"Не ответили хранители {response['timed_out']}, их даты могут быть неполными")
+
+            elif response['from'] == 'showcase4':
+                print(f"({response['count']} значений)")
+                for q, value in response['quantiles'].items():
+                    print(f"квантиль {q}: {value}")
+
             # elif response['from'] == 'showcase2':
             else:
                 print(f"{response['avg_temperature']}")
@@ -99,19 +134,23 @@ if __name__ == "__main__":
     listener_thread = threading.Thread(target=listen_responses, daemon=True)
     listener_thread.start()
     
-    print("[Клиент] Введите команды: LOAD [файл], GET [дата], KILL [nodeID], temp_range [date1 date2], temp_range_avg [date1 date2] EXIT")
+    print("[Клиент] Введите команды: LOAD [файл] [STREAM], JOBS, JOB [номер], CANCEL [номер], GET [дата], GET_RANGE [date1 date2], MGET [date1 date2 ...], JOIN [вес], KILL [nodeID], REBUILD, temp_range [date1 date2] [day/month/year], temp_range_avg [date1 date2], temp_range_stats [date1 date2], temp_range_quantile [date1 date2 q1 q2 ...] EXIT")
     while True:
         command = input("> ").strip()
         if command.upper() == "EXIT":
             print("[Клиент] Завершение работы.")
             break
         elif command.startswith("temp_range"):
-            parts = command.split(" ")
-            if len(parts) == 3:
+            parts = command.split()
+            if parts[0] == "temp_range_quantile" and len(parts) >= 4:
+                send_command_to_showcase(parts[0], parts[1], parts[2], quantiles=parts[3:])
+            elif parts[0] == "temp_range" and len(parts) == 4:
+                send_command_to_showcase(parts[0], parts[1], parts[2], granularity=parts[3].lower())
+            elif len(parts) == 3 and parts[0] != "temp_range_quantile":
                 start_date = parts[1]
                 end_date = parts[2]
                 send_command_to_showcase(parts[0], parts[1], parts[2])
             else:
-                print("Неверный формат команды. Используйте: temp_range/temp_range_avg дата1 дата2")
+                print("Неверный формат команды. Используйте: temp_range дата1 дата2 [day/month/year], temp_range_avg/temp_range_stats дата1 дата2 или temp_range_quantile дата1 дата2 квантиль1 [квантиль2 ...]")
         else:
             send_command_to_manager(command)
@@ -0,0 +1,248 @@
+from array import array
+from datetime import datetime
+from sortedcontainers import SortedDict
+
+# Упаковка ссылки на строку в одно число индекса: (номер схемы << offset_bits) | смещение строки
+offset_bits = 40
+offset_mask = (1 << offset_bits) - 1
+
+# Словарное кодирование невыгодно для почти уникальных значений (например, строк с датой):
+# после dictionary_check_rows значений столбец с долей уникальных выше порога хранится простым списком
+dictionary_check_rows = 1024
+dictionary_max_unique_ratio = 0.5
+
+
+class Column:
+    """
+    Один столбец схемы. Целые числа хранятся в array('q'), вещественные - в array('d'),
+    все остальное (строки, None, bool) - словарным кодированием: array('I') кодов + список значений,
+    а почти уникальные значения - простым списком.
+    Если в столбец приходит значение другого типа, столбец переводится в словарное кодирование.
+    """
+
+    def __init__(self):
+        self.kind = None  # 'q' - целые, 'd' - вещественные, 'o' - словарное кодирование, 'p' - список
+        self.values = None
+        self.dictionary = []  # для 'o': код -> значение
+        self.codes = {}  # для 'o': (тип, значение) -> код
+        self.nan_code = None  # NaN не равен сам себе, поэтому храним для него отдельный код
+
+    @classmethod
+    def from_parts(cls, kind, values, dictionary=None):
+        """Восстанавливает столбец из готового массива (и словаря для 'o'), например из снимка на диске"""
+        column = cls()
+        column.kind = kind
+        column.values = values
+        if kind == 'o':
+            column.dictionary = dictionary
+            for code, value in enumerate(dictionary):
+                if value != value:
+                    column.nan_code = code
+                else:
+                    column.codes[(type(value), value)] = code
+        return column
+
+    @staticmethod
+    def _kind_of(value):
+        if type(value) is int:
+            return 'q'
+        if type(value) is float:
+            return 'd'
+        return 'o'
+
+    def _encode(self, value):
+        """Возвращает код значения в словаре столбца, добавляя его при необходимости"""
+        if value != value:  # NaN
+            if self.nan_code is None:
+                self.nan_code = len(self.dictionary)
+                self.dictionary.append(value)
+            return self.nan_code
+
+        # Ключ с типом, чтобы 1, 1.0 и True не слились в одно значение
+        key = (type(value), value)
+        code = self.codes.get(key)
+        if code is None:
+            code = len(self.dictionary)
+            self.codes[key] = code
+            self.dictionary.append(value)
+        return code
+
+    def _to_dictionary(self):
+        """Переводит уже накопленные значения в словарное кодирование"""
+        old_values = self.values
+        self.kind = 'o'
+        self.values = array('I')
+        for value in old_values:
+            self.values.append(self._encode(value))
+
+    def _to_plain(self):
+        """Переводит словарно закодированный столбец в простой список значений"""
+        self.values = [self.dictionary[code] for code in self.values]
+        self.kind = 'p'
+        self.dictionary = []
+        self.codes = {}
+        self.nan_code = None
+
+    def append(self, value):
+        if self.kind is None:
+            self.kind = self._kind_of(value)
+            self.values = array('I') if self.kind == 'o' else array(self.kind)
+
+        if self.kind == 'p':
+            self.values.append(value)
+            return
+
+        if self.kind != 'o':
+            if self._kind_of(value) == self.kind:
+                try:
+                    self.values.append(value)
+                    return
+                except OverflowError:  # целое не помещается в 64 бита
+                    pass
+            self._to_dictionary()
+
+        self.values.append(self._encode(value))
+
+        if len(self.values) == dictionary_check_rows and len(self.dictionary) > dictionary_max_unique_ratio * dictionary_check_rows:
+            self._to_plain()
+
+    def get(self, offset):
+        if self.kind == 'o':
+            return self.dictionary[self.values[offset]]
+        return self.values[offset]
+
+
+class SchemaSegment:
+    """Строки одной схемы (одного набора и порядка столбцов), разложенные по столбцам"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.column_data = [Column() for _ in columns]
+        self.length = 0
+
+    def append(self, row):
+        """Добавляет строку и возвращает ее смещение в сегменте"""
+        for column, name in zip(self.column_data, self.columns):
+            column.append(row[name])
+        self.length += 1
+        return self.length - 1
+
+    def row(self, offset):
+        """Собирает строку обратно в словарь"""
+        return dict(zip(self.columns, [column.get(offset) for column in self.column_data]))
+
+
+class ColumnarStore:
+    """
+    Хранилище строк хранителя и реплики: по одному сегменту на схему исходного файла,
+    значения в типизированных массивах, индекс дата -> смещения строк.
+    Снаружи ведет себя как словарь {дата: список строк}; строки собираются только при чтении.
+    """
+
+    def __init__(self):
+        self.schema_ids = {}  # кортеж имен столбцов -> номер схемы
+        self.segments = []
+        self.index = {}  # дата -> array('q') упакованных ссылок на строки в порядке добавления
+        self.sorted_dates = SortedDict()  # порядковый номер дня -> дата, для запросов по диапазону
+        self.replacements = 0  # число замен и удалений дат
+        self.replaced = {}  # дата -> номер ее последней замены или удаления (для версий дат)
+
+    def append(self, row):
+        """Добавляет одну строку (дата берется из 'date_parsed')"""
+        columns = tuple(row)
+        schema_id = self.schema_ids.get(columns)
+        if schema_id is None:
+            schema_id = len(self.segments)
+            self.schema_ids[columns] = schema_id
+            self.segments.append(SchemaSegment(columns))
+
+        offset = self.segments[schema_id].append(row)
+
+        date = row['date_parsed']
+        refs = self.index.get(date)
+        if refs is None:
+            refs = self.index[date] = array('q')
+            self.add_sorted_date(date)
+        refs.append((schema_id << offset_bits) | offset)
+
+    def add_sorted_date(self, date):
+        """Добавляет дату в упорядоченный индекс (даты не в формате '%d-%m-%Y' в него не попадают)"""
+        try:
+            self.sorted_dates[datetime.strptime(date, '%d-%m-%Y').toordinal()] = date
+        except (TypeError, ValueError):
+            pass
+
+    def dates_in_range(self, start, end):
+        """Даты из хранилища в диапазоне [start, end] (datetime или date) по возрастанию, без обхода всего индекса"""
+        return [
+            date for date in self.sorted_dates.values()[
+                self.sorted_dates.bisect_left(start.toordinal()):self.sorted_dates.bisect_right(end.toordinal())
+            ]
+            if date in self.index
+        ]
+
+    def append_rows(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def get(self, date, default=None):
+        """Собирает строки за дату (или возвращает default, если даты нет)"""
+        refs = self.index.get(date)
+        if refs is None:
+            return default
+        return [self.segments[ref >> offset_bits].row(ref & offset_mask) for ref in refs]
+
+    def update(self, data):
+        """
+        Аналог dict.update для {дата: список строк}: строки за переданные даты заменяются.
+        Старые строки замененных дат остаются в сегментах, но из индекса больше не видны.
+        """
+        for date, rows in data.items():
+            self.index.pop(date, None)
+            self.mark_replaced(date)
+            self.append_rows(rows)
+
+    def remove_dates(self, dates):
+        """Убирает даты из индекса (их строки остаются в сегментах до уплотнения, как после update)"""
+        for date in dates:
+            self.index.pop(date, None)
+            self.mark_replaced(date)
+
+    def mark_replaced(self, date):
+        self.replacements += 1
+        self.replaced[date] = self.replacements
+
+    def dates(self):
+        return self.index.keys()
+
+    def items(self):
+        """Пары (дата, список строк); строки собираются по мере обхода"""
+        for date in list(self.index):
+            yield date, self.get(date)
+
+    def compacted(self):
+        """Новое хранилище только с видимыми строками (без замененных через update), в порядке индекса"""
+        store = ColumnarStore()
+        for _, rows in self.items():
+            store.append_rows(rows)
+        return store
+
+    def row_count(self):
+        return sum(len(refs) for refs in self.index.values())
+
+    def date_row_count(self, date):
+        """Сколько строк за дату (без сборки самих строк)"""
+        return len(self.index.get(date, ()))
+
+    def date_version(self, date):
+        """
+        Версия строк даты: (номер последней замены или удаления, число строк). Строки между заменами
+        только дописываются, поэтому одинаковая версия означает одинаковые строки
+        """
+        return self.replaced.get(date, 0), self.date_row_count(date)
+
+    def __contains__(self, date):
+        return date in self.index
+
+    def __len__(self):
+        return len(self.index)
@@ -1,12 +1,76 @@
 num_storages = 6
-# num_vnodes = 1
+num_vnodes = 256 # количество виртуальных узлов на кольце для каждого хранителя (с весом 1)
+storage_weights = {} # веса хранителей {id: вес}, хранитель с весом 2 получает вдвое больше виртуальных узлов
 print_each_step = False
 durability = False
 hash_prefix = 'storage-'
 
-ping_interval = 0.3 # секунд
-max_retries = 5  # количество пингов, после которых считаем, что хранитель умер
+heartbeat_interval = 0.3 # секунд между heartbeat, которые хранители сами отправляют менеджеру
+heartbeat_check_interval = 0.1 # секунд между проверками подозрения (phi) по всем хранителям
+phi_threshold = 8.0 # при каком phi хранитель считается упавшим (8 - вероятность ошибки около 10^-8)
+phi_window = 100 # сколько последних интервалов между heartbeat учитывает детектор
+phi_min_std = 0.1 # нижняя граница разброса интервалов (секунд), чтобы ровные heartbeat не делали детектор слишком чувствительным
+heartbeat_acceptable_pause = 0.5 # секунд задержки heartbeat сверх обычного интервала, которые не вызывают подозрения (паузы GC, пики нагрузки)
+main_loop_stall_timeout = 15.0 # секунд без хода основного цикла хранителя, после которых его поток heartbeat завершает процесс (дальше - обычное обнаружение по phi); больше replication_wait_timeout
 print_only_if_dead = True
 
 print_every_chunk = False
 chunk_size = 200
+
+batch_max_rows = 500 # максимальное количество строк в одном сообщении LOAD_BATCH
+batch_max_bytes = 512 * 1024 # максимальный размер тела сообщения LOAD_BATCH в байтах
+
+stream_chunk_rows = 5000 # сколько строк CSV читаем за раз в потоковом режиме LOAD <файл> STREAM
+stream_queue_threshold = 200 # длина очереди хранителя (сообщений), после которой потоковая загрузка притормаживает
+stream_backoff_interval = 0.05 # секунд ожидания перед повторной проверкой длины очереди
+
+route_cache_size = 100000 # сколько маршрутов ключ -> хранитель кэширует ConsistentHashing
+
+persistence_enabled = False # сохранять ли данные хранителей и реплик на диск (журнал + снимки) для быстрого перезапуска
+persistence_dir = 'node_data' # каталог, в котором у каждого узла своя папка с журналом и снимком
+snapshot_every_records = 500 # через сколько записей в журнал делать уплотненный снимок
+persistence_fsync = False # вызывать ли fsync после каждой записи в журнал (надежнее, но медленнее)
+
+request_timeout = 5.0 # секунд ожидания ответов хранителей на GET_RANGE / MGET, после чего клиент получает собранное
+
+bloom_enabled = True # вести ли на хранителях фильтры Блума по датам, чтобы менеджер сам отвечал на GET заведомо отсутствующих дат
+bloom_capacity = 20000 # на сколько дат у одного хранителя рассчитан фильтр
+bloom_error_rate = 0.01 # допустимая доля ложных срабатываний при заполнении до bloom_capacity
+
+replication_batch_rows = 500 # сколько строк копится в буфере репликации хранителя перед отправкой реплике
+replication_flush_interval = 0.05 # секунд, через которые буфер репликации отправляется, даже если не заполнен
+replication_max_lag_rows = 20000 # больше стольких неподтвержденных репликой строк хранитель ждет подтверждений
+replication_resend_timeout = 2.0 # секунд без подтверждения, после которых пачки репликации отправляются заново
+replication_wait_timeout = 5.0 # сколько секунд хранитель ждет подтверждений при превышении replication_max_lag_rows
+
+replica_reads = 'least_outstanding' # куда отправлять GET: 'off' - только хранителю, 'round_robin' - по очереди хранителю и реплике, 'least_outstanding' - тому, у кого меньше GET без ответа
+replica_read_max_lag_rows = None # если задано, реплика читается только при отставании не больше стольких строк (None - без проверки)
+
+get_cache_size = 10000 # сколько ответов GET хранит кэш менеджера (вытесняется давно не читанный)
+get_cache_ttl = 30.0 # сколько секунд ответ GET живет в кэше менеджера, даже если дата не менялась
+cache_change_heartbeats = 5 # в скольких heartbeat подряд хранитель повторяет измененные даты (пропуск меньшего числа heartbeat не сбрасывает кэш целиком)
+
+failover_mode = 'promote' # что делать при падении хранителя: 'promote' - реплика занимает его место на кольце, 'relocate' - реплика раздает данные соседям по кольцу
+promotion_timeout = 10.0 # секунд ожидания подтверждения от повышаемой реплики, после чего хранитель убирается с кольца
+
+migration_step_interval = 0.01 # секунд между порциями (по chunk_size дат), которыми хранитель отдает даты новому хранителю после JOIN
+migration_timeout = 60.0 # секунд ожидания, пока все хранители передадут даты новому, после чего менеджер переключается на новое кольцо
+migration_fence_interval = 0.01 # секунд между проверками, закончили ли задания LOAD порции, начатые по старому кольцу, прежде чем отправить MIGRATE_DONE
+
+transfer_chunk_bytes = 256 * 1024 # размер порции (байт JSON до сжатия) при передаче данных реплики хранителям (RELOCATE / LOAD_2 / COPY_2)
+transfer_codecs = ['zstd', 'zlib', 'none'] # кодеки сжатия порций в порядке предпочтения (zstd - если установлен zstandard)
+transfer_window = 4 # сколько порций может быть отправлено и еще не подтверждено
+transfer_ack_timeout = 2.0 # секунд без подтверждения, после которых порция отправляется заново
+transfer_max_retries = 5 # сколько раз повторять порцию, прежде чем прервать передачу
+
+anti_entropy_enabled = True # сверять ли хранителя с репликой по дереву хэшей в фоне
+anti_entropy_interval = 30.0 # секунд между раундами сверки хранителя с репликой
+anti_entropy_timeout = 10.0 # секунд ожидания ответов реплики, после чего раунд сверки прерывается
+merkle_buckets = 1024 # количество корзин дат (листьев дерева хэшей), округляется вверх до степени двойки
+
+digest_compression = 100 # сжатие t-digest в дереве отрезков витрины (temp_range_stats / temp_range_quantile): больше - точнее квантили, но крупнее узлы
+
+showcase_persistence_enabled = persistence_enabled # сохранять ли витрину на диск (журнал пачек + периодические снимки скетчей дней), чтобы после перезапуска она не была пустой; по умолчанию - вместе с хранителями, иначе повторный LOAD после перезапуска посчитает дни витрины дважды
+showcase_snapshot_interval = 30.0 # секунд между снимками витрины (если с прошлого снимка в журнал что-то писалось)
+showcase_rebuild_timeout = 60.0 # секунд, за которые все хранители должны прислать витрине свои даты при REBUILD, после чего витрина сообщает, кто не ответил
+rebuild_step_interval = 0.01 # секунд между порциями (по chunk_size дат), которыми хранитель отдает витрине скетчи дат при REBUILD
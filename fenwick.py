@@ -0,0 +1,77 @@
+class FenwickIndex:
+    """
+    Деревья Фенвика (префиксных сумм) по порядковому номеру дня: по каждому полю - сумма значений дней
+    от начала до любого дня за O(log n), поэтому сумма, количество и среднее по диапазону считаются
+    за O(log n) без обхода дат. Индекс покрывает дни [base, base + size) и при выходе даты за границы
+    перестраивается с запасом вдвое за O(n) по хранимым значениям дней.
+    """
+
+    def __init__(self, fields, size=1 << 12):
+        self.fields = list(fields)
+        self.base = None  # порядковый номер первого дня (date.toordinal())
+        self.size = size
+        # Списки, а не массивы numpy: обновление - это O(log n) отдельных сложений, а на скалярах списки быстрее
+        self.values = {field: [0.0] * size for field in self.fields}  # значения по дням
+        self.trees = {field: [0.0] * (size + 1) for field in self.fields}  # деревья, индексы с 1
+
+    def ensure(self, ordinal):
+        """Расширяет индекс так, чтобы день ordinal в него попадал"""
+        if self.base is None:
+            self.base = ordinal - self.size // 2
+        if self.base <= ordinal < self.base + self.size:
+            return
+
+        low = min(self.base, ordinal)
+        high = max(self.base + self.size, ordinal + 1)
+        size = self.size
+        while size < 2 * (high - low):
+            size *= 2
+        base = low - (size - (high - low)) // 2
+
+        shift = self.base - base
+        for field in self.fields:
+            values = [0.0] * size
+            values[shift:shift + self.size] = self.values[field]
+            self.values[field] = values
+        self.base, self.size = base, size
+        self.rebuild()
+
+    def rebuild(self):
+        """Построение деревьев за O(n): каждый узел прибавляет свою сумму к родителю"""
+        for field in self.fields:
+            tree = [0.0] + self.values[field]
+            for i in range(1, self.size + 1):
+                parent = i + (i & -i)
+                if parent <= self.size:
+                    tree[parent] += tree[i]
+            self.trees[field] = tree
+
+    def add(self, ordinal, **deltas):
+        """Прибавляет к значениям дня ordinal: add(ordinal, avg=0.5, days=1)"""
+        self.ensure(ordinal)
+        position = ordinal - self.base + 1
+        for field, delta in deltas.items():
+            self.values[field][position - 1] += delta
+            tree = self.trees[field]
+            i = position
+            while i <= self.size:
+                tree[i] += delta
+                i += i & -i
+
+    def prefix(self, field, ordinal):
+        """Сумма поля по дням до ordinal включительно"""
+        if self.base is None or ordinal < self.base:
+            return 0.0
+        i = min(ordinal - self.base + 1, self.size)
+        tree = self.trees[field]
+        total = 0.0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def range_sum(self, field, first, last):
+        """Сумма поля по дням [first, last]"""
+        if last < first:
+            return 0.0
+        return self.prefix(field, last) - self.prefix(field, first - 1)
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import threading
 import time
 import numpy as np
@@ -6,50 +6,83 @@ import pandas as pd
 import pika
 import json
 import sys
+import uuid
+import itertools
+import multiprocessing
+from collections import Counter
 from hashing import ConsistentHashing
+from ingest import convert_date, partition_rows, group_rows, build_batches
+from bloom import BloomFilter
+from get_cache import GetCache
+from heartbeat import PhiAccrualDetector
+from jobs import LoadJob
+from storageNode import start_storage, run_replica
+
+from config import num_storages, num_vnodes, print_each_step, durability, print_only_if_dead, hash_prefix
+from config import heartbeat_check_interval, phi_threshold, main_loop_stall_timeout
+from config import request_timeout, replica_reads, replica_read_max_lag_rows, failover_mode, promotion_timeout, migration_timeout, migration_fence_interval
+from config import batch_max_rows, batch_max_bytes, stream_chunk_rows, stream_queue_threshold, stream_backoff_interval
 
-from config import num_storages, print_each_step, durability, ping_interval, max_retries, print_only_if_dead, hash_prefix
+class StorageManager:
+    def __init__(self, num_storages, num_vnodes=num_vnodes):
+        self.num_storages = num_storages
+        self.num_vnodes = num_vnodes
+        self.consistent_hashing = ConsistentHashing(num_storages, num_vnodes)
 
-def convert_date(date_str):
 
-    # Третий формат: 20000120 (годмесяцдень)
-    try:
-        date_str = str(int(date_str))  # Преобразуем в строку, отбрасывая десятичную часть
-        return datetime.strptime(date_str, "%Y%m%d").strftime("%d-%m-%Y")
-    except ValueError:
-        pass
+        # Детектор отказов по heartbeat, которые хранители присылают сами (phi-accrual)
+        self.detector = PhiAccrualDetector()
+        for storage_id in range(num_storages):
+            self.detector.register(storage_id)
 
-    # Первый формат: 2012-01-31 (год-месяц-число)
-    try:
-        return datetime.strptime(date_str, "%Y-%m-%d").strftime("%d-%m-%Y")
-    except ValueError:
-        pass
+        # Поток heartbeat хранителя жив и при зависшем основном цикле: по отметке его хода (progress) в heartbeat.
+        # Зависший дольше main_loop_stall_timeout хранитель завершается сам, и его место занимают по phi, когда heartbeat прекратятся
+        self.main_loop_stalls = {} # id хранителя -> на сколько секунд отметка отставала от отправки последнего heartbeat
+        self.stall_reported = set() # хранители, о зависании которых уже предупредили
 
-    # Второй формат: 19970527-15:00 (годмесяцдень-время)
-    try:
-        return datetime.strptime(date_str.split('-')[0], "%Y%m%d").strftime("%d-%m-%Y")
-    except ValueError:
-        pass
+        self.lock = threading.Lock()
 
-    # Если не удается распознать формат
-    return None
+        # Подключение к RabbitMQ
+        self.connect()
 
-class StorageManager:
-    def __init__(self, num_storages, num_vnodes=3):
-        self.num_storages = num_storages
-        self.num_vnodes = num_vnodes
-        self.consistent_hashing = ConsistentHashing(num_storages)
+        self.bloom_filters = {} # id хранителя -> копия его фильтра Блума по датам (нет копии - спрашиваем хранителя)
+        # gets - всего GET, short_circuited - ответили сами без похода к хранителю,
+        # forwarded - фильтр ответил "возможно есть" и запрос ушел хранителю, forwarded_misses - из них хранитель ответил,
+        # что данных нет (ложное срабатывание фильтра), unfiltered - у менеджера еще нет фильтра хранителя
+        self.bloom_stats = {'gets': 0, 'short_circuited': 0, 'forwarded': 0, 'forwarded_misses': 0, 'unfiltered': 0}
+        self.bloom_forwarded = Counter() # даты GET, пропущенных фильтром к хранителю и еще не получивших ответ
 
+        self.get_cache = GetCache() # ответы хранителей на GET, сбрасываются по версиям дат из heartbeat
 
-        self.pending_pings = {}
-        self.failed_pings = {}  # Storages, которые не ответили на пинг
+        self.replication_status = {} # id хранителя -> состояние его репликации из последнего heartbeat
+        self.outstanding_gets = Counter() # очередь (storage-N / replica-N) -> сколько GET отправлено и еще без ответа
+        self.read_round_robin = Counter() # id хранителя -> счетчик для чередования хранитель/реплика
+        self.replica_read_stats = {'primary': 0, 'replica': 0}
 
-        self.ping_interval = ping_interval
-        # self.retry_interval = 1  # Интервал повторных пингов
-        self.max_retries = max_retries  # Максимальное количество попыток повторного пинга
-        self.lock = threading.Lock()
+        self.promoting = {} # id хранителя -> когда его реплике отправлен PROMOTE (ждем подтверждения PROMOTED)
+        self.promotion_epochs = Counter() # id хранителя -> сколько раз его реплика уже повышалась
+        self.replica_rebuilding = set() # хранители, чья новая реплика еще строится (читать из нее нельзя)
+        self.failovers = [] # завершенные повышения реплик: кто и за сколько секунд
 
-        # Подключение к RabbitMQ
+        self.migration = None # текущий JOIN: новый хранитель, кольцо с ним и хранители, еще не передавшие ему даты
+        self.joins = [] # завершенные JOIN: кто, за сколько секунд и сколько строк переехало
+        # Номер состава кольца растет при каждом его изменении (JOIN, падение хранителя). Задания LOAD сверяют его
+        # перед каждой порцией строк, а JOIN отправляет MIGRATE_DONE, только когда порций старых номеров не осталось
+        self.ring_epoch = 0
+        self.job_slices = Counter() # номер кольца -> сколько порций по нему задания отправляют прямо сейчас
+
+        self.jobs = {} # номер задания -> LoadJob (фоновые LOAD)
+        self.job_ids = itertools.count(1)
+
+        self.pending_requests = {} # request_id -> незавершенный GET_RANGE / MGET (какие хранители еще не ответили и собранные данные)
+
+        self.live_storages = set(range(num_storages))  # Живые хранители
+        self.dead_storages = set()  # Упавшие хранители
+        
+        self.start_background()
+
+    def connect(self):
+        """Подключение к RabbitMQ и объявление очередей менеджера"""
         self.connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
         self.channel = self.connection.channel()
 
@@ -57,7 +90,7 @@ class StorageManager:
         self.channel.queue_declare(queue='manager_commands', durable=durability) # Очередь для запросов клиентов (просматриваем менеджером)
         self.channel.queue_declare(queue='client_responses', durable=durability) # Очередь для публикации ответов менеджера клиенту (отправляем менеджером, просматриваем клиентом)
 
-        self.channel.queue_declare(queue='manager_pings', durable=durability) # Очередь для ответов хранителей на команду PING (просматриваем менеджером)
+        self.channel.queue_declare(queue='manager_heartbeats', durable=durability) # Очередь heartbeat хранителей (просматриваем менеджером в отдельном потоке)
 
         self.channel.queue_declare(queue='showcase_data', durable=durability) # Очередь для передачи данных на процесс-витрину
 
@@ -66,172 +99,727 @@ class StorageManager:
             queue_name = f"storage-{i}"
             self.channel.queue_declare(queue=queue_name, durable=durability) # Очередь для отправки хранителям запросов (отправляем менеджером, просматриваем хранителями)
 
-        self.live_storages = set(range(num_storages))  # Живые хранители
-        self.dead_storages = set()  # Упавшие хранители
-        
-        # Запуск фонового потока пинга
-        self.ping_thread = threading.Thread(target=self.ping_storages, daemon=True)
-        self.ping_thread.start()
+    def start_background(self):
+        """Фоновые потоки менеджера: проверка подозрений по heartbeat и прием heartbeat"""
+        # Запуск фонового потока проверки подозрений по heartbeat
+        self.detector_thread = threading.Thread(target=self.watch_storages, daemon=True)
+        self.detector_thread.start()
 
-        # Запуск прослушивания очереди ответов на пинги
-        self.ping_listener_thread = threading.Thread(target=self.listen_ping_responses, daemon=True)
-        self.ping_listener_thread.start()
+        # Запуск прослушивания очереди heartbeat
+        self.heartbeat_listener_thread = threading.Thread(target=self.listen_heartbeats, daemon=True)
+        self.heartbeat_listener_thread.start()
 
-    def ping_storages(self):
-        """Периодически проверяет, живы ли хранители (в отдельном потоке)"""
+    def watch_storages(self):
+        """Раз в heartbeat_check_interval считает phi каждого живого хранителя (в отдельном потоке)"""
         try:
             connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
             channel = connection.channel()
 
-            with self.lock:
-                self.failed_pings = {storage: 0 for storage in range(self.num_storages)}
-
             while True:
-                with self.lock:
-                    self.pending_pings = {storage: time.time() for storage in self.live_storages.union(self.dead_storages)}
-                for storage_id in range(self.num_storages):
-                    if storage_id in self.dead_storages:
-                        continue  # Не пингуем, если хранитель уже упал
+                connection.sleep(heartbeat_check_interval)
+                self.check_storages(channel)
 
-                    request = {'command': 'PING', 'reply_to': 'manager_pings'}
-                    channel.basic_publish(exchange='', routing_key=f'storage-{storage_id}', body=json.dumps(request))
+        except Exception as e:
+            print(f"[Ошибка] в watch_storages: {e}")
 
-                time.sleep(self.ping_interval)  # Периодичность пинга
+    def check_storages(self, channel):
+        """Одна проверка: хранители с phi выше порога и реплики, не подтвердившие повышение за promotion_timeout"""
+        now = time.time()
 
-                self.check_pending_pings(channel)
+        with self.lock:
+            suspects = []
+            for storage_id in self.live_storages:
+                if storage_id in self.promoting: # реплика занимает место хранителя, до ее подтверждения не проверяем
+                    if now - self.promoting[storage_id] > promotion_timeout:
+                        suspects.append(storage_id)
+                elif self.detector.phi(storage_id, now) > phi_threshold:
+                    suspects.append(storage_id)
+
+        for storage_id in suspects:
+            if storage_id in self.promoting:
+                self.promotion_failed(storage_id)
+            else:
+                self.on_storage_failed(channel, storage_id)
 
-        except Exception as e:
-            print(f"[Ошибка] в ping_storages: {e}")
+    def on_storage_failed(self, channel, storage_id):
+        """Хранитель перестал присылать heartbeat: повышаем его реплику или раздаем ее данные соседям"""
+        last_seen = self.detector.last_seen(storage_id)
+        print(f"[Менеджер] Хранитель {storage_id} не присылает heartbeat {time.time() - last_seen:.2f} с (phi > {phi_threshold})")
 
-    def check_pending_pings(self, channel):
-        """Проверка, какие хранители не ответили на PING"""
-        for storage_id in list(self.pending_pings.keys()):
-            if self.failed_pings[storage_id] < self.max_retries: # очередной раз не было ответа на PING
-                with self.lock:
-                    self.failed_pings[storage_id] += 1
-                    print(f"[Менеджер] Хранитель {storage_id} не отправил ответ на PING ({self.failed_pings[storage_id]}/{self.max_retries}) раз")
+        if failover_mode == 'promote':
+            self.promote_replica(channel, storage_id)
+            return
 
-                if self.failed_pings[storage_id] >= self.max_retries: # логика кода если хранитель "умер"
-                    self.mark_storage_dead(storage_id)
-                    print(f"Хранитель {storage_id} был отмечен как 'dead' после {self.max_retries} неудачных попыток")
+        self.mark_storage_dead(storage_id)
 
-                    # удаляем из круга и ключей в consistent hashing
-                    self.consistent_hashing.remove_storage(storage_id)
+        # удаляем из круга и ключей в consistent hashing
+        with self.lock:
+            self.consistent_hashing.remove_storage(storage_id)
+            self.ring_epoch += 1
 
-                    # определярем в consistent hashing id следующего хранителя по хешу умершего хранителя
-                    relocation_storage_id = self.consistent_hashing.get_storage(f'{hash_prefix}{storage_id}')
+        # определярем в consistent hashing id следующего хранителя по хешу умершего хранителя
+        relocation_storage_id = self.consistent_hashing.get_storage(f'{hash_prefix}{storage_id}')
 
-                    # отправляем команду на релоцирование данных реплике умершего хранителя
-                    request = {'command': 'RELOCATE', 'reply_to': 'manager_responses', 'storage_id': relocation_storage_id}
-                    channel.basic_publish(exchange='', routing_key=f'replica-{storage_id}', body=json.dumps(request))
+        # с виртуальными узлами дуги умершего хранителя расходятся по разным соседям,
+        # поэтому передаем реплике состав кольца - она сама разложит даты по новым владельцам
+        request = {'command': 'RELOCATE', 'reply_to': 'manager_responses', 'storage_id': relocation_storage_id,
+                   **self.consistent_hashing.to_message()}
+        channel.basic_publish(exchange='', routing_key=f'replica-{storage_id}', body=json.dumps(request))
 
-                    print(f"[Менеджер] Отправил запрос на релоцирование реплике {storage_id}")
+        print(f"[Менеджер] Отправил запрос на релоцирование реплике {storage_id}")
 
-            else:
-                # print("NOT SUPPOSED TO BE HERE")
-                # self.mark_storage_dead(storage_id)
-                if not print_only_if_dead:
-                    print(f"Хранитель {storage_id} был отмечен как 'dead' после {self.max_retries} неудачных попыток")
+    def promote_replica(self, channel, storage_id):
+        """
+        Переключение на реплику: она остается на месте хранителя на кольце и начинает разбирать очередь storage-N,
+        поэтому данные никуда не переезжают. Запросы, пришедшие за время переключения, ждут в очереди storage-N.
+        """
+        with self.lock:
+            self.get_cache.invalidate_storage(storage_id) # реплика могла не получить последних строк хранителя
+            self.promoting[storage_id] = time.time()
+            self.replica_rebuilding.add(storage_id)
+            self.promotion_epochs[storage_id] += 1
+
+        request = {'command': 'PROMOTE', 'reply_to': 'manager_responses', 'epoch': self.promotion_epochs[storage_id]}
+        channel.basic_publish(exchange='', routing_key=f'replica-{storage_id}', body=json.dumps(request))
+        print(f"[Менеджер] Хранитель {storage_id} не отвечает, повышаю его реплику до хранителя")
+
+    def promotion_failed(self, storage_id):
+        """Реплика не подтвердила повышение за promotion_timeout: раздел потерян, убираем хранителя с кольца"""
+        with self.lock:
+            del self.promoting[storage_id]
+            self.replica_rebuilding.discard(storage_id)
+        self.mark_storage_dead(storage_id)
+        with self.lock:
+            self.consistent_hashing.remove_storage(storage_id)
+            self.ring_epoch += 1
+        print(f"[Менеджер] Реплика {storage_id} не подтвердила повышение за {promotion_timeout} с, хранитель убран с кольца")
+
+    def on_promoted(self, response):
+        """Реплика заняла место хранителя и отвечает из storage-N"""
+        storage_id = response['node_id']
+        with self.lock:
+            started = self.promoting.pop(storage_id, None)
+            self.detector.register(storage_id) # история heartbeat упавшего процесса к новому отношения не имеет
+        if started is None:
+            return
+
+        # Время от решения о переключении до готовности отвечать; обнаружение падения добавляет время до превышения phi_threshold
+        seconds = round(time.time() - started, 3)
+        self.failovers.append({'storage_id': storage_id, 'mode': 'promote', 'seconds': seconds, 'rows': response['rows']})
+        print(f"[Менеджер] Реплика {storage_id} стала хранителем за {seconds} с ({response['rows']} строк), новая реплика строится в фоне")
+
+    def join_storage(self, weight=1):
+        """
+        Добавляет хранителя (и его реплику) на ходу. Пока прежние владельцы передают ему даты его дуг,
+        чтение и запись идут по старому кольцу; после того как все передали - менеджер переключается на новое.
+        """
+        if self.migration is not None:
+            return {"status": "ERROR", "message": f"JOIN хранителя {self.migration['storage_id']} еще не завершен"}
+
+        storage_id = self.num_storages
+
+        # Очереди нужны до запуска узлов: прежние владельцы начнут слать в них даты сразу
+        self.channel.queue_declare(queue=f'storage-{storage_id}', durable=durability)
+        self.channel.queue_declare(queue=f'replica-{storage_id}', durable=durability)
+
+        # spawn, а не fork: у менеджера уже работают потоки и открыты соединения
+        context = multiprocessing.get_context('spawn')
+        context.Process(target=run_replica, args=(storage_id,)).start()
+        storage_process = context.Process(target=start_storage, args=(storage_id,), name=f"StorageNode_{storage_id}")
+        storage_process.start()
+
+        ring = ConsistentHashing.from_message(self.consistent_hashing.to_message())
+        ring.weights[storage_id] = weight
+        ring.add_storage(storage_id)
+
+        owners = sorted(self.live_storages)
+        self.migration = {'storage_id': storage_id, 'ring': ring, 'owners': owners, 'waiting': set(owners), 'rows': 0, 'started': time.time()}
+
+        request = {'command': 'MIGRATE', 'target': storage_id, 'reply_to': 'manager_responses', **ring.to_message()}
+        for owner in owners:
+            self.channel.basic_publish(exchange='', routing_key=f'storage-{owner}', body=json.dumps(request))
+        self.connection.call_later(migration_timeout, lambda: self.finish_join(storage_id))
+
+        print(f"[Менеджер] Запущен хранитель {storage_id} (PID = {storage_process.pid}), хранители {owners} передают ему даты")
+        return {"status": "OK", "message": f"Хранитель {storage_id} запущен (PID = {storage_process.pid}), идет передача данных"}
+
+    def on_migrated(self, response):
+        """Прежний владелец передал новому хранителю все его даты"""
+        migration = self.migration
+        if migration is None or response['target'] != migration['storage_id']:
+            return
+
+        migration['waiting'].discard(response['node_id'])
+        migration['rows'] += response['rows']
+        if not migration['waiting']:
+            self.finish_join(migration['storage_id'])
+
+    def finish_join(self, storage_id):
+        """Переключение на новое кольцо; прежние владельцы после этого удаляют у себя переехавшие даты"""
+        migration = self.migration
+        if migration is None or migration['storage_id'] != storage_id:
+            return
+        self.migration = None
+
+        if migration['waiting']:
+            print(f"[Менеджер] Хранители {sorted(migration['waiting'])} не завершили передачу за {migration_timeout} с, часть их дат может быть недоступна")
+
+        with self.lock:
+            for dead_storage in self.dead_storages: # упавшие за время передачи уже убраны со старого кольца
+                migration['ring'].remove_storage(dead_storage)
+            self.consistent_hashing = migration['ring']
+            self.ring_epoch += 1
+            self.detector.register(storage_id)
+            self.live_storages.add(storage_id)
+            self.num_storages = max(self.num_storages, storage_id + 1)
+
+        self.send_migrate_done(migration['owners'], self.ring_epoch)
+
+        seconds = round(time.time() - migration['started'], 3)
+        self.joins.append({'storage_id': storage_id, 'seconds': seconds, 'rows': migration['rows']})
+        print(f"[Менеджер] Хранитель {storage_id} добавлен на кольцо: переехало {migration['rows']} строк за {seconds} с")
+
+        response = {"status": "OK", "message": f"Хранитель {storage_id} добавлен на кольцо, к нему переехало {migration['rows']} строк"}
+        self.channel.basic_publish(exchange='', routing_key='client_responses', body=json.dumps(response))
+
+    def send_migrate_done(self, owners, epoch):
+        """
+        MIGRATE_DONE прежним владельцам. Задание LOAD, начавшее порцию до переключения, отправляет ее строки
+        по старому кольцу из своего соединения, поэтому сообщение уходит, только когда таких порций не осталось:
+        до него прежний владелец еще пересылает строки переехавших дат новому хранителю.
+        """
+        with self.lock:
+            busy = any(count for slice_epoch, count in self.job_slices.items() if slice_epoch < epoch)
+        if busy:
+            self.connection.call_later(migration_fence_interval, lambda: self.send_migrate_done(owners, epoch))
+            return
+
+        for owner in owners:
+            self.channel.basic_publish(exchange='', routing_key=f'storage-{owner}', body=json.dumps({'command': 'MIGRATE_DONE'}))
 
     def mark_storage_dead(self, storage_id):
         """Помечает хранителя как мертвого"""
         with self.lock:
             self.dead_storages.add(storage_id)
             self.live_storages.discard(storage_id)
-            del self.pending_pings[storage_id]
+            self.bloom_filters.pop(storage_id, None) # его даты переедут к соседям, они пришлют свои фильтры
+            self.detector.forget(storage_id)
+            self.get_cache.invalidate_storage(storage_id)
             print(f"Хранитель {storage_id} был отмечен как 'dead'")
 
-    def listen_ping_responses(self):
-        """Этот метод будет слушать очередь с ответами на пинг (manager_pings)."""
-        try:
+    def on_heartbeat(self, body):
+        """Heartbeat хранителя: отметка для детектора и состояние его репликации"""
+        heartbeat = json.loads(body)
+        storage_id = heartbeat['node_id']
 
+        progress = heartbeat.get('progress')
+        with self.lock:
+            if storage_id in self.dead_storages or storage_id not in self.detector.nodes:
+                return  # упавший хранитель или узел, о котором менеджер еще не знает (JOIN в процессе)
+            self.detector.heartbeat(storage_id)
+            if progress is not None:
+                self.main_loop_stalls[storage_id] = heartbeat['sent'] - progress
+
+        # Только предупреждаем: пока процесс жив, он держит очередь storage-N, и реплику повышать нельзя
+        stall = self.main_loop_stalls.get(storage_id, 0.0)
+        if stall > main_loop_stall_timeout / 2 and storage_id not in self.stall_reported:
+            self.stall_reported.add(storage_id)
+            print(f"[Менеджер] Основной цикл хранителя {storage_id} стоит {stall:.2f} с; через {main_loop_stall_timeout} с хранитель завершится сам")
+        elif stall <= main_loop_stall_timeout / 2:
+            self.stall_reported.discard(storage_id)
+
+        if heartbeat.get('cache') is not None:
+            self.get_cache.on_storage_status(storage_id, heartbeat['cache'])
+
+        if heartbeat.get('replication') is not None:
+            self.replication_status[storage_id] = heartbeat['replication']
+            if not heartbeat['replication'].get('rebuilding') and storage_id not in self.promoting:
+                self.replica_rebuilding.discard(storage_id)
+
+        if not print_only_if_dead:
+            print(f"[Менеджер] Получен heartbeat от хранителя {storage_id}")
+
+    def listen_heartbeats(self):
+        """Слушает очередь heartbeat хранителей (manager_heartbeats) в отдельном потоке"""
+        try:
             def callback(ch, method, properties, body):
-                response = json.loads(body)
-                if not print_only_if_dead:
-                    print(f"[Менеджер] Получен ответ PONG от хранителя: {response}")
-
-                storage_id = response.get('node_id')
-                if storage_id in self.pending_pings: # находится в словаре тех, кто должен получить пинг, но еще не был обработан
-                    with self.lock:
-                        self.live_storages.add(storage_id)
-                        self.dead_storages.discard(storage_id)
-                        del self.pending_pings[storage_id]
-                        self.failed_pings[storage_id] = 0 # обнуляем неудачные попытки, так как PING был получен
-                    if not print_only_if_dead:
-                        print(f"Хранитель {storage_id} находится в рабочем состоянии")
-            
+                self.on_heartbeat(body)
+
             connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
             channel = connection.channel()
-            channel.basic_consume(queue='manager_pings', on_message_callback=callback, auto_ack=True)
+            channel.basic_consume(queue='manager_heartbeats', on_message_callback=callback, auto_ack=True)
             if not print_only_if_dead:
-                print("[Менеджер] Ожидаю ответы на пинги...")
+                print("[Менеджер] Ожидаю heartbeat хранителей...")
             channel.start_consuming()
 
         except Exception as e:
-            print(f"[Ошибка] в listen_ping_responses: {e}")
+            print(f"[Ошибка] в listen_heartbeats: {e}")
 
     def get_storage(self, date):
         """Определяет, какой хранитель должен хранить дату"""
         return self.consistent_hashing.get_storage(date)
 
-    def send_get_request(self, date):
+    def get_storages(self, dates):
+        """Определяет хранителей сразу для списка дат (пакетный кэшируемый маршрут по кольцу)"""
+        return self.consistent_hashing.get_storage_many(dates).tolist()
+
+    def choose_read_queue(self, storage_node, fresh=False):
+        """
+        Выбирает, кому отправить GET: хранителю или его реплике (replica_reads = 'round_robin' или 'least_outstanding').
+        Реплика подходит, только если ее отставание по последнему heartbeat не больше replica_read_max_lag_rows.
+        При fresh GET всегда уходит хранителю: отставание из heartbeat не учитывает только что отправленные записи,
+        а хранитель, обработав все записи до этого GET, сам передаст его реплике, если она их все подтвердила.
+        """
+        primary = f'storage-{storage_node}'
+        replica = f'replica-{storage_node}'
+        if replica_reads == 'off' or storage_node in self.replica_rebuilding or fresh:
+            return primary
+
+        if replica_read_max_lag_rows is not None:
+            status = self.replication_status.get(storage_node)
+            if status is None or status['lag_rows'] > replica_read_max_lag_rows:
+                return primary
+
+        if replica_reads == 'least_outstanding' and self.outstanding_gets[primary] != self.outstanding_gets[replica]:
+            return primary if self.outstanding_gets[primary] < self.outstanding_gets[replica] else replica
+
+        # round_robin (и равная загрузка при least_outstanding) - по очереди
+        self.read_round_robin[storage_node] += 1
+        return primary if self.read_round_robin[storage_node] % 2 else replica
+
+    def send_get_request(self, date, fresh=False):
         """Отправляет запрос на получение данных"""
-        storage_node = self.get_storage(date)
-        request = {'command': 'GET', 'date': date, 'reply_to': 'manager_responses'}
+        storage_node = self.get_storages([date])[0]
+
+        # Дата не менялась с прошлого ответа хранителя - отвечаем из кэша. GET FRESH кэш обходит: записи не от менеджера
+        # (LOAD_2, MIGRATE_DATA, догонка после повышения) сбрасывают его только по heartbeat; свежий ответ обновит кэш
+        cached = None if fresh else self.get_cache.get(date, storage_node)
+        if cached is not None:
+            self.channel.basic_publish(exchange='', routing_key='client_responses', body=json.dumps({**cached, 'queue_name': 'manager (cache)'}))
+            if print_each_step:
+                print(f"[Менеджер] GET {date}: ответ из кэша")
+            return {"status": "OK", "message": f"Запрос GET {date} обработан менеджером"}
+
+        self.bloom_stats['gets'] += 1
+
+        # Фильтр Блума хранителя говорит, что даты точно нет - отвечаем клиенту сами, без похода к хранителю
+        bloom = self.bloom_filters.get(storage_node)
+        if bloom is not None and date not in bloom:
+            self.bloom_stats['short_circuited'] += 1
+            response_with_info = {
+                'command': 'GET',
+                'date': date,
+                'data': "Данных за указанную дату не найдено",
+                'node_id': storage_node,
+                'queue_name': 'manager (bloom)'
+            }
+            self.channel.basic_publish(exchange='', routing_key='client_responses', body=json.dumps(response_with_info))
+            print(f"[Менеджер] GET {date}: по фильтру Блума хранителя {storage_node} данных нет, ответил сам")
+            return {"status": "OK", "message": f"Запрос GET {date} обработан менеджером"}
+
+        if bloom is None:
+            self.bloom_stats['unfiltered'] += 1
+        else:
+            self.bloom_stats['forwarded'] += 1
+            self.bloom_forwarded[date] += 1
+
+        queue_name = self.choose_read_queue(storage_node, fresh)
+        self.outstanding_gets[queue_name] += 1
+        self.replica_read_stats['replica' if queue_name.startswith('replica-') else 'primary'] += 1
+
+        request = {'command': 'GET', 'date': date, 'reply_to': 'manager_responses', 'generation': self.get_cache.generation(date)}
+        if fresh and replica_reads != 'off':
+            request['fresh'] = True
         self.channel.basic_publish(
-            exchange='', routing_key=f'storage-{storage_node}', body=json.dumps(request)
+            exchange='', routing_key=queue_name, body=json.dumps(request)
         )
-        print(f"[Менеджер] Запрос GET {date} -> storage_{storage_node}")
+        print(f"[Менеджер] Запрос GET {date} -> {queue_name}")
 
         return {"status": "OK", "message": f"Запрос GET {date} отправлен"}
 
-    def load_data(self, file_path):
+    def remember_loaded_dates(self, storage_id, rows):
+        """
+        Добавляет отправленные хранителю даты в копию его фильтра, не дожидаясь, пока хранитель пришлет свой:
+        иначе GET сразу после LOAD мог бы получить ложный ответ "нет данных".
+        """
+        bloom = self.bloom_filters.get(storage_id)
+        if bloom is None:
+            return
+        for date in dict.fromkeys(row['date_parsed'] for row in rows):
+            bloom.add(date)
+
+    def on_bloom_update(self, response):
+        """Сливает присланный хранителем фильтр со своей копией (фильтры только растут, поэтому ИЛИ)"""
+        storage_id = response['node_id']
+        bloom = BloomFilter.from_message(response['bloom'])
+
+        with self.lock:
+            if storage_id in self.dead_storages:
+                return
+            current = self.bloom_filters.get(storage_id)
+            if current is None:
+                self.bloom_filters[storage_id] = bloom
+            else:
+                current.merge(bloom)
+
+        if print_each_step:
+            print(f"[Менеджер] Обновлен фильтр Блума хранителя {storage_id} ({bloom.count} дат)")
+
+    def get_stats(self):
+        """Метрики менеджера для команды STATS"""
+        stats = self.bloom_stats
+        negatives = stats['short_circuited'] + stats['forwarded_misses']
+        return {
+            'replication': dict(sorted(self.replication_status.items())),
+            'main_loop_stalls': {storage_id: round(stall, 2) for storage_id, stall in sorted(self.main_loop_stalls.items())},
+            'failovers': self.failovers,
+            'joins': self.joins,
+            'cache': self.get_cache.status(),
+            'reads': {**self.replica_read_stats, 'outstanding': {queue: count for queue, count in self.outstanding_gets.items() if count}},
+            'bloom': {
+                **stats,
+                'round_trips_saved': stats['short_circuited'],
+                # доля отсутствующих дат, которые фильтр не отсек (наблюдаемая частота ложных срабатываний)
+                'observed_false_positive_rate': round(stats['forwarded_misses'] / negatives, 4) if negatives else None,
+                'estimated_false_positive_rate': {
+                    storage_id: round(bloom.estimated_false_positive_rate(), 6)
+                    for storage_id, bloom in sorted(self.bloom_filters.items())
+                },
+            }
+        }
+
+    def rebuild_showcase(self):
+        """
+        Перестраивает витрину по живым хранителям без повторного чтения CSV: витрина получает REBUILD_START
+        со списком хранителей, а хранители параллельно присылают ей скетчи температур своих дат (SHOWCASE_DUMP)
+        """
+        if self.migration is not None: # во время JOIN часть дат лежит сразу у двух хранителей
+            return {"status": "ERROR", "message": "Идет JOIN, перестроить витрину можно после его окончания"}
+
+        rebuild_id = uuid.uuid4().hex
+        with self.lock:
+            storages = sorted(self.live_storages)
+
+        # Начало уходит витрине раньше запросов хранителям, поэтому приходит раньше их порций
+        start = {'command': 'REBUILD_START', 'rebuild_id': rebuild_id, 'storages': storages, 'reply_to': 'client_responses'}
+        self.channel.basic_publish(exchange='', routing_key='showcase_data', body=json.dumps(start))
+
+        request = {'command': 'SHOWCASE_DUMP', 'rebuild_id': rebuild_id, 'reply_to': 'showcase_data'}
+        for storage_id in storages:
+            self.channel.basic_publish(exchange='', routing_key=f'storage-{storage_id}', body=json.dumps(request))
+
+        print(f"[Менеджер] REBUILD витрины -> хранители {storages}")
+        return {"status": "OK", "message": f"Витрина перестраивается по {len(storages)} хранителям"}
+
+    def track_request(self, kind, storages, dates, reply_to='client_responses', **extra):
+        """
+        Регистрирует запрос, разосланный нескольким хранителям, и возвращает его request_id.
+        Если за request_timeout ответят не все, клиент получит собранное с пометкой, какие хранители не ответили.
+        """
+        request_id = uuid.uuid4().hex
+        self.pending_requests[request_id] = {
+            'kind': kind, 'waiting': set(storages), 'dates': dates, 'data': {}, 'nodes': [], 'reply_to': reply_to, **extra
+        }
+
+        # Таймер выполняется в потоке этого же соединения, так что блокировка не нужна
+        self.connection.call_later(request_timeout, lambda: self.finish_request(request_id))
+        return request_id
+
+    def on_request_part(self, response):
+        """Добавляет ответ хранителя к запросу и, когда ответили все, отправляет клиенту один общий ответ"""
+        pending = self.pending_requests.get(response['request_id'])
+        if pending is None:
+            return # запрос уже завершен (например, по таймауту)
+
+        pending['data'].update(response['data'])
+        pending['nodes'].append(response['node_id'])
+        pending['waiting'].discard(response['node_id'])
+
+        if not pending['waiting']:
+            self.finish_request(response['request_id'])
+
+    def finish_request(self, request_id):
+        """Склеивает ответы хранителей в порядке запрошенных дат и отправляет клиенту"""
+        pending = self.pending_requests.pop(request_id, None)
+        if pending is None:
+            return # уже отправлен
+
+        merged = {date: pending['data'][date] for date in pending['dates'] if date in pending['data']}
+        timed_out = sorted(pending['waiting'])
+
+        result = {'status': 'OK', 'command': pending['kind'], 'nodes': sorted(pending['nodes']), 'timed_out': timed_out}
+
+        if pending['kind'] == 'GET_RANGE':
+            result['data'] = merged if merged else "Данных за указанный период не найдено"
+        else:
+            # Даты, хранители которых не ответили, не считаем ни найденными, ни отсутствующими
+            unavailable = set(date for date, storage in zip(pending['dates'], pending['date_storages']) if storage in pending['waiting'])
+            result['data'] = merged
+            result['found'] = list(merged)
+            result['missing'] = [date for date in pending['dates'] if date not in merged and date not in unavailable]
+            result['unavailable'] = [date for date in pending['dates'] if date in unavailable]
+
+        if timed_out:
+            result['status'] = 'PARTIAL'
+            print(f"[Менеджер] {pending['kind']}: не дождался ответа хранителей {timed_out} за {request_timeout} с")
+
+        print(f"[Менеджер] Собран ответ {pending['kind']}: {len(merged)} дат от хранителей {result['nodes']}")
+        self.channel.basic_publish(exchange='', routing_key=pending['reply_to'], body=json.dumps(result))
+
+    def send_get_range_request(self, date1, date2):
+        """
+        Отправляет запрос по диапазону дат: даты диапазона группируются по хранителям через кольцо,
+        и каждому задействованному хранителю уходит один запрос GET_RANGE. Ответы собираются в on_request_part.
+        """
+        try:
+            start = datetime.strptime(date1, '%d-%m-%Y')
+            end = datetime.strptime(date2, '%d-%m-%Y')
+        except ValueError:
+            return {"status": "ERROR", "message": "Даты диапазона должны быть в формате ДД-ММ-ГГГГ"}
+
+        if start > end:
+            return {"status": "ERROR", "message": "Начало диапазона позже конца"}
+
+        dates = [(start + timedelta(days=i)).strftime('%d-%m-%Y') for i in range((end - start).days + 1)]
+        storages = set(self.get_storages(dates))
+
+        request_id = self.track_request('GET_RANGE', storages, dates)
+
+        request = {'command': 'GET_RANGE', 'date1': date1, 'date2': date2, 'request_id': request_id, 'reply_to': 'manager_responses'}
+        for storage_node in storages:
+            self.channel.basic_publish(
+                exchange='', routing_key=f'storage-{storage_node}', body=json.dumps(request)
+            )
+
+        print(f"[Менеджер] Запрос GET_RANGE {date1} {date2} ({len(dates)} дат) -> хранители {sorted(storages)}")
+
+        return {"status": "OK", "message": f"Запрос GET_RANGE {date1} {date2} отправлен {len(storages)} хранителям"}
+
+    def send_mget_request(self, dates):
+        """Отправляет каждому хранителю один запрос MGET со всеми его датами из списка"""
+        dates = list(dict.fromkeys(dates)) # без повторов, в порядке запроса
+        storages = self.get_storages(dates)
+
+        by_storage = {}
+        for date, storage_node in zip(dates, storages):
+            by_storage.setdefault(storage_node, []).append(date)
+
+        request_id = self.track_request('MGET', by_storage, dates, date_storages=storages)
+
+        for storage_node, storage_dates in by_storage.items():
+            request = {'command': 'MGET', 'dates': storage_dates, 'request_id': request_id, 'reply_to': 'manager_responses'}
+            self.channel.basic_publish(
+                exchange='', routing_key=f'storage-{storage_node}', body=json.dumps(request)
+            )
+
+        print(f"[Менеджер] Запрос MGET ({len(dates)} дат) -> хранители {sorted(by_storage)}")
+
+        return {"status": "OK", "message": f"Запрос MGET на {len(dates)} дат отправлен {len(by_storage)} хранителям"}
+
+    def start_load_job(self, file_path, stream):
+        """Запускает LOAD фоновым заданием и сразу отвечает клиенту его номером"""
+        job = LoadJob(next(self.job_ids), file_path, stream)
+        self.jobs[job.job_id] = job
+        self.launch_job(job)
+
+        print(f"[Менеджер] Загрузка {file_path} запущена как задание {job.job_id}")
+        return {"status": "OK", "message": f"Загрузка {file_path} запущена как задание {job.job_id} (JOB {job.job_id} - прогресс, CANCEL {job.job_id} - отмена)", "job_id": job.job_id}
+
+    def launch_job(self, job):
+        """Запускает задание в отдельном потоке"""
+        threading.Thread(target=self.run_load_job, args=(job,), daemon=True).start()
+
+    def run_load_job(self, job):
+        """
+        Поток задания: у него свое соединение с RabbitMQ (соединения pika нельзя делить между потоками),
+        так что основной цикл менеджера тем временем разбирает команды и ответы хранителей.
+        """
+        connection = None
+        try:
+            connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+            channel = connection.channel()
+
+            if job.stream:
+                response = self.load_data_stream(job, connection)
+            else:
+                response = self.load_data(job, channel)
+
+            # Итог задания клиент получает отдельным сообщением
+            channel.basic_publish(exchange='', routing_key='client_responses', body=json.dumps({**response, 'job': job.progress()}))
+
+        except Exception as e:
+            job.finish('failed', str(e))
+            print(f"[Ошибка] Задание {job.job_id}: {e}")
+
+        finally:
+            if connection is not None and connection.is_open:
+                connection.close()
+
+    def ring_snapshot(self, ring=None):
+        """
+        Копия кольца для потока задания и номер ее состава: маршрутизация меняет кэш маршрутов, а кольцом менеджера
+        одновременно пользуется основной цикл. Копия пересобирается, только если состав кольца изменился.
+        """
+        with self.lock:
+            message = self.consistent_hashing.to_message()
+            epoch = self.ring_epoch
+        if ring is None or ring.to_message() != message:
+            ring = ConsistentHashing.from_message(message)
+        return ring, epoch
+
+    def begin_slice(self, storage_id, part, epoch):
+        """
+        Начало порции строк задания, разложенных по кольцу с номером epoch. False - кольцо с тех пор изменилось,
+        и порцию нужно разложить заново; иначе до end_slice MIGRATE_DONE прежним владельцам не отправляется.
+        """
+        with self.lock:
+            if self.ring_epoch != epoch:
+                return False
+            self.job_slices[epoch] += 1
+            self.remember_loaded_dates(storage_id, part)
+        return True
+
+    def end_slice(self, epoch):
+        with self.lock:
+            self.job_slices[epoch] -= 1
+            if not self.job_slices[epoch]:
+                del self.job_slices[epoch]
+
+    def publish_rows(self, channel, storage_id, rows, job, epoch, mandatory=False):
+        """
+        Отправляет строки хранителю пачками LOAD_BATCH, отмечая прогресс задания. Возвращает строки, которые
+        не отправлены, потому что кольцо изменилось (пустой список - отправлено все), или None - задание отменено.
+        """
+        queue_name = f"storage-{storage_id}"
+
+        # Прогресс, отмена и состав кольца проверяются через каждые десять пачек, блокировка фильтров берется на такую же порцию
+        step = batch_max_rows * 10
+        for start in range(0, len(rows), step):
+            if job.cancelled():
+                return None
+
+            part = rows[start:start + step]
+            if not self.begin_slice(storage_id, part, epoch):
+                return rows[start:]
+            try:
+                for body in build_batches(part, batch_max_rows, batch_max_bytes):
+                    channel.basic_publish(exchange='', routing_key=queue_name, body=body, mandatory=mandatory)
+            finally:
+                self.end_slice(epoch)
+            self.get_cache.invalidate_dates(dict.fromkeys(row['date_parsed'] for row in part))
+            job.rows_published += len(part)
+
+        if print_each_step:
+            print(f"[Менеджер] Отправил {len(rows)} строк в {queue_name}")
+        return []
+
+    def publish_partitions(self, channel, partitions, ring, epoch, job, connection=None):
+        """
+        Отправляет строки, разложенные по кольцу с номером epoch. Строки, которые не успели уйти до изменения кольца
+        (JOIN, падение хранителя), раскладываются по новому кольцу и отправляются уже его владельцам.
+        connection - потоковый режим: перед каждым хранителем ждем разгрузки его очереди.
+        False - задание отменено.
+        """
+        while partitions:
+            unsent = []
+            for storage_id, rows in partitions.items():
+                if connection is not None:
+                    self.wait_for_queue(channel, storage_id, connection)
+
+                # basic_publish в режиме подтверждений возвращается только после ack брокера,
+                # так что неподтвержденных данных в полете не больше одной пачки LOAD_BATCH
+                rest = self.publish_rows(channel, storage_id, rows, job, epoch, mandatory=connection is not None)
+                if rest is None:
+                    return False
+                unsent.extend(rest)
+
+            partitions = {}
+            if unsent:
+                ring, epoch = self.ring_snapshot(ring)
+                partitions = group_rows(unsent, ring)
+        return True
+
+    def load_data(self, job, channel):
         """
         Загружает CSV, разбивает данные по хранителям и отправляет их в RabbitMQ.
         """
         try:
-            data = pd.read_csv(file_path)
-
-            # Возможные имена столбцов с датой
-            possible_date_columns = ['date', 'datetime_utc', 'Date.Full', 'DATE']
-
-            # Проверяем, какой из столбцов присутствует в DataFrame
-            date_column = None
-            for column in possible_date_columns:
-                if column in data.columns:
-                    date_column = column
-                    break
-
-            for _, row in data.iterrows():
-                date_raw = row[date_column]
-                date_parsed = convert_date(date_raw)
-                row['date_parsed'] = date_parsed
-                storage_id = self.consistent_hashing.get_storage(date_parsed)
-                queue_name = f"storage-{storage_id}"
-                
-                load_request = {'command': 'LOAD', 'data': row.to_dict()}
-                self.channel.basic_publish(exchange='', routing_key=queue_name, body=json.dumps(load_request))
+            data = pd.read_csv(job.file_path)
+            job.rows_total = len(data)
 
-                # # отправляем в очередь витрины
-                # self.channel.basic_publish(
-                #     exchange='',
-                #     routing_key='showcase_data',
-                #     body=json.dumps(load_request)
-                # )
+            # Разбираем даты и маршрутизируем строки по столбцам, группируя их по хранителям
+            ring, epoch = self.ring_snapshot()
+            partitions = partition_rows(data, ring)
 
-                if print_each_step:
-                    print(f"[Менеджер] Отправил данные {row} в {queue_name}")
+            if not self.publish_partitions(channel, partitions, ring, epoch, job):
+                job.finish('cancelled')
+                print(f"[Менеджер] Задание {job.job_id} отменено, отправлено {job.rows_published} строк")
+                return {"status": "CANCELLED", "message": f"Загрузка {job.file_path} отменена после {job.rows_published} строк"}
 
+            job.finish('done')
             print("[Менеджер] Данные успешно загружены и распределены!")
-            return {"status": "OK", "message": f"Файл {file_path} загружен"}
+            return {"status": "OK", "message": f"Файл {job.file_path} загружен"}
         
         except Exception as e:
 
+            job.finish('failed', str(e))
             print(f"[Ошибка] Не удалось загрузить файл: {e}")
             return {"status": "ERROR", "message": f"Не удалось загрузить файл: {e}"}
         
             # self.channel = self.connection.channel()
     
+    def load_data_stream(self, job, connection):
+        """
+        Потоковая загрузка CSV: файл читается чанками по stream_chunk_rows строк, поэтому в памяти
+        менеджера одновременно находится только один чанк. Публикация идет через отдельный канал
+        с подтверждениями издателя (publisher confirms), а при переполнении очередей хранителей
+        загрузка притормаживает.
+        """
+        channel = None
+        try:
+            # Отдельный канал: режим подтверждений не должен задевать итоговый ответ клиенту
+            channel = connection.channel()
+            channel.confirm_delivery()
+
+            ring = None
+            for chunk in pd.read_csv(job.file_path, chunksize=stream_chunk_rows):
+                ring, epoch = self.ring_snapshot(ring)
+                partitions = partition_rows(chunk, ring)
+
+                if not self.publish_partitions(channel, partitions, ring, epoch, job, connection):
+                    job.finish('cancelled')
+                    print(f"[Менеджер] Задание {job.job_id} отменено, отправлено {job.rows_published} строк")
+                    return {"status": "CANCELLED", "message": f"Загрузка {job.file_path} отменена после {job.rows_published} строк"}
+
+                if print_each_step:
+                    print(f"[Менеджер] Потоковая загрузка {job.file_path}: отправлено {job.rows_published} строк")
+
+            job.rows_total = job.rows_published
+            job.finish('done')
+            print(f"[Менеджер] Данные успешно загружены и распределены в потоковом режиме ({job.rows_published} строк)!")
+            return {"status": "OK", "message": f"Файл {job.file_path} загружен ({job.rows_published} строк)"}
+
+        except Exception as e:
+
+            job.finish('failed', str(e))
+            print(f"[Ошибка] Не удалось загрузить файл: {e}")
+            return {"status": "ERROR", "message": f"Не удалось загрузить файл: {e}"}
+
+        finally:
+            if channel is not None and channel.is_open:
+                channel.close()
+
+    def wait_for_queue(self, channel, storage_id, connection):
+        """Backpressure: ждет, пока очередь хранителя не станет короче stream_queue_threshold"""
+        queue_name = f"storage-{storage_id}"
+        while storage_id not in self.dead_storages: # очередь упавшего хранителя никто не разберет, не ждем ее
+            declared = channel.queue_declare(queue=queue_name, durable=durability, passive=True)
+            if declared.method.message_count <= stream_queue_threshold:
+                return
+
+            # sleep соединения продолжает обслуживать heartbeat'ы, в отличие от time.sleep
+            connection.sleep(stream_backoff_interval)
+
     def on_client_command(self, ch, method, properties, body):
         try:
 
@@ -243,23 +831,70 @@ class StorageManager:
             if cmd == "LOAD":
 
                 if len(command) < 2:
-                    print("[Ошибка] Использование: LOAD [имя файла]")
-                    response = {"status": "ERROR", "message": "[Ошибка] Использование: LOAD [имя файла]"}
+                    print("[Ошибка] Использование: LOAD [имя файла] [STREAM]")
+                    response = {"status": "ERROR", "message": "[Ошибка] Использование: LOAD [имя файла] [STREAM]"}
 
                 else:
 
                     file_name = command[1]
-                    response = self.load_data(file_name)
+                    stream = len(command) > 2 and command[2].upper() == "STREAM"
+                    response = self.start_load_job(file_name, stream)
+
+            elif cmd == "JOBS":
+                response = {"status": "OK", "jobs": [job.progress() for job in self.jobs.values()]}
+
+            elif cmd in ("JOB", "CANCEL"):
+
+                job = self.jobs.get(int(command[1])) if len(command) > 1 and command[1].isdigit() else None
+                if job is None:
+                    print(f"[Ошибка] Использование: {cmd} [номер задания]")
+                    response = {"status": "ERROR", "message": f"[Ошибка] Использование: {cmd} [номер задания] (задания: {list(self.jobs)})"}
+
+                elif cmd == "CANCEL":
+                    job.cancel()
+                    response = {"status": "OK", "message": f"Задание {job.job_id} будет отменено", "job": job.progress()}
+
+                else:
+                    response = {"status": "OK", "job": job.progress()}
 
             elif cmd == "GET":
 
                 if len(command) < 2:
-                    print("[Ошибка] Использование: GET [дата]")
-                    response = {"status": "ERROR", "message": "[Ошибка] Использование: GET [дата]"}
+                    print("[Ошибка] Использование: GET [дата] [FRESH]")
+                    response = {"status": "ERROR", "message": "[Ошибка] Использование: GET [дата] [FRESH]"}
 
                 else:
                     date = command[1]
-                    response = self.send_get_request(date)
+                    fresh = len(command) > 2 and command[2].upper() == "FRESH"
+                    response = self.send_get_request(date, fresh)
+
+            elif cmd == "GET_RANGE":
+
+                if len(command) < 3:
+                    print("[Ошибка] Использование: GET_RANGE [дата1] [дата2]")
+                    response = {"status": "ERROR", "message": "[Ошибка] Использование: GET_RANGE [дата1] [дата2]"}
+
+                else:
+                    response = self.send_get_range_request(command[1], command[2])
+
+            elif cmd == "MGET":
+
+                if len(command) < 2:
+                    print("[Ошибка] Использование: MGET [дата1] [дата2] ...")
+                    response = {"status": "ERROR", "message": "[Ошибка] Использование: MGET [дата1] [дата2] ..."}
+
+                else:
+                    response = self.send_mget_request(command[1:])
+
+            elif cmd == "STATS":
+
+                response = {"status": "OK", "command": "STATS", "stats": self.get_stats()}
+
+            elif cmd == "JOIN":
+                response = self.join_storage(float(command[1]) if len(command) > 1 else 1)
+
+            elif cmd == "REBUILD":
+                response = self.rebuild_showcase()
 
             elif cmd == "KILL":
                 """Отправляет запрос на получение данных"""
@@ -295,6 +930,42 @@ class StorageManager:
     def on_storage_message(self, ch, method, properties, body):
         response = json.loads(body)
 
+        if response.get('request_id') is not None:
+            self.on_request_part(response)
+            return
+
+        if response.get('command') == 'BLOOM':
+            self.on_bloom_update(response)
+            return
+
+        if response.get('command') == 'PROMOTED':
+            self.on_promoted(response)
+            return
+
+        if response.get('command') == 'MIGRATED':
+            self.on_migrated(response)
+            return
+
+        # Кэшируем только ответы самого хранителя или реплики на переданный им GET FRESH: другие ответы реплики могут отставать
+        if (response.get('command') == 'GET' and response.get('version') is not None
+                and f"storage-{response['node_id']}" in (response['queue_name'], response.get('forwarded_by'))):
+            self.get_cache.put(response, response['generation'])
+
+        # GET FRESH, который хранитель передал догнавшей его реплике, учтен как отправленный хранителю
+        if response.get('command') == 'GET' and response.get('forwarded_by') is not None:
+            self.replica_read_stats['primary'] -= 1
+            self.replica_read_stats['replica'] += 1
+        sent_to = response.get('forwarded_by') or response['queue_name']
+        if response.get('command') == 'GET' and self.outstanding_gets[sent_to] > 0:
+            self.outstanding_gets[sent_to] -= 1
+
+        if response.get('command') == 'GET' and self.bloom_forwarded[response['date']] > 0:
+            self.bloom_forwarded[response['date']] -= 1
+            if self.bloom_forwarded[response['date']] == 0:
+                del self.bloom_forwarded[response['date']]
+            if response['data'] == "Данных за указанную дату не найдено":
+                self.bloom_stats['forwarded_misses'] += 1
+
         print(f"[Менеджер] Получен ответ от хранителя с id = {response['node_id']} (queue_name = {response['queue_name']}): {response['data']}")
         
         # Отправляем ответ клиенту
@@ -0,0 +1,112 @@
+import time
+import threading
+from collections import OrderedDict, Counter
+
+from config import get_cache_size, get_cache_ttl
+
+
+class GetCache:
+    """
+    Кэш ответов GET в менеджере: повторный GET той же даты отвечается без похода к хранителю.
+    Размер ограничен get_cache_size записей (вытесняется давно не читанная), запись живет не дольше get_cache_ttl.
+
+    Хранитель отвечает на GET с версией даты (номером последней записи в нее), а в heartbeat присылает
+    даты, измененные за последние несколько heartbeat, с их версиями. Запись кэша сбрасывается, если
+    ее дата изменилась позже ее версии. Даты своих LOAD менеджер сбрасывает сам сразу при отправке,
+    а ответ на GET, отправленный до такого сброса, в кэш не попадает (поколение даты).
+    Записи, сделанные не менеджером (LOAD_2 от реплики при RELOCATE, MIGRATE_DATA после JOIN, догонка
+    после повышения реплики), сбрасывают кэш только по heartbeat, поэтому такой ответ может оставаться
+    устаревшим до cache_change_heartbeats * heartbeat_interval секунд. GET FRESH кэш не читает.
+    Кэшем пользуются основной цикл, потоки heartbeat и заданий LOAD, поэтому методы берут блокировку.
+    """
+
+    def __init__(self, size=get_cache_size, ttl=get_cache_ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict() # дата -> (ответ хранителя, id хранителя, версия даты, когда запись истекает)
+        self.generations = Counter() # дата -> сколько раз менеджер сбрасывал ее сам
+        self.versions = {} # дата -> (запуск процесса хранителя, последняя версия из heartbeat): более старые ответы в кэш не берем
+        self.storages = {} # id хранителя -> (запуск процесса, номер его последней записи) из последнего heartbeat
+        self.lock = threading.RLock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidated': 0, 'evicted': 0, 'stored': 0, 'rejected': 0}
+
+    def generation(self, date):
+        return self.generations[date]
+
+    def get(self, date, storage_id):
+        """Ответ из кэша или None; storage_id - текущий владелец даты (после JOIN записи прежнего владельца не годятся)"""
+        with self.lock:
+            entry = self.entries.get(date)
+            if entry is None or entry[1] != storage_id:
+                self.stats['misses'] += 1
+                return None
+
+            if entry[3] < time.time():
+                del self.entries[date]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            self.entries.move_to_end(date)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def put(self, response, generation):
+        """Запоминает ответ хранителя на GET, отправленный при поколении даты generation"""
+        with self.lock:
+            date, storage_id = response['date'], response['node_id']
+            known = self.storages.get(storage_id)
+            latest = self.versions.get(date)
+            if (generation != self.generations[date]
+                    or (latest is not None and latest[0] == response['incarnation'] and response['version'] < latest[1])
+                    or (known is not None and known[0] != response['incarnation'])):
+                self.stats['rejected'] += 1 # ответ устарел, пока шел к менеджеру
+                return
+
+            self.entries[date] = (response, storage_id, response['version'], time.time() + self.ttl)
+            self.entries.move_to_end(date)
+            self.stats['stored'] += 1
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def drop(self, date):
+        if self.entries.pop(date, None) is not None:
+            self.stats['invalidated'] += 1
+
+    def invalidate_dates(self, dates):
+        """Менеджер сам отправил строки этих дат"""
+        with self.lock:
+            for date in dates:
+                self.generations[date] += 1
+                self.drop(date)
+
+    def invalidate_storage(self, storage_id):
+        """Хранитель упал, перезапущен или его реплика заняла его место - его версии больше не сравнимы"""
+        with self.lock:
+            for date in [date for date, entry in self.entries.items() if entry[1] == storage_id]:
+                self.drop(date)
+            self.storages.pop(storage_id, None)
+
+    def on_storage_status(self, storage_id, status):
+        """Изменения дат хранителя из heartbeat: status = {'incarnation', 'version', 'since', 'changes': {дата: версия}}"""
+        with self.lock:
+            known = self.storages.get(storage_id)
+            if known is None or known[0] != status['incarnation'] or known[1] < status['since']:
+                # Новый процесс или пропущены heartbeat с изменениями, которых уже нет в окне - по датам сбросить нельзя
+                self.invalidate_storage(storage_id)
+            else:
+                for date, version in status['changes'].items():
+                    entry = self.entries.get(date)
+                    if entry is not None and entry[1] == storage_id and entry[2] < version:
+                        self.drop(date)
+
+            for date, version in status['changes'].items():
+                self.versions[date] = (status['incarnation'], version)
+            self.storages[storage_id] = (status['incarnation'], status['version'])
+
+    def status(self):
+        """Метрики для STATS"""
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {**self.stats, 'entries': len(self.entries), 'hit_ratio': round(self.stats['hits'] / lookups, 4) if lookups else None}
@@ -1,49 +1,158 @@
 import hashlib
 import bisect
+import threading
+import numpy as np
 
-from config import hash_prefix
+from config import hash_prefix, num_vnodes, storage_weights, route_cache_size
 
 class ConsistentHashing:
-    def __init__(self, num_storages):
+    def __init__(self, num_storages, num_vnodes=num_vnodes, weights=None):
         self.num_storages = num_storages
+        self.num_vnodes = num_vnodes # количество виртуальных узлов на хранитель с весом 1
+        self.weights = dict(storage_weights if weights is None else weights) # id хранителя -> вес
         self.ring = {}
         self.sorted_keys = []
+        self.storage_points = {} # id хранителя -> список его точек на кольце
+
+        # Кольцо в виде массивов NumPy для searchsorted (пересобирается лениво после изменения кольца)
+        self.ring_positions = None
+        self.ring_owners = None
+
+        # Мемоизация ключ -> хранитель, сбрасывается при любом изменении кольца
+        self.route_cache = {}
+        self.route_cache_size = route_cache_size
+
+        # Кольцо меняется из потока детектора отказов (remove_storage), а маршруты ищутся из основного потока и заданий LOAD:
+        # поиск и изменение идут под одним замком, иначе поиск может закэшировать маршрут по старому кольцу
+        # уже после сброса кэша или застать ring_positions = None посреди вызова
+        self.lock = threading.RLock()
         
         # Добавляем хранителей
         for i in range(num_storages):
             self.add_storage(i)
 
     def _hash(self, key):
-        """Возвращает хэш-значение для ключа (даты или хранителя)"""
-        return int(hashlib.md5(key.encode()).hexdigest(), 16)
+        """
+        Возвращает хэш-значение для ключа (даты или хранителя): старшие 64 бита MD5.
+        Порядок точек на кольце тот же, что и у полного MD5, но значения помещаются в uint64.
+        """
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def vnode_count(self, storage_id):
+        """Количество виртуальных узлов хранителя с учетом его веса (не меньше одного)"""
+        weight = self.weights.get(storage_id, 1)
+        return max(1, round(self.num_vnodes * weight))
+
+    def vnode_key(self, storage_id, vnode):
+        """Ключ виртуального узла; нулевой узел совпадает с ключом хранителя без виртуальных узлов"""
+        if vnode == 0:
+            return f"{hash_prefix}{storage_id}"
+        return f"{hash_prefix}{storage_id}#{vnode}"
+
+    def _ring_changed(self):
+        """Сбрасывает все, что зависит от состава кольца"""
+        self.route_cache.clear()
+        self.ring_positions = None
+        self.ring_owners = None
     
     def add_storage(self, storage_id):
         """Добавляет хранитель на кольцо с виртуальными узлами"""
-        storage_key = f"{hash_prefix}{storage_id}"
-        hashed_key = self._hash(storage_key)
-        self.ring[hashed_key] = storage_id
-        bisect.insort(self.sorted_keys, hashed_key)
+        with self.lock:
+            if storage_id in self.storage_points:
+                return
+
+            points = []
+            for vnode in range(self.vnode_count(storage_id)):
+                hashed_key = self._hash(self.vnode_key(storage_id, vnode))
+                if hashed_key in self.ring: # коллизия практически невозможна, но точку не перезаписываем
+                    continue
+                self.ring[hashed_key] = storage_id
+                bisect.insort(self.sorted_keys, hashed_key)
+                points.append(hashed_key)
+
+            self.storage_points[storage_id] = points
+            self._ring_changed()
 
     def remove_storage(self, storage_id):
-        """Удаляет хранитель с кольца"""
-        # Вычисляем хеш для данного хранителя
+        """Удаляет хранитель (все его виртуальные узлы) с кольца"""
+        with self.lock:
+            points = self.storage_points.pop(storage_id, [])
+
+            # Удаляем его точки из кольца и списка
+            for hashed_key in points:
+                del self.ring[hashed_key]
+                index = bisect.bisect_left(self.sorted_keys, hashed_key)
+                del self.sorted_keys[index]
+
+            self._ring_changed()
 
-        storage_key = f"{hash_prefix}{storage_id}"
-        hashed_key = self._hash(storage_key)
+    def to_message(self):
+        """Состав кольца для передачи в JSON (узлы по нему сами раскладывают даты по владельцам)"""
+        with self.lock:
+            return {'ring_storages': sorted(self.storage_points), 'num_vnodes': self.num_vnodes, 'weights': dict(self.weights)}
 
-        # Удаляем его из кольца и списка
-        if hashed_key in self.ring:
-            del self.ring[hashed_key]
-            self.sorted_keys.remove(hashed_key)
+    @classmethod
+    def from_message(cls, message):
+        ring = cls(0, message['num_vnodes'], {int(k): v for k, v in message['weights'].items()})
+        for storage_id in message['ring_storages']:
+            ring.add_storage(storage_id)
+        return ring
+
+    def _remember(self, key, storage_id):
+        """Кладет маршрут в кэш, вытесняя самую старую запись при переполнении"""
+        if len(self.route_cache) >= self.route_cache_size:
+            del self.route_cache[next(iter(self.route_cache))]
+        self.route_cache[key] = storage_id
 
     def get_storage(self, key):
         """Определяет, какому хранителю принадлежит ключ (дата)"""
-        hashed_key = self._hash(key)
+        with self.lock:
+            storage_id = self.route_cache.get(key)
+            if storage_id is not None:
+                return storage_id
+
+            hashed_key = self._hash(key)
+
+            # Поиск ближайшего хэша по кольцу
+            index = bisect.bisect(self.sorted_keys, hashed_key)
+            if index == len(self.sorted_keys):  
+                index = 0  # Если достигли конца списка, идем на начало
+
+            storage_id = self.ring[self.sorted_keys[index]]
+            self._remember(key, storage_id)
+            return storage_id
+
+    def get_storage_many(self, keys):
+        """
+        Определяет хранителей сразу для массива ключей.
+        Ключи, которых нет в кэше, хэшируются один раз на уникальный ключ и ищутся на кольце
+        одним вызовом np.searchsorted. Возвращает массив id хранителей той же длины, что и keys.
+        """
+        keys = list(keys)
+
+        with self.lock:
+            routes = {}
+            missing = []
+            for key in dict.fromkeys(keys):
+                storage_id = self.route_cache.get(key)
+                if storage_id is None:
+                    missing.append(key)
+                else:
+                    routes[key] = storage_id
+
+            if missing:
+                if self.ring_positions is None:
+                    self.ring_positions = np.array(self.sorted_keys, dtype=np.uint64)
+                    self.ring_owners = np.array([self.ring[point] for point in self.sorted_keys], dtype=np.int64)
+
+                hashes = np.fromiter((self._hash(key) for key in missing), dtype=np.uint64, count=len(missing))
+
+                # Поиск ближайшего хэша по кольцу, с переходом с конца на начало
+                indexes = np.searchsorted(self.ring_positions, hashes, side='right')
+                indexes[indexes == len(self.ring_positions)] = 0
 
-        # Поиск ближайшего хэша по кольцу
-        index = bisect.bisect(self.sorted_keys, hashed_key)
-        if index == len(self.sorted_keys):  
-            index = 0  # Если достигли конца списка, идем на начало
+                for key, storage_id in zip(missing, self.ring_owners[indexes].tolist()):
+                    routes[key] = storage_id
+                    self._remember(key, storage_id)
 
-        storage_id = self.ring[self.sorted_keys[index]]
-        return storage_id
+            return np.array([routes[key] for key in keys], dtype=np.int64)
@@ -0,0 +1,129 @@
+import os
+import math
+import json
+import time
+import threading
+from collections import deque
+
+import pika
+
+from config import heartbeat_interval, phi_window, phi_min_std, heartbeat_acceptable_pause, durability, main_loop_stall_timeout
+
+
+class PhiAccrualDetector:
+    """
+    Детектор отказов phi-accrual: по последним phi_window интервалам между heartbeat узла оценивается
+    нормальное распределение интервалов, и phi = -log10(вероятность, что heartbeat еще придет после такой паузы).
+    Порог по phi сам подстраивается под узел: если heartbeat узла приходят неровно (например, под нагрузкой),
+    разброс растет и такой же паузе соответствует меньшее phi. Сумма и сумма квадратов интервалов ведутся
+    на ходу, поэтому phi считается за O(1) на узел.
+    """
+
+    def __init__(self, window=phi_window, min_std=phi_min_std, acceptable_pause=heartbeat_acceptable_pause,
+                 first_interval=heartbeat_interval):
+        self.window = window
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        self.first_interval = first_interval
+        self.nodes = {}  # id узла -> {'last': время последнего heartbeat, 'intervals': deque, 'sum', 'squares'}
+
+    def register(self, node_id, now=None):
+        """Начинает наблюдение за узлом (как будто heartbeat пришел сейчас)"""
+        now = time.time() if now is None else now
+        # Начальная оценка: интервал heartbeat_interval с разбросом в четверть интервала
+        std = self.first_interval / 4
+        self.nodes[node_id] = {
+            'last': now,
+            'intervals': deque([self.first_interval - std, self.first_interval + std]),
+            'sum': 2 * self.first_interval,
+            'squares': (self.first_interval - std) ** 2 + (self.first_interval + std) ** 2,
+        }
+
+    def forget(self, node_id):
+        self.nodes.pop(node_id, None)
+
+    def heartbeat(self, node_id, now=None):
+        now = time.time() if now is None else now
+        node = self.nodes.get(node_id)
+        if node is None:
+            self.register(node_id, now)
+            return
+
+        interval = now - node['last']
+        node['last'] = now
+        node['intervals'].append(interval)
+        node['sum'] += interval
+        node['squares'] += interval * interval
+        if len(node['intervals']) > self.window:
+            dropped = node['intervals'].popleft()
+            node['sum'] -= dropped
+            node['squares'] -= dropped * dropped
+
+    def phi(self, node_id, now=None):
+        """Уровень подозрения: 1 - ошибка в 10%, 2 - в 1%, 8 - в 0.000001% (0.0 для неизвестного узла)"""
+        node = self.nodes.get(node_id)
+        if node is None:
+            return 0.0
+
+        now = time.time() if now is None else now
+        count = len(node['intervals'])
+        mean = node['sum'] / count
+        std = max(self.min_std, math.sqrt(max(0.0, node['squares'] / count - mean * mean)))
+
+        # Логистическая аппроксимация хвоста нормального распределения (как в Akka / Cassandra)
+        y = (now - node['last'] - mean - self.acceptable_pause) / std
+        exponent = y * (1.5976 + 0.070566 * y * y)
+        if y > 0:
+            # -log10(e / (1 + e)) при e = exp(-exponent), без потери точности на очень малых e
+            return exponent / math.log(10) + math.log10(1.0 + math.exp(-exponent))
+        if exponent < -50:
+            return 0.0
+        e = math.exp(-exponent)
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+    def last_seen(self, node_id):
+        node = self.nodes.get(node_id)
+        return None if node is None else node['last']
+
+
+class HeartbeatSender:
+    """
+    Фоновый поток узла, отправляющий heartbeat менеджеру раз в heartbeat_interval через свое соединение
+    и отдельную очередь manager_heartbeats, так что heartbeat не стоят в очереди за LOAD.
+    В heartbeat кладется последнее состояние, которое основной поток узла обновляет через set_status.
+    Поток шлет heartbeat и тогда, когда основной цикл завис, поэтому хранитель кладет в состояние
+    отметку хода цикла (progress). Если она старше main_loop_stall_timeout, поток завершает процесс:
+    heartbeat прекращаются, и реплика занимает место хранителя, только когда прежний процесс уже не держит его очередь.
+    """
+
+    def __init__(self, node_id, queue_name, queue='manager_heartbeats'):
+        self.node_id = node_id
+        self.queue_name = queue_name
+        self.queue = queue
+        self.status = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def set_status(self, status):
+        self.status = status  # замена ссылки атомарна, блокировка не нужна
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        try:
+            connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+            channel = connection.channel()
+            channel.queue_declare(queue=self.queue, durable=durability)
+
+            while True:
+                stall = time.time() - self.status.get('progress', time.time())
+                if stall > main_loop_stall_timeout:
+                    print(f"[Узел {self.node_id}] Основной цикл стоит {stall:.2f} с (больше {main_loop_stall_timeout} с), завершаю процесс")
+                    os._exit(1)  # SystemExit из этого потока не остановил бы зависший основной поток
+
+                message = {'node_id': self.node_id, 'queue_name': self.queue_name, 'sent': time.time(), **self.status}
+                channel.basic_publish(exchange='', routing_key=self.queue, body=json.dumps(message))
+                connection.sleep(heartbeat_interval)
+
+        except Exception as e:
+            print(f"[Ошибка] в отправке heartbeat узла {self.node_id}: {e}")
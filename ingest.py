@@ -0,0 +1,188 @@
+from datetime import datetime
+import json
+import numpy as np
+import pandas as pd
+
+# Возможные имена столбцов с датой
+possible_date_columns = ['date', 'datetime_utc', 'Date.Full', 'DATE']
+
+# Формат даты, в котором даты хранятся и маршрутизируются
+date_output_format = "%d-%m-%Y"
+
+# Известные форматы дат в исходных файлах (порядок совпадает с convert_date)
+DATE_FORMAT_NUMERIC = 'numeric'    # 20000120 (годмесяцдень, число)
+DATE_FORMAT_ISO = 'iso'            # 2012-01-31 (год-месяц-число)
+DATE_FORMAT_WITH_TIME = 'with_time'  # 19970527-15:00 (годмесяцдень-время)
+
+# Сколько значений столбца проверяем при определении формата
+format_sample_size = 100
+
+
+def convert_date(date_str):
+
+    # Третий формат: 20000120 (годмесяцдень)
+    try:
+        date_str = str(int(date_str))  # Преобразуем в строку, отбрасывая десятичную часть
+        return datetime.strptime(date_str, "%Y%m%d").strftime("%d-%m-%Y")
+    except ValueError:
+        pass
+
+    # Первый формат: 2012-01-31 (год-месяц-число)
+    try:
+        return datetime.strptime(date_str, "%Y-%m-%d").strftime("%d-%m-%Y")
+    except ValueError:
+        pass
+
+    # Второй формат: 19970527-15:00 (годмесяцдень-время)
+    try:
+        return datetime.strptime(date_str.split('-')[0], "%Y%m%d").strftime("%d-%m-%Y")
+    except ValueError:
+        pass
+
+    # Если не удается распознать формат
+    return None
+
+
+def _convert_value(value):
+    """convert_date для одного значения, пропуски в данных сразу дают None"""
+    if pd.isna(value):
+        return None
+    return convert_date(value)
+
+
+def find_date_column(columns):
+    """Возвращает имя столбца с датой (или None, если такого нет)"""
+    for column in possible_date_columns:
+        if column in columns:
+            return column
+    return None
+
+
+def _parse_with_format(column, date_format):
+    """Векторно разбирает столбец в указанном формате, нераспознанные значения -> NaT"""
+    if date_format == DATE_FORMAT_NUMERIC:
+        numbers = pd.to_numeric(column, errors='coerce')
+        # Отбрасываем дробную часть, как str(int(x)) в convert_date
+        strings = numbers.dropna().astype('int64').astype(str).reindex(column.index)
+        return pd.to_datetime(strings, format="%Y%m%d", errors='coerce')
+
+    strings = column.astype(str)
+    if date_format == DATE_FORMAT_ISO:
+        return pd.to_datetime(strings, format="%Y-%m-%d", errors='coerce')
+    if date_format == DATE_FORMAT_WITH_TIME:
+        return pd.to_datetime(strings.str.split('-').str[0], format="%Y%m%d", errors='coerce')
+
+    raise ValueError(f"Неизвестный формат даты: {date_format}")
+
+
+def detect_date_format(column):
+    """
+    Определяет формат даты один раз на весь столбец по выборке значений.
+    Возвращает None, если ни один из известных форматов не подходит ко всей выборке.
+    """
+    sample = column.dropna().head(format_sample_size)
+    if sample.empty:
+        return None
+
+    for date_format in (DATE_FORMAT_NUMERIC, DATE_FORMAT_ISO, DATE_FORMAT_WITH_TIME):
+        if _parse_with_format(sample, date_format).notna().all():
+            return date_format
+
+    return None
+
+
+def parse_date_column(column):
+    """
+    Преобразует весь столбец дат в строки формата '%d-%m-%Y' одним векторным вызовом.
+    Значения, которые не удалось распознать, становятся None (как в convert_date).
+    """
+    date_format = detect_date_format(column)
+
+    if date_format is None:
+        # Смешанный или неизвестный формат - разбираем по одному разу на каждое уникальное значение
+        codes, uniques = pd.factorize(column, use_na_sentinel=False)
+        converted = np.array([_convert_value(value) for value in uniques], dtype=object)
+        return converted[codes]
+
+    parsed = _parse_with_format(column, date_format)
+    result = parsed.dt.strftime(date_output_format).to_numpy(dtype=object)
+
+    # Строки, не подошедшие под общий формат, добираем построчным разбором
+    missing = parsed.isna().to_numpy()
+    if missing.any():
+        result[missing] = [_convert_value(value) for value in column[missing]]
+
+    return result
+
+
+def route_dates(dates, consistent_hashing):
+    """
+    Определяет хранителя для каждой даты, вычисляя хэш только один раз на уникальную дату.
+    Возвращает массив id хранителей той же длины, что и dates.
+    """
+    codes, uniques = pd.factorize(pd.Series(dates, dtype=object), use_na_sentinel=False)
+    unique_storages = consistent_hashing.get_storage_many(str(date) for date in uniques)
+    return unique_storages[codes]
+
+
+def partition_rows(data, consistent_hashing):
+    """
+    Разбирает DataFrame по столбцам и группирует строки по хранителям до сериализации.
+    Возвращает словарь {id хранителя: список строк-словарей с добавленным 'date_parsed'}.
+    """
+    date_column = find_date_column(data.columns)
+    if date_column is None:
+        raise ValueError("В файле не найден столбец с датой")
+
+    data = data.copy()
+    data['date_parsed'] = parse_date_column(data[date_column])
+    storage_ids = route_dates(data['date_parsed'].to_numpy(dtype=object), consistent_hashing)
+
+    partitions = {}
+    for storage_id in np.unique(storage_ids):
+        part = data[storage_ids == storage_id]
+        partitions[int(storage_id)] = part.to_dict(orient='records')
+
+    return partitions
+
+
+def group_rows(rows, consistent_hashing):
+    """
+    Заново группирует по хранителям уже разобранные строки (с 'date_parsed') - те, что задание
+    не успело отправить до изменения кольца. Возвращает словарь того же вида, что partition_rows.
+    """
+    storage_ids = route_dates([row['date_parsed'] for row in rows], consistent_hashing)
+
+    partitions = {}
+    for row, storage_id in zip(rows, storage_ids):
+        partitions.setdefault(int(storage_id), []).append(row)
+    return partitions
+
+
+def build_batches(rows, max_rows, max_bytes, command='LOAD_BATCH'):
+    """
+    Упаковывает строки в тела сообщений вида {"command": ..., "data": [строки]}.
+    Каждая строка сериализуется ровно один раз; в сообщение попадает не больше max_rows строк
+    и не больше max_bytes байт (строка, которая одна больше лимита, уходит отдельным сообщением).
+    """
+    prefix = f'{{"command": {json.dumps(command)}, "data": ['.encode()
+    suffix = b']}'
+
+    batch = []
+    batch_bytes = len(prefix) + len(suffix)
+
+    for row in rows:
+        encoded = json.dumps(row).encode()
+        row_bytes = len(encoded) + (1 if batch else 0)  # запятая между строками
+
+        if batch and (len(batch) >= max_rows or batch_bytes + row_bytes > max_bytes):
+            yield prefix + b','.join(batch) + suffix
+            batch = []
+            batch_bytes = len(prefix) + len(suffix)
+            row_bytes = len(encoded)
+
+        batch.append(encoded)
+        batch_bytes += row_bytes
+
+    if batch:
+        yield prefix + b','.join(batch) + suffix
@@ -0,0 +1,47 @@
+import time
+import threading
+
+
+class LoadJob:
+    """
+    Фоновое задание LOAD: менеджер публикует строки файла в отдельном потоке со своим соединением,
+    а основной цикл продолжает отвечать на GET. Поток отмечает здесь прогресс и проверяет запрос отмены.
+    """
+
+    def __init__(self, job_id, file_path, stream):
+        self.job_id = job_id
+        self.file_path = file_path
+        self.stream = stream
+        self.status = 'running'  # running / done / failed / cancelled
+        self.rows_published = 0
+        self.rows_total = None  # известно после разбора файла (в потоковом режиме - только в конце)
+        self.started = time.time()
+        self.finished = None
+        self.error = None
+        self.cancel_requested = threading.Event()
+
+    def cancel(self):
+        self.cancel_requested.set()
+
+    def cancelled(self):
+        return self.cancel_requested.is_set()
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished = time.time()
+
+    def progress(self):
+        """Состояние задания для команд JOBS и JOB"""
+        seconds = (self.finished or time.time()) - self.started
+        return {
+            'job_id': self.job_id,
+            'file': self.file_path,
+            'mode': 'STREAM' if self.stream else 'BATCH',
+            'status': self.status,
+            'rows_published': self.rows_published,
+            'rows_total': self.rows_total,
+            'rows_per_second': round(self.rows_published / seconds, 1) if seconds > 0 else 0.0,
+            'seconds': round(seconds, 3),
+            'error': self.error,
+        }
@@ -0,0 +1,208 @@
+import json
+import time
+import hashlib
+
+from config import merkle_buckets, anti_entropy_interval, anti_entropy_timeout, chunk_size, durability, print_each_step
+
+digest_mask = (1 << 64) - 1
+
+
+def hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+def row_hash(row):
+    return hash64(json.dumps(row, sort_keys=True).encode())
+
+
+class MerkleIndex:
+    """
+    Дерево хэшей над корзинами дат хранилища. Дата попадает в корзину по своему хэшу, хэш корзины -
+    сумма хэшей ее дат, хэш даты - сумма хэшей ее строк. Суммы не зависят от порядка строк, поэтому
+    хранитель и реплика, получившие одни и те же строки в разном порядке, дают одинаковые деревья.
+    Хэш даты кэшируется по ее версии в хранилище (номер последней замены и число строк) и пересчитывается
+    только для изменившихся дат - в том числе замененных через update тем же числом строк.
+    """
+
+    def __init__(self, store, num_buckets=merkle_buckets):
+        self.store = store
+        self.num_buckets = num_buckets
+        self.depth = max(0, (num_buckets - 1).bit_length())  # листьев 2 ** depth
+        self.digests = {}  # дата -> (версия даты, хэш строк)
+        self.buckets = {}  # дата -> номер корзины
+
+    def bucket_of(self, date):
+        bucket = self.buckets.get(date)
+        if bucket is None:
+            bucket = self.buckets[date] = hash64(date.encode()) % (1 << self.depth)
+        return bucket
+
+    def date_digest(self, date):
+        version = self.store.date_version(date)
+        cached = self.digests.get(date)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        digest = 0
+        for row in self.store.get(date, []):
+            digest = (digest + row_hash(row)) & digest_mask
+        self.digests[date] = (version, digest)
+        return digest
+
+    def build(self):
+        """Уровни дерева: levels[0] - [корень], levels[depth] - хэши корзин"""
+        leaves = [0] * (1 << self.depth)
+        for date in self.store.dates():
+            leaves[self.bucket_of(date)] = (leaves[self.bucket_of(date)] + hash64(f'{date}:{self.date_digest(date)}'.encode())) & digest_mask
+
+        # Забываем хэши удаленных дат
+        if len(self.digests) > len(self.store):
+            self.digests = {date: value for date, value in self.digests.items() if date in self.store}
+
+        levels = [leaves]
+        while len(levels[0]) > 1:
+            below = levels[0]
+            levels.insert(0, [hash64(below[i].to_bytes(8, 'big') + below[i + 1].to_bytes(8, 'big')) for i in range(0, len(below), 2)])
+        return levels
+
+    def dates_in_buckets(self, buckets):
+        """Хэши дат из указанных корзин"""
+        buckets = set(buckets)
+        return {date: self.date_digest(date) for date in self.store.dates() if self.bucket_of(date) in buckets}
+
+
+class AntiEntropy:
+    """
+    Фоновая сверка хранителя с репликой. Раз в anti_entropy_interval хранитель строит свое дерево и спускается
+    по нему вместе с репликой (MERKLE): на каждом уровне запрашиваются только дети несовпавших узлов.
+    Для несовпавших корзин реплика присылает хэши своих дат (MERKLE_DATES), и хранитель отправляет ей
+    только расходящиеся даты (REPAIR). Объем передачи растет с расхождением, а не с размером раздела.
+    """
+
+    def __init__(self, node_id, connection, channel, store, replication, replica_queue, reply_queue):
+        self.node_id = node_id
+        self.connection = connection
+        self.channel = channel
+        self.store = store
+        self.replication = replication
+        self.replica_queue = replica_queue
+        self.reply_queue = reply_queue
+        self.index = MerkleIndex(store)
+
+        self.round = 0
+        self.tree = None  # дерево хранителя в текущем раунде
+        self.round_started = None  # None - раунд не идет
+        self.paused = lambda: False  # хранитель подставляет проверку, можно ли сейчас сверяться
+
+        self.stats = {'rounds': 0, 'divergent_rounds': 0, 'requests': 0, 'repaired_dates': 0, 'removed_dates': 0, 'repaired_rows': 0, 'last_round_seconds': None}
+
+        self.channel.queue_declare(queue=reply_queue, durable=durability)
+        self.channel.basic_consume(queue=reply_queue, on_message_callback=self.on_reply, auto_ack=True)
+
+    def schedule(self):
+        self.connection.call_later(anti_entropy_interval, self.on_timer)
+
+    def on_timer(self):
+        try:
+            if self.round_started is not None and time.time() - self.round_started > anti_entropy_timeout:
+                print(f"[Хранитель-{self.node_id}] Реплика не ответила на сверку {self.round}, раунд прерван")
+                self.round_started = None
+
+            # Пока реплике идут пачки репликации, деревья расходятся законно - сверяемся, когда отставания нет
+            if self.round_started is None and self.replication.lag_rows() == 0 and not self.paused():
+                self.start_round()
+        finally:
+            self.schedule()
+
+    def start_round(self):
+        self.round += 1
+        self.round_started = time.time()
+        self.tree = self.index.build()
+        self.request({'command': 'MERKLE', 'level': 0, 'nodes': [0]})
+
+    def request(self, message):
+        self.stats['requests'] += 1
+        message.update({'round': self.round, 'reply_to': self.reply_queue})
+        self.channel.basic_publish(exchange='', routing_key=self.replica_queue, body=json.dumps(message))
+
+    def on_reply(self, ch, method, properties, body):
+        reply = json.loads(body)
+        if reply['round'] != self.round or self.round_started is None:
+            return  # ответ на прерванный раунд
+
+        if reply['command'] == 'MERKLE':
+            level = reply['level']
+            differing = [int(node) for node, value in reply['hashes'].items() if value != self.tree[level][int(node)]]
+
+            if not differing:
+                self.finish_round(divergent=level > 0)
+            elif level + 1 < len(self.tree):
+                self.request({'command': 'MERKLE', 'level': level + 1, 'nodes': [child for node in differing for child in (2 * node, 2 * node + 1)]})
+            else:
+                self.request({'command': 'MERKLE_DATES', 'buckets': differing})
+
+        elif reply['command'] == 'MERKLE_DATES':
+            self.repair(reply['buckets'], reply['dates'])
+
+    def repair(self, buckets, replica_dates):
+        """Отправляет реплике расходящиеся даты целиком (реплика заменяет их) и список дат, которых у хранителя нет"""
+        own = self.index.dates_in_buckets(buckets)
+        changed = [date for date, digest in own.items() if replica_dates.get(date) != digest]
+        removed = [date for date in replica_dates if date not in own]
+
+        # Строки, еще ждущие в буфере репликации, должны дойти до реплики раньше замены дат
+        self.replication.flush()
+
+        for i in range(0, max(len(changed), 1), chunk_size):
+            data = {date: self.store.get(date) for date in changed[i:i + chunk_size]}
+            request = {'command': 'REPAIR', 'data': data, 'remove': removed if i == 0 else []}
+            self.channel.basic_publish(exchange='', routing_key=self.replica_queue, body=json.dumps(request))
+            self.stats['repaired_rows'] += sum(len(rows) for rows in data.values())
+
+        self.stats['repaired_dates'] += len(changed)
+        self.stats['removed_dates'] += len(removed)
+        print(f"[Хранитель-{self.node_id}] Сверка с репликой: расходятся {len(buckets)} корзин, исправлено {len(changed)} дат, удалено {len(removed)}")
+        self.finish_round(divergent=True)
+
+    def finish_round(self, divergent):
+        self.stats['rounds'] += 1
+        self.stats['divergent_rounds'] += int(divergent)
+        self.stats['last_round_seconds'] = round(time.time() - self.round_started, 3)
+        self.round_started = None
+        self.tree = None
+
+        if print_each_step and not divergent:
+            print(f"[Хранитель-{self.node_id}] Сверка с репликой: расхождений нет")
+
+    def status(self):
+        return dict(self.stats)
+
+
+class MerkleResponder:
+    """Ответы реплики на сверку: дерево строится один раз на раунд и переиспользуется на всех уровнях"""
+
+    def __init__(self, channel, store):
+        self.channel = channel
+        self.index = MerkleIndex(store)
+        self.round = None
+        self.tree = None
+
+    def handle(self, request):
+        command = request['command']
+        if command == 'MERKLE':
+            if request['level'] == 0 or request['round'] != self.round:
+                self.round = request['round']
+                self.tree = self.index.build()
+            level = self.tree[request['level']]
+            reply = {'hashes': {node: level[node] for node in request['nodes']}, 'level': request['level']}
+
+        elif command == 'MERKLE_DATES':
+            reply = {'buckets': request['buckets'], 'dates': self.index.dates_in_buckets(request['buckets'])}
+
+        else:  # REPAIR
+            self.index.store.remove_dates(request['remove'])
+            self.index.store.update(request['data'])
+            return
+
+        reply.update({'command': command, 'round': request['round']})
+        self.channel.basic_publish(exchange='', routing_key=request['reply_to'], body=json.dumps(reply))
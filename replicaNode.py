@@ -1,13 +1,24 @@
 import pika
 import json
 import sys
+from hashing import ConsistentHashing
+from segment_store import open_store, drop_store
+from transfer import ChunkSender, byte_chunks, decode_rows
+from merkle import MerkleResponder
 
-from config import num_storages, print_each_step, durability, chunk_size, print_every_chunk
+from config import num_storages, print_each_step, durability, print_every_chunk
 
 class ReplicaNode:
-    def __init__(self, storage_id):
+    def __init__(self, storage_id, store_name=None):
         self.storage_id = storage_id
-        self.data = {}  # Хранилище данных (ключ - дата, значение - список записей)
+        self.applied_seq = 0  # номер последней примененной пачки REPLICATE
+        self.pipeline = None  # конвейер репликации (процесс хранителя), к которому относится applied_seq
+        self.promotion = None  # запрос PROMOTE, если реплика должна занять место упавшего хранителя
+
+        # Новая реплика после повышения прежней строится с нуля в своей папке (старая теперь у хранителя)
+        if store_name is not None:
+            drop_store(store_name)
+        self.data = open_store(store_name or f'replica-{storage_id}')  # Хранилище данных (ключ - дата, значение - список записей) в столбцовом виде, при persistence_enabled - еще и на диске
 
         # Подключение к RabbitMQ
         self.connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
@@ -17,13 +28,18 @@ class ReplicaNode:
         self.replica_queue = f'replica-{storage_id}'
         self.channel.queue_declare(queue=self.replica_queue, durable=durability)
 
+        self.merkle = MerkleResponder(self.channel, self.data)  # ответы хранителю на сверку по дереву хэшей
+
         # Устанавливаем обработчик сообщений
-        self.channel.basic_consume(
+        self.consumer_tag = self.channel.basic_consume(
             queue=self.replica_queue, on_message_callback=self.handle_request, auto_ack=True
         )
+        self.pending = []  # сообщения, доставленные после PROMOTE, но еще не разобранные (auto_ack - брокер их уже отдал)
+
+        if len(self.data):
+            print(f"[Реплика-{self.storage_id}] Восстановила с диска {self.data.row_count()} строк за {len(self.data)} дат")
 
         print(f'[Реплика-{self.storage_id}] Запущена и ожидает данные...')
-        self.channel.start_consuming()
 
 
     def handle_request(self, ch, method, properties, body):
@@ -34,64 +50,86 @@ class ReplicaNode:
             if command == 'LOAD':
                 row = request['data']
                 date = row['date_parsed']
-                if date not in self.data:
-                    self.data[date] = []
-                self.data[date].append(row)
+                self.data.append(row)
 
                 if print_each_step:
                     print(f"[Реплика-{self.storage_id}] Копия данных сохранена: {row}")
 
-            elif command == 'COPY_2':
+            elif command == 'LOAD_BATCH':
+                rows = request['data']
+                self.data.append_rows(rows)
+
+                if print_each_step:
+                    print(f"[Реплика-{self.storage_id}] Копия пачки из {len(rows)} строк сохранена")
+
+            elif command == 'REPLICATE': # Пачка из конвейера репликации хранителя
+                seq = request['seq']
+
+                # Хранитель перезапустился (или реплику повысили): его нумерация пачек началась заново
+                if request.get('pipeline') != self.pipeline:
+                    self.pipeline = request.get('pipeline')
+                    self.applied_seq = request['base_seq'] - 1
+
+                # Все до base_seq хранитель уже считает подтвержденным (например, реплика перезапустилась) - не ждем их
+                if self.applied_seq < request['base_seq'] - 1:
+                    self.applied_seq = request['base_seq'] - 1
+
+                # Применяем строго по порядку; повторы и пачки после пропуска отбрасываем, хранитель переотправит
+                if seq == self.applied_seq + 1:
+                    self.data.append_rows(request['data'])
+                    self.applied_seq = seq
+
+                    if print_each_step:
+                        print(f"[Реплика-{self.storage_id}] Пачка репликации {seq} из {len(request['data'])} строк сохранена")
 
-                received_data = request['data']
-                reply_to = request['reply_to']
-                replica_id = request['replica_id']
-                chunk_id = request['chunk_id']
-                total_chunks = request['total_chunks']
-                
-                self.data.update(received_data)
+                self.channel.basic_publish(exchange='', routing_key=request['ack_to'], body=json.dumps({'seq': self.applied_seq, 'pipeline': self.pipeline}))
+
+            elif command in ('MERKLE', 'MERKLE_DATES', 'REPAIR'): # Сверка с хранителем и исправление расхождений
+                self.merkle.handle(request)
+
+            elif command == 'REMOVE_DATES': # Даты переехали к новому хранителю после JOIN
+                self.data.remove_dates(request['dates'])
+
+                if print_each_step:
+                    print(f"[Реплика-{self.storage_id}] Удалены {len(request['dates'])} дат, переехавших к хранителю {request['target']}")
+
+            elif command == 'COPY_2': # Порция, которую хранитель получил от реплики упавшего хранителя и применил у себя
+                rows = decode_rows(request)
+                self.data.append_rows(rows)
 
                 if print_every_chunk:
-                    print(f"[Реплика-{self.storage_id}] Восстановленные данные чанка {chunk_id + 1} сохранены")
+                    print(f"[Реплика-{self.storage_id}] Восстановленные данные порции {request['chunk_id'] + 1} ({len(rows)} строк) сохранены")
 
 
             elif command == 'RELOCATE':
 
-                def chunk_data(data, chunk_size=1000):
-                    """Функция для разбиения словаря на части."""
-                    items = list(data.items())
-                    for i in range(0, len(items), chunk_size):
-                        chunk = dict(items[i:i + chunk_size])
-                        yield chunk
-
                 relocation_storage_id = request['storage_id']
 
-                # Считаем количество чанков для разбиения данных
-                total_chunks = (len(self.data) + (chunk_size - 1)) // chunk_size  # Примерно, делим на chunk_size и округляем вверх
-
-
-                # Разбиваем данные на части
-                chunks = chunk_data(self.data, chunk_size=chunk_size)  # Можно выбрать размер чанка
-                
-                # Для каждого чанка отправляем отдельное сообщение
-                for id, chunk in enumerate(chunks):
-                    load_request = {
-                        'command': 'LOAD_2',
-                        'data': chunk,  # Отправляем только одну часть данных
-                        'reply_to': request['reply_to'],
-                        'replica_id': self.storage_id,
-                        'chunk_id': id,  # Индекс чанка для восстановления
-                        'total_chunks': total_chunks  # Общее количество чанков
-                    }
-                    
-                    # Отправляем сообщение в RabbitMQ
-                    self.channel.basic_publish(
-                        exchange='',
-                        routing_key=f'storage-{relocation_storage_id}',
-                        body=json.dumps(load_request)
-                    )
+                # Раскладываем даты по новым владельцам: с виртуальными узлами дуги умершего хранителя
+                # достаются разным соседям. Без состава кольца (старый менеджер) отдаем все одному хранителю.
+                # Раскладываются только даты, строки собираются по мере отправки порций
+                dates = list(self.data.dates())
+                if 'ring_storages' in request:
+                    owners = ConsistentHashing.from_message(request).get_storage_many(dates).tolist()
+                else:
+                    owners = [relocation_storage_id] * len(dates)
+
+                partitions = {}
+                for date, owner in zip(dates, owners):
+                    partitions.setdefault(owner, []).append(date)
 
-                print(f"[Реплика-{self.storage_id}] Отправила все собственные данные хранителю с id {relocation_storage_id} (разбила данные на {total_chunks} чанков для пересылки)")
+                sender = ChunkSender(self.connection, self.channel, f'transfer_acks-{self.replica_queue}')
+                for target_storage_id, target_dates in partitions.items():
+                    fields = {'command': 'LOAD_2', 'reply_to': request['reply_to'], 'replica_id': self.storage_id}
+                    stats = sender.send(f'storage-{target_storage_id}', fields, byte_chunks(self.data, target_dates))
+
+                    response = (f"[Реплика-{self.storage_id}] Передала хранителю {target_storage_id} {len(target_dates)} дат: "
+                                f"{stats['chunks']} порций, {stats['raw_bytes']} -> {stats['sent_bytes']} байт ({stats['codec']}), "
+                                f"повторов {stats['retries']}, {stats['seconds']} с")
+                    print(response)
+                    self.channel.basic_publish(exchange='', routing_key=request['reply_to'], body=json.dumps({
+                        'data': response, 'node_id': self.storage_id, 'queue_name': self.replica_queue
+                    }))
 
                 print(f"[Реплика-{self.storage_id}] Завершаю работу.")
                 self.channel.stop_consuming() 
@@ -100,17 +138,30 @@ class ReplicaNode:
                 raise SystemExit() 
                 # return
             
+            elif command == 'PROMOTE': # Хранитель упал: выходим из цикла, дальше процесс работает хранителем с этими же данными
+                if self.promotion is None:
+                    # С auto_ack сообщения за PROMOTE брокер уже отдал: отменяем подписку и забираем их, чтобы разобрать перед выходом
+                    self.pending = self.channel.basic_cancel(self.consumer_tag)
+                    self.channel.stop_consuming()
+                self.promotion = request
+                print(f"[Реплика-{self.storage_id}] Получен PROMOTE, занимаю место хранителя {self.storage_id} ({self.data.row_count()} строк)")
+
             elif command == 'GET':
                 date = request['date']
+                # GET FRESH, переданный хранителем: с его версией даты, чтобы менеджер закэшировал ответ
+                forwarded = {'forwarded_by': request['forwarded_by'], **request.get('cache_version', {})} if 'forwarded_by' in request else {}
 
                 if date in self.data:
-                    response = self.data[date]
+                    response = self.data.get(date) # Строки собираются из столбцов только здесь
 
                     # Добавляем дополнительные сведения
                     response_with_info = {
+                        'command': 'GET',
+                        'date': date,
                         'data': response,
                         'node_id': self.storage_id,
-                        'queue_name': "TEST"
+                        'queue_name': self.replica_queue,
+                        **forwarded
                     }
 
                     self.channel.basic_publish(exchange='', routing_key=request['reply_to'], body=json.dumps(response_with_info))
@@ -120,9 +171,12 @@ class ReplicaNode:
 
                     # Добавляем дополнительные сведения
                     response_with_info = {
+                        'command': 'GET',
+                        'date': date,
                         'data': response,
                         'node_id': self.storage_id,
-                        'queue_name': "SSS"
+                        'queue_name': self.replica_queue,
+                        **forwarded
                     }
 
                     print(f"[Реплика-{self.storage_id}] Данные за {date} не найдены")
@@ -133,5 +187,24 @@ class ReplicaNode:
             
     
     def start(self):
+        """Разбирает очередь реплики до остановки; после PROMOTE соединение закрывается, а self.promotion заполнен"""
         print(f"[Реплика-{self.storage_id}] Запущена и ждет запросы...")
         self.channel.start_consuming()
+        if self.promotion is not None:
+            self.drain()
+            self.connection.close()
+
+    def drain(self):
+        """
+        После PROMOTE дорабатывает как реплика все, что пришло в ее очередь до повышения: пачки REPLICATE
+        упавшего хранителя и GET менеджера. Новый хранитель очистит очередь реплики, поэтому здесь ничего не теряется.
+        """
+        for method, properties, body in self.pending:
+            self.handle_request(self.channel, method, properties, body)
+        self.pending = []
+
+        while True:
+            method, properties, body = self.channel.basic_get(queue=self.replica_queue, auto_ack=True)
+            if method is None:
+                return
+            self.handle_request(self.channel, method, properties, body)
@@ -0,0 +1,161 @@
+import time
+import json
+import uuid
+from collections import OrderedDict
+
+from config import (replication_batch_rows, replication_flush_interval, replication_max_lag_rows,
+                    replication_resend_timeout, replication_wait_timeout, print_each_step)
+
+
+class ReplicationPipeline:
+    """
+    Отложенная (write-behind) репликация строк хранителя в его реплику.
+    Строки копятся в буфере и уходят одним сообщением REPLICATE, когда набралось replication_batch_rows
+    строк или прошло replication_flush_interval секунд. Каждой пачке присваивается номер (seq),
+    реплика применяет пачки строго по порядку и подтверждает номер последней примененной.
+    Неподтвержденные пачки через replication_resend_timeout отправляются заново (go-back-N).
+    Объем нереплицированных данных ограничен replication_max_lag_rows.
+    Подтверждения забираются из очереди через basic_get (poll_acks), а не подпиской: replicate вызывается
+    из обработчика сообщения или таймера, а внутри них pika не вызывает обработчики других сообщений.
+    """
+
+    def __init__(self, node_id, connection, channel, replica_queue, ack_queue):
+        self.node_id = node_id
+        self.connection = connection
+        self.channel = channel
+        self.replica_queue = replica_queue
+        self.ack_queue = ack_queue
+
+        self.buffer = []  # строки, еще не отправленные реплике
+        self.buffer_since = None  # когда в пустой буфер попала первая строка
+        self.seq = 0  # номер последней отправленной пачки
+        self.acked_seq = 0  # номер последней подтвержденной репликой пачки
+        self.unacked = OrderedDict()  # seq -> {'rows': [...], 'sent': время последней отправки}
+        self.unacked_rows = 0
+        self.timer_scheduled = False
+        # Нумерация пачек начинается заново в каждом процессе хранителя: по этому полю реплика понимает, что ее
+        # applied_seq относится к прежнему конвейеру, а хранитель - что подтверждение пришло не на его пачки
+        self.incarnation = uuid.uuid4().hex
+
+    def replicate(self, rows):
+        """Ставит строки в очередь на репликацию"""
+        if not self.buffer:
+            self.buffer_since = time.time()
+        self.buffer.extend(rows)
+
+        if len(self.buffer) >= replication_batch_rows:
+            self.flush()
+        self.schedule_timer()
+
+        if self.lag_rows() > replication_max_lag_rows:
+            self.wait_for_acks()
+
+    def on_timer(self):
+        """Срабатывание по времени: отправляем накопленное и переотправляем зависшие пачки"""
+        self.timer_scheduled = False
+        self.poll_acks()
+        self.flush()
+        self.resend_expired()
+
+        self.schedule_timer()
+
+    def schedule_timer(self):
+        """Таймер нужен, пока есть неотправленные строки или неподтвержденные пачки (для переотправки)"""
+        if not self.timer_scheduled and (self.buffer or self.unacked):
+            self.timer_scheduled = True
+            self.connection.call_later(replication_flush_interval, self.on_timer)
+
+    def flush(self):
+        """Отправляет буфер реплике одной пачкой"""
+        if not self.buffer:
+            return
+
+        rows, self.buffer = self.buffer, []
+        self.seq += 1
+        self.unacked[self.seq] = {'rows': rows, 'sent': time.time()}
+        self.unacked_rows += len(rows)
+        self._publish(self.seq, rows)
+
+        if print_each_step:
+            print(f"[Хранитель-{self.node_id}] Отправил реплике пачку {self.seq} из {len(rows)} строк")
+
+    def _publish(self, seq, rows):
+        request = {
+            'command': 'REPLICATE',
+            'seq': seq,
+            'pipeline': self.incarnation,
+            'base_seq': next(iter(self.unacked)),  # все пачки до base_seq реплика уже подтвердила
+            'data': rows,
+            'ack_to': self.ack_queue,
+        }
+        self.channel.basic_publish(exchange='', routing_key=self.replica_queue, body=json.dumps(request))
+
+    def resend_expired(self):
+        """Если самая старая пачка не подтверждена вовремя, отправляем заново ее и все следующие"""
+        if not self.unacked:
+            return
+
+        oldest = next(iter(self.unacked.values()))
+        if time.time() - oldest['sent'] < replication_resend_timeout:
+            return
+
+        print(f"[Хранитель-{self.node_id}] Реплика не подтвердила пачки {list(self.unacked)[0]}..{self.seq}, отправляю заново")
+        now = time.time()
+        for seq, batch in self.unacked.items():
+            batch['sent'] = now
+            self._publish(seq, batch['rows'])
+
+    def poll_acks(self):
+        """Применяет все подтверждения, лежащие в очереди"""
+        while True:
+            method, _, body = self.channel.basic_get(queue=self.ack_queue, auto_ack=True)
+            if method is None:
+                return
+            self.on_ack(body)
+
+    def on_ack(self, body):
+        """Подтверждение от реплики: все пачки с номером не больше seq применены"""
+        ack = json.loads(body)
+        if ack.get('pipeline') != self.incarnation:
+            return  # номер пачки прежнего конвейера (до перезапуска хранителя), к нашим пачкам отношения не имеет
+        seq = ack['seq']
+
+        while self.unacked and next(iter(self.unacked)) <= seq:
+            _, batch = self.unacked.popitem(last=False)
+            self.unacked_rows -= len(batch['rows'])
+        self.acked_seq = max(self.acked_seq, seq)
+
+    def wait_for_acks(self):
+        """Ограничение отставания: отправляем буфер и ждем подтверждений, пока отставание не станет допустимым"""
+        self.flush()
+        deadline = time.time() + replication_wait_timeout
+        while True:
+            self.poll_acks()
+            if self.lag_rows() <= replication_max_lag_rows or time.time() >= deadline:
+                break
+            # sleep соединения продолжает обслуживать heartbeat'ы брокера, в отличие от time.sleep
+            self.connection.sleep(replication_flush_interval)
+            self.resend_expired()
+
+        if self.lag_rows() > replication_max_lag_rows:
+            print(f"[Хранитель-{self.node_id}] Реплика отстает на {self.lag_rows()} строк (больше {replication_max_lag_rows})")
+
+    def lag_rows(self):
+        """Сколько строк еще не подтверждено репликой (в буфере и в отправленных пачках)"""
+        return len(self.buffer) + self.unacked_rows
+
+    def status(self):
+        """Состояние репликации для heartbeat"""
+        # Возраст самых старых нереплицированных данных: первая неподтвержденная пачка или начало буфера
+        candidates = [next(iter(self.unacked.values()))['sent']] if self.unacked else []
+        if self.buffer:
+            candidates.append(self.buffer_since)
+        oldest = min(candidates) if candidates else None
+        return {
+            'lag_rows': self.lag_rows(),
+            'buffered_rows': len(self.buffer),
+            'unacked_batches': len(self.unacked),
+            'last_sent_seq': self.seq,
+            'last_acked_seq': self.acked_seq,
+            'lag_seconds': round(time.time() - oldest, 3) if oldest is not None else 0.0,
+        }
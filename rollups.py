@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+granularities = ('day', 'month', 'year')
+
+
+def month_end(date):
+    """Последний день месяца даты"""
+    following = datetime(date.year + date.month // 12, date.month % 12 + 1, 1)
+    return following - timedelta(days=1)
+
+
+class Rollups:
+    """
+    Сводки витрины по месяцам и годам поверх дней (days - словарь витрины: дата -> (средняя, количество)).
+    На каждом уровне хранится сумма средних температур дней и число дней с данными, поэтому среднее
+    любого периода - сумма / дни, как у temp_range_avg. Сводки обновляются на каждой записи в витрину.
+    Диапазон раскладывается на целые годы, целые месяцы и отдельные дни только на краях: запрос
+    за 20 лет складывает около 20 годовых сводок и до двух неполных месяцев по дням.
+    """
+
+    def __init__(self, days):
+        self.days = days
+        self.months = {}  # (год, месяц) -> [сумма средних дней, дней]
+        self.years = {}  # год -> [сумма средних дней, дней]
+
+    def add(self, date, avg_delta, days_delta):
+        """Средняя дня date изменилась на avg_delta (days_delta = 1 для нового дня)"""
+        for rollup in (self.months.setdefault((date.year, date.month), [0.0, 0]), self.years.setdefault(date.year, [0.0, 0])):
+            rollup[0] += avg_delta
+            rollup[1] += days_delta
+
+    def day_sum(self, start, end):
+        total, days = 0.0, 0
+        for date in self.days.irange(start, end):
+            total += self.days[date][0]
+            days += 1
+        return total, days
+
+    def periods(self, start, end, granularity):
+        """(ключ, сумма, дней) по месяцам или годам периода; неполные месяцы и годы на краях считаются по дням"""
+        cursor = start
+        while cursor <= end:
+            if granularity == 'year':
+                period_end = datetime(cursor.year, 12, 31)
+                key = str(cursor.year)
+                whole = cursor.month == 1 and cursor.day == 1 and period_end <= end
+                total, days = self.years.get(cursor.year, (0.0, 0)) if whole else self.sum_year(cursor, min(period_end, end))
+            else:
+                period_end = month_end(cursor)
+                key = cursor.strftime('%m-%Y')
+                whole = cursor.day == 1 and period_end <= end
+                total, days = self.months.get((cursor.year, cursor.month), (0.0, 0)) if whole else self.day_sum(cursor, min(period_end, end))
+            yield key, total, days
+            cursor = period_end + timedelta(days=1)
+
+    def sum_year(self, start, end):
+        """Неполный год: целые месяцы из сводок, края - по дням"""
+        total, days = 0.0, 0
+        for _, month_total, month_days in self.periods(start, end, 'month'):
+            total += month_total
+            days += month_days
+        return total, days
+
+    def range_sum(self, start, end):
+        """Сумма средних дней и число дней за [start, end]: целые годы и месяцы из сводок, края - по дням"""
+        total, days = 0.0, 0
+        for _, period_total, period_days in self.periods(start, end, 'year'):
+            total += period_total
+            days += period_days
+        return total, days
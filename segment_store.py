@@ -0,0 +1,269 @@
+import os
+import shutil
+import json
+import mmap
+from array import array
+
+from columnar_store import Column, ColumnarStore, SchemaSegment
+
+from config import persistence_enabled, persistence_dir, snapshot_every_records, persistence_fsync
+
+# Снимок: первая строка - JSON-заголовок с описанием блоков, дальше - сырые байты столбцов и индекса.
+# Типизированные столбцы пишутся как есть и при чтении копируются из mmap одним frombytes.
+snapshot_name = 'snapshot.seg'
+snapshot_version = 1
+
+
+def log_name(generation):
+    return f'wal-{generation:08d}.log'
+
+
+def write_snapshot(store, path, next_log_generation):
+    """
+    Записывает уплотненный снимок хранилища. Файл сначала пишется во временный и затем
+    атомарно переименовывается, так что на диске всегда лежит целый снимок.
+    """
+    # Уплотняем, только если в сегментах есть строки, замененные через update
+    if store.row_count() != sum(segment.length for segment in store.segments):
+        store = store.compacted()
+
+    blobs = []
+    blobs_size = 0
+
+    def add_blob(data):
+        """Добавляет блок после заголовка и возвращает его [смещение, длина] относительно начала блоков"""
+        nonlocal blobs_size
+        blobs.append(data)
+        blobs_size += len(data)
+        return [blobs_size - len(data), len(data)]
+
+    segments = []
+    for segment in store.segments:
+        columns = []
+        for column in segment.column_data:
+            if column.kind in ('q', 'd'):
+                columns.append({'kind': column.kind, 'values': add_blob(column.values.tobytes())})
+            elif column.kind == 'o':
+                columns.append({
+                    'kind': 'o',
+                    'values': add_blob(column.values.tobytes()),
+                    'dictionary': add_blob(json.dumps(column.dictionary).encode()),
+                })
+            else:
+                columns.append({'kind': 'p', 'values': add_blob(json.dumps(column.values).encode())})
+        segments.append({'columns': list(segment.columns), 'length': segment.length, 'column_data': columns})
+
+    dates = list(store.index)
+    refs = array('q')
+    for date in dates:
+        refs.extend(store.index[date])
+
+    header = {
+        'version': snapshot_version,
+        'next_log_generation': next_log_generation,
+        'segments': segments,
+        'dates': dates,
+        'index_lengths': [len(store.index[date]) for date in dates],
+        'index': add_blob(refs.tobytes()),
+    }
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(json.dumps(header).encode() + b'\n')
+        for blob in blobs:
+            file.write(blob)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """Читает снимок через mmap. Возвращает (хранилище, номер первого журнала после снимка)"""
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return ColumnarStore(), 0
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header_end = mm.find(b'\n')
+            header = json.loads(mm[:header_end])
+            base = header_end + 1
+
+            if header['version'] != snapshot_version:
+                raise ValueError(f"Неизвестная версия снимка: {header['version']}")
+
+            def blob(position):
+                offset, length = position
+                return mm[base + offset:base + offset + length]
+
+            def typed(kind, position):
+                values = array(kind)
+                values.frombytes(blob(position))
+                return values
+
+            store = ColumnarStore()
+            for segment_header in header['segments']:
+                segment = SchemaSegment(tuple(segment_header['columns']))
+                segment.length = segment_header['length']
+                segment.column_data = []
+                for column in segment_header['column_data']:
+                    kind = column['kind']
+                    if kind in ('q', 'd'):
+                        segment.column_data.append(Column.from_parts(kind, typed(kind, column['values'])))
+                    elif kind == 'o':
+                        dictionary = json.loads(blob(column['dictionary']))
+                        segment.column_data.append(Column.from_parts('o', typed('I', column['values']), dictionary))
+                    else:
+                        segment.column_data.append(Column.from_parts('p', json.loads(blob(column['values']))))
+
+                store.schema_ids[segment.columns] = len(store.segments)
+                store.segments.append(segment)
+
+            refs = typed('q', header['index'])
+            position = 0
+            for date, length in zip(header['dates'], header['index_lengths']):
+                store.index[date] = refs[position:position + length]
+                store.add_sorted_date(date)
+                position += length
+
+    return store, header['next_log_generation']
+
+
+class DurableStore:
+    """
+    Хранилище узла с сохранением на диск: все записи сначала попадают в журнал (append-only),
+    а раз в snapshot_every_records записей состояние уплотняется в снимок и журнал начинается заново.
+    При запуске узел читает снимок и доигрывает журналы, записанные после него.
+    Для чтения ведет себя так же, как ColumnarStore.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.snapshot_path = os.path.join(directory, snapshot_name)
+        if os.path.exists(self.snapshot_path):
+            self.store, self.log_generation = read_snapshot(self.snapshot_path)
+        else:
+            self.store, self.log_generation = ColumnarStore(), 0
+
+        self.replay_logs()
+
+        self.records_since_snapshot = 0
+        self.log_file = open(os.path.join(directory, log_name(self.log_generation)), 'ab')
+
+    def log_generations(self):
+        """Номера поколений журналов, лежащих в каталоге узла, по возрастанию"""
+        return sorted(
+            int(name[4:-4]) for name in os.listdir(self.directory)
+            if name.startswith('wal-') and name.endswith('.log')
+        )
+
+    def replay_logs(self):
+        """Доигрывает журналы начиная с текущего поколения; обрезанная последняя запись (падение при записи) пропускается"""
+        for generation in self.log_generations():
+            if generation < self.log_generation:
+                continue
+            with open(os.path.join(self.directory, log_name(generation)), 'rb') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    self._apply(record)
+
+            # Дописывать в доигранный журнал нельзя (в конце может быть обрезанная запись), начинаем следующий
+            self.log_generation = generation + 1
+
+    def _apply(self, record):
+        if record['op'] == 'rows':
+            self.store.append_rows(record['rows'])
+        elif record['op'] == 'update':
+            self.store.update(record['data'])
+        elif record['op'] == 'remove':
+            self.store.remove_dates(record['dates'])
+
+    def _log(self, record):
+        self.log_file.write(json.dumps(record).encode() + b'\n')
+        self.log_file.flush()
+        if persistence_fsync:
+            os.fsync(self.log_file.fileno())
+
+        self.records_since_snapshot += 1
+
+    def _maybe_snapshot(self):
+        """Снимок делается только после применения записи к памяти, иначе он ее не увидит"""
+        if self.records_since_snapshot >= snapshot_every_records:
+            self.snapshot()
+
+    def snapshot(self):
+        """Уплотняет состояние в снимок, начинает новый журнал и удаляет старые"""
+        self.log_file.close()
+        old_generation = self.log_generation
+        self.log_generation += 1
+        self.log_file = open(os.path.join(self.directory, log_name(self.log_generation)), 'ab')
+
+        write_snapshot(self.store, self.snapshot_path, self.log_generation)
+        self.records_since_snapshot = 0
+
+        for generation in self.log_generations():
+            if generation <= old_generation:
+                os.remove(os.path.join(self.directory, log_name(generation)))
+
+    def append(self, row):
+        self.append_rows([row])
+
+    def append_rows(self, rows):
+        self._log({'op': 'rows', 'rows': rows})
+        self.store.append_rows(rows)
+        self._maybe_snapshot()
+
+    def update(self, data):
+        self._log({'op': 'update', 'data': data})
+        self.store.update(data)
+        self._maybe_snapshot()
+
+    def remove_dates(self, dates):
+        dates = list(dates)
+        self._log({'op': 'remove', 'dates': dates})
+        self.store.remove_dates(dates)
+        self._maybe_snapshot()
+
+    def get(self, date, default=None):
+        return self.store.get(date, default)
+
+    def dates(self):
+        return self.store.dates()
+
+    def items(self):
+        return self.store.items()
+
+    def dates_in_range(self, start, end):
+        return self.store.dates_in_range(start, end)
+
+    def row_count(self):
+        return self.store.row_count()
+
+    def date_row_count(self, date):
+        return self.store.date_row_count(date)
+
+    def date_version(self, date):
+        return self.store.date_version(date)
+
+    def __contains__(self, date):
+        return date in self.store
+
+    def __len__(self):
+        return len(self.store)
+
+
+def open_store(name):
+    """Хранилище для узла: с сохранением на диск, если включено persistence_enabled, иначе только в памяти"""
+    if persistence_enabled:
+        return DurableStore(os.path.join(persistence_dir, name))
+    return ColumnarStore()
+
+
+def drop_store(name):
+    """Удаляет сохраненные на диск данные узла (для узла, который строится заново)"""
+    if persistence_enabled:
+        shutil.rmtree(os.path.join(persistence_dir, name), ignore_errors=True)
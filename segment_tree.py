@@ -0,0 +1,86 @@
+from tdigest import TDigest
+
+
+class DigestSegmentTree:
+    """
+    Дерево отрезков по порядковому номеру дня: лист - скетч значений дня (TDigest с min, max, числом и суммой),
+    внутренний узел - слияние скетчей детей. Запрос по диапазону сливает O(log n) готовых узлов вместо обхода строк.
+    Запись меняет только лист и помечает его; предки пересчитываются один раз при следующем запросе,
+    поэтому LOAD из многих строк не пересобирает верх дерева на каждой строке.
+    Как и FenwickIndex, дерево покрывает дни [base, base + size) и при выходе даты за границы растет вдвое.
+    """
+
+    def __init__(self, size=1 << 12):
+        self.base = None
+        self.size = size
+        self.nodes = [None] * (2 * size)  # nodes[1] - корень, листья с nodes[size]
+        self.dirty = set()  # листья, чьих предков нужно пересчитать
+
+    def ensure(self, ordinal):
+        if self.base is None:
+            self.base = ordinal - self.size // 2
+        if self.base <= ordinal < self.base + self.size:
+            return
+
+        low = min(self.base, ordinal)
+        high = max(self.base + self.size, ordinal + 1)
+        size = self.size
+        while size < 2 * (high - low):
+            size *= 2
+        base = low - (size - (high - low)) // 2
+
+        nodes = [None] * (2 * size)
+        shift = self.base - base
+        nodes[size + shift:size + shift + self.size] = self.nodes[self.size:]
+        self.base, self.size, self.nodes = base, size, nodes
+        self.dirty = {position for position in range(size, 2 * size) if nodes[position] is not None}
+
+    def add(self, ordinal, value, weight=1):
+        self.ensure(ordinal)
+        position = self.size + ordinal - self.base
+        if self.nodes[position] is None:
+            self.nodes[position] = TDigest()
+        self.nodes[position].add(value, weight)
+        self.dirty.add(position)
+
+    def set(self, ordinal, digest):
+        """Заменяет скетч дня целиком (перестройка витрины по хранителям, восстановление с диска)"""
+        self.ensure(ordinal)
+        position = self.size + ordinal - self.base
+        self.nodes[position] = digest
+        self.dirty.add(position)
+
+    def leaves(self):
+        """(порядковый номер дня, скетч) всех дней с данными по возрастанию"""
+        if self.base is None:
+            return []
+        return [(self.base + i, node) for i, node in enumerate(self.nodes[self.size:]) if node is not None]
+
+    def refresh(self):
+        """Пересчитывает предков измененных листьев, уровень за уровнем"""
+        level = self.dirty
+        self.dirty = set()
+        while level:
+            parents = {position >> 1 for position in level if position > 1}
+            for parent in parents:
+                children = [child for child in (self.nodes[2 * parent], self.nodes[2 * parent + 1]) if child is not None]
+                self.nodes[parent] = TDigest.merged(children) if children else None
+            level = parents
+
+    def query(self, first, last):
+        """Скетч значений дней [first, last] (пустой, если данных нет)"""
+        self.refresh()
+        parts = []
+        if self.base is not None:
+            left = max(first, self.base) - self.base + self.size
+            right = min(last, self.base + self.size - 1) - self.base + self.size + 1
+            while left < right:
+                if left & 1:
+                    parts.append(self.nodes[left])
+                    left += 1
+                if right & 1:
+                    right -= 1
+                    parts.append(self.nodes[right])
+                left >>= 1
+                right >>= 1
+        return TDigest.merged(part for part in parts if part is not None)
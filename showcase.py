@@ -1,15 +1,44 @@
-import math
 import pika
 import json
 from datetime import datetime
 import threading
+import time
 from sortedcontainers import SortedDict
+from fenwick import FenwickIndex
+from segment_tree import DigestSegmentTree
+from rollups import Rollups, granularities
+from showcase_ingest import SchemaExtractors, parse_day
+from showcase_store import open_showcase_store
+from tdigest import TDigest
+
+from config import showcase_snapshot_interval, showcase_rebuild_timeout
 
 class Showcase:
-    def __init__(self):
+    def __init__(self, connect=True):
         self.accuracy = 3  # количество знаков после запятой, которые отдает клиенту
         self.data = SortedDict()  # Используем SortedDict для хранения данных
+        # Префиксные суммы по дням рядом с self.data: avg - сумма средних температур дней, days - число дней с данными
+        self.index = FenwickIndex(['avg', 'days'])
+        # Дерево отрезков по дням со скетчами значений (min, max, число, квантили) для temp_range_stats / temp_range_quantile
+        self.stats_tree = DigestSegmentTree()
+        # Сводки по месяцам и годам для temp_range с granularity month / year
+        self.rollups = Rollups(self.data)
         self.lock = threading.Lock()  # для потокобезопасности
+        self.extractors = SchemaExtractors()  # извлечение температуры по схеме файла, кэшируется по набору столбцов
+        self.rebuild = None  # текущий REBUILD: от каких хранителей еще ждем окончания и сколько дат получено
+
+        # Без подключения витрина нужна бенчмаркам и живет только в памяти
+        self.store = open_showcase_store() if connect else None
+        if self.store is not None:
+            started = time.time()
+            self.store.load(self)
+            if self.data:
+                print(f"Витрина восстановлена с диска: {len(self.data)} дат за {time.time() - started:.2f} с")
+
+        if connect:
+            self.connect()
+
+    def connect(self):
         self.connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
         self.channel = self.connection.channel()
         
@@ -24,85 +53,184 @@ class Showcase:
         self.channel.basic_consume(queue='showcase_requests',
                                   on_message_callback=self.process_request,
                                   auto_ack=True)
+
+        if self.store is not None:
+            self.connection.call_later(showcase_snapshot_interval, self.snapshot_step)
         
         print("Витрина данных запущена и ожидает сообщений...")
 
     def process_new_data(self, ch, method, properties, body):
-        """Обработка новых данных от менеджера/хранителя"""
+        """Обработка новых данных от менеджера/хранителя (одна строка LOAD или пачка LOAD_BATCH)"""
         try:
             request = json.loads(body)
-            row = request['data']
-            date_str = row['date_parsed']  # Дата гарантированно в формате '%d-%m-%Y'
-            date = datetime.strptime(date_str, '%d-%m-%Y')  # Преобразуем дату в datetime
-
-            # Возможные имена столбцов с датой
-            possible_date_columns = ['temp_max', ' _tempm', 'Data.Temperature.Avg Temp', 'BASEL_temp_mean']
-
-            # Словарь для ассоциации столбцов с числовыми значениями
-            column_to_number = {
-                'temp_max': 0,
-                ' _tempm': 1,
-                'Data.Temperature.Avg Temp': 2,
-                'BASEL_temp_mean': 3
-            }
-
-            # Проверяем, какой из столбцов присутствует в DataFrame и ассоциируем его с числом
-            column_number = None
 
-            for column in possible_date_columns:
-                if column in row:  # Проверяем, есть ли столбец как ключ в словаре row
-                    column_number = column_to_number[column]
-                    break
+            if request.get('command') in ('REBUILD_START', 'REBUILD_CHUNK', 'REBUILD_DONE'):
+                self.on_rebuild_message(request)
+                return
 
-            count_to_add = 1
-            
-            if column_number == 0:
-                # Среднее между минимальной и максимальной температурами
-                temperature = (float(row['temp_min']) + float(row['temp_max'])) / 2
-            elif column_number == 1:
-                # Используем значение _tempm
-                temperature = float(row[' _tempm'])
-            elif column_number == 2:
-                # Используем значение Data.Temperature.Avg Temp
-                temperature = float(row['Data.Temperature.Avg Temp'])
+            if request.get('command') == 'LOAD_BATCH':
+                rows = request['data']
             else:
-                # Среднее из всех столбцов с суффиксом _temp_mean
-                temp_mean_columns = [col for col in row.keys() if col.endswith('_temp_mean')]
-                if temp_mean_columns:
-                    temp_sum = sum(float(row[col]) for col in temp_mean_columns if row[col] not in [None, ''])
-                    temp_count = sum(1 for col in temp_mean_columns if row[col] not in [None, ''])
-                    count_to_add = temp_count
-                    
-                    if temp_count > 0:
-                        temperature = temp_sum / temp_count
-                    else:
-                        print(f"Нет допустимых значений температуры в строке: {row}")
-                        return  # Пропускаем эту запись
-                else:
-                    print(f"Не найдены столбцы с суффиксом _temp_mean в строке: {row}")
-                    return  # Пропускаем эту запись
-                
-            if math.isnan(temperature):
-                return
-            
-            # оперируем данными непосредственно из словаря витрины, так что навешиваем замок для потокобезопасности
-            with self.lock:
+                rows = [request['data']]
+
+            # Сначала векторно считаем температуры всей пачки (по схеме ее столбцов), потом один раз берем замок и сливаем в витрину
+            # Ошибка в одной строке не должна отбрасывать всю пачку
+            updates, errors = self.extractors.extract(rows)
+            if self.store is not None:
+                self.store.log_values(updates)
+            self.merge_updates(updates)
+            if self.rebuild is not None:
+                self.rebuild['stale'].difference_update(date for date, _, _ in updates)
+
+            if errors:
+                print(f"[Ошибка] Не удалось загрузить {len(errors)} строк в витрину: {errors[0]}")
+                result = {'status': '500', 'from': "showcaseX", 'message': errors[0]}
+                self.send_response('client_responses', result)
+
+        except Exception as e:
+            print(f"[Ошибка] Не удалось загрузить данные в витрину: {e}")
+            result = {'status': '500', 'from': "showcaseX", 'message': str(e)}
+            self.send_response('client_responses', result)
+
+    def merge_updates(self, updates):
+        """Сливает (дата, температура, количество значений) в витрину и ее индексы"""
+        # Значения одной даты из пачки складываем до замка: на дату - одно обновление словаря, индекса и сводок
+        by_date = {}
+        for date, temperature, count_to_add in updates:
+            total, count = by_date.get(date, (0.0, 0))
+            by_date[date] = (total + temperature * count_to_add, count + count_to_add)
+
+        # оперируем данными непосредственно из словаря витрины, так что навешиваем замок для потокобезопасности
+        with self.lock:
+            for date, temperature, count_to_add in updates:
+                self.stats_tree.add(date.toordinal(), temperature, count_to_add)
+
+            for date, (total, count_to_add) in by_date.items():
+                temperature = total / count_to_add
                 if date in self.data:
                     # Обновляем среднюю температуру
                     old_avg, old_count = self.data[date]
                     new_count = old_count + count_to_add
-                    
+
                     new_avg = (old_avg * old_count + temperature * count_to_add) / new_count
                     self.data[date] = (new_avg, new_count)
+                    self.index.add(date.toordinal(), avg=new_avg - old_avg)
+                    self.rollups.add(date, new_avg - old_avg, 0)
                 else:
                     # Добавляем новую запись
                     self.data[date] = (temperature, count_to_add)
+                    self.index.add(date.toordinal(), avg=temperature, days=1)
+                    self.rollups.add(date, temperature, 1)
+
+    def replace_days(self, days):
+        """
+        Заменяет дни витрины скетчами [(дата, TDigest)] целиком: средняя и количество дня берутся из суммы
+        и числа значений скетча, индекс и сводки получают разницу со старой средней
+        """
+        with self.lock:
+            for date, digest in days:
+                if not digest.count:
+                    continue
+                temperature = digest.total / digest.count
+                self.stats_tree.set(date.toordinal(), digest)
+
+                if date in self.data:
+                    old_avg, _ = self.data[date]
+                    self.index.add(date.toordinal(), avg=temperature - old_avg)
+                    self.rollups.add(date, temperature - old_avg, 0)
+                else:
+                    self.index.add(date.toordinal(), avg=temperature, days=1)
+                    self.rollups.add(date, temperature, 1)
+                self.data[date] = (temperature, round(digest.count))
+
+    def remove_days(self, dates):
+        """Убирает дни из витрины, ее индекса и сводок (после REBUILD - дни, которых нет ни у одного хранителя)"""
+        with self.lock:
+            for date in dates:
+                old_avg, _ = self.data.pop(date)
+                self.stats_tree.set(date.toordinal(), None)
+                self.index.add(date.toordinal(), avg=-old_avg, days=-1)
+                self.rollups.add(date, -old_avg, -1)
+
+    def on_rebuild_message(self, request):
+        """
+        Перестройка витрины по хранителям (REBUILD): менеджер присылает REBUILD_START со списком хранителей,
+        затем каждый хранитель - порции REBUILD_CHUNK со скетчами температур своих дат и REBUILD_DONE.
+        Порция заменяет дни целиком. Хранитель пересылает сюда и LOAD_BATCH, и порции по одному каналу, поэтому
+        пачки, пришедшие раньше порции, в ней уже учтены (и заменяются), а пришедшие позже доливаются поверх.
+        Дни, которые были в витрине до REBUILD, но не пришли ни в порциях, ни в пачках за время перестройки,
+        удаляются, когда ответили все хранители: таких дат у них нет (например, витрина пережила перезапуск, а хранители - нет).
+        """
+        command = request['command']
+        rebuild = self.rebuild if self.rebuild is not None and self.rebuild['rebuild_id'] == request['rebuild_id'] else None
+
+        if command == 'REBUILD_START':
+            self.rebuild = {
+                'rebuild_id': request['rebuild_id'], 'storages': request['storages'], 'waiting': set(request['storages']),
+                'reply_to': request['reply_to'], 'days': 0, 'started': time.time(),
+                'stale': set(self.data),  # дни витрины, которых хранители пока не прислали
+            }
+            self.connection.call_later(showcase_rebuild_timeout, lambda: self.finish_rebuild(request['rebuild_id']))
+            print(f"Витрина перестраивается по хранителям {request['storages']}")
+
+        elif command == 'REBUILD_CHUNK':
+            # Порцию опоздавшего хранителя (после таймаута) все равно применяем: она так же верна
+            days = [(parse_day(date), TDigest.from_message(message)) for date, message in request['days'].items()]
+            if self.store is not None:
+                self.store.log_days(days)
+            self.replace_days(days)
+            if self.rebuild is not None:
+                self.rebuild['stale'].difference_update(date for date, _ in days)
+            if rebuild is not None:
+                rebuild['days'] += len(days)
+
+        elif command == 'REBUILD_DONE' and rebuild is not None:
+            rebuild['waiting'].discard(request['node_id'])
+            if not rebuild['waiting']:
+                self.finish_rebuild(request['rebuild_id'])
+
+    def finish_rebuild(self, rebuild_id):
+        """Сообщает клиенту итог REBUILD (по готовности всех хранителей или по таймауту) и сразу делает снимок"""
+        rebuild = self.rebuild
+        if rebuild is None or rebuild['rebuild_id'] != rebuild_id:
+            return  # уже завершен
+        self.rebuild = None
+
+        timed_out = sorted(rebuild['waiting'])
+        # Не ответивший хранитель мог не успеть прислать свои даты - без всех ответов дни не удаляем
+        removed = 0 if timed_out else len(rebuild['stale'])
+        if removed:
+            self.remove_days(rebuild['stale'])
+        seconds = round(time.time() - rebuild['started'], 3)
+        if timed_out:
+            print(f"[Ошибка] Хранители {timed_out} не прислали даты для REBUILD за {showcase_rebuild_timeout} с, устаревшие дни не удалены")
+        print(f"Витрина перестроена: {rebuild['days']} дат за {seconds} с, удалено дней без данных у хранителей: {removed}")
 
+        result = {
+            'status': 'success', 'from': "showcase5", 'command': 'REBUILD', 'days': rebuild['days'], 'removed': removed, 'seconds': seconds,
+            'nodes': sorted(set(rebuild['storages']) - rebuild['waiting']), 'timed_out': timed_out,
+        }
+        self.send_response(rebuild['reply_to'], result)
+        if self.store is not None:
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        """Снимок скетчей всех дней; делается в потоке соединения, как и прием данных, поэтому журнал не пишется параллельно"""
+        started = time.time()
+        with self.lock:
+            days = [(datetime.fromordinal(ordinal), digest) for ordinal, digest in self.stats_tree.leaves()]
+            size = self.store.snapshot(days)
+        print(f"Снимок витрины: {len(days)} дат, {size} байт за {time.time() - started:.3f} с")
+
+    def snapshot_step(self):
+        """Периодический снимок, если с прошлого в журнал что-то писалось"""
+        try:
+            if self.store.blocks_since_snapshot:
+                self.save_snapshot()
         except Exception as e:
-            print(f"[Ошибка] Не удалось загрузить данные в витрину: {e}")
-            result = {'status': '500', 'from': "showcaseX", 'message': str(e)}
-            self.send_response('client_responses', result)
-    
+            print(f"[Ошибка] Не удалось сохранить снимок витрины: {e}")
+        self.connection.call_later(showcase_snapshot_interval, self.snapshot_step)
+
     def process_request(self, ch, method, properties, body):
         """Обработка запросов от клиента"""
         try:
@@ -112,25 +240,41 @@ class Showcase:
             date2 = request.get('date2')
             
             if command == 'temp_range':
-                result = self.get_temp_range(date1, date2)
+                result = self.get_temp_range(date1, date2, request.get('granularity') or 'day')
                 self.send_response(request['reply_to'], result)
 
             elif command == 'temp_range_avg':
                 result = self.get_temp_range_avg(date1, date2)
                 self.send_response(request['reply_to'], result)
 
+            elif command == 'temp_range_stats':
+                result = self.get_temp_range_stats(date1, date2)
+                self.send_response(request['reply_to'], result)
+
+            elif command == 'temp_range_quantile':
+                result = self.get_temp_range_quantile(date1, date2, request.get('quantiles') or [0.5])
+                self.send_response(request['reply_to'], result)
+
         except Exception as e:
             print(f"[Ошибка] не удалось обработать запрос от клиента: {e}")
             result = {'status': '500', 'from': "showcaseX", 'message': str(e)}
             self.send_response(request['reply_to'], result)
     
-    def get_temp_range(self, start_date, end_date):
-        """Получение данных о температуре за указанный период"""
+    def get_temp_range(self, start_date, end_date, granularity='day'):
+        """
+        Получение данных о температуре за указанный период: средние по дням или, при granularity
+        month / year, средние средних дней по месяцам (ключ ММ-ГГГГ) или годам (ключ ГГГГ) из сводок
+        """
 
         # Преобразуем в объекты datetime для сравнения
         start = datetime.strptime(start_date, '%d-%m-%Y')
         end = datetime.strptime(end_date, '%d-%m-%Y')
 
+        if granularity not in granularities:
+            return {'status': '500', 'from': "showcaseX", 'message': f"granularity должна быть одной из {', '.join(granularities)}"}
+        if granularity != 'day':
+            return self.get_temp_range_rollup(start, end, granularity)
+
         result = {}
         exists = False  # Флаг для отслеживания, вошел ли цикл хотя бы один раз
         found = False
@@ -156,22 +300,72 @@ class Showcase:
         
         return response
     
+    def get_temp_range_rollup(self, start, end, granularity):
+        """temp_range по месяцам или годам: целые периоды берутся из сводок, неполные на краях - по дням"""
+        with self.lock:
+            if not self.data:
+                return {'status': "204", 'data': {}, 'from': "showcase1"}  # No Content
+            periods = list(self.rollups.periods(start, end, granularity))
+
+        result = {key: round(total / days, self.accuracy) for key, total, days in periods if days}
+
+        response = {'status': 'success', 'data': result, 'from': "showcase1"}
+        if not result:
+            response['status'] = "404"  # Not Found
+        return response
+
     def get_temp_range_avg(self, start_date, end_date):
-        """Получение средней температуры за указанный период"""
-        temp_range = self.get_temp_range(start_date, end_date)
-        
-        if temp_range['status'] != 'success':
-            return temp_range
-        
-        data = temp_range['data']
-        if not data:
-            return {'status': 'error', 'message': 'Нет данных за указанный период'}
-        
-        total_temp = sum(data.values())
-        avg_temp = round((total_temp / len(data)), self.accuracy)
-        
-        return {'status': 'success', 'avg_temperature': avg_temp, 'from': "showcase2"}
+        """Получение средней температуры за указанный период (среднее средних по дням) по индексу за O(log n)"""
+        first = datetime.strptime(start_date, '%d-%m-%Y').toordinal()
+        last = datetime.strptime(end_date, '%d-%m-%Y').toordinal()
+
+        with self.lock:
+            days = round(self.index.range_sum('days', first, last))
+            total_temp = self.index.range_sum('avg', first, last)
+
+        if not days:
+            return {'status': "204", 'data': {}, 'from': "showcase1"}  # No Content
+
+        avg_temp = round((total_temp / days), self.accuracy)
+
+        return {'status': 'success', 'avg_temperature': avg_temp, 'days': days, 'from': "showcase2"}
     
+    def range_digest(self, start_date, end_date):
+        """Скетч значений температуры за период: слияние O(log n) узлов дерева отрезков"""
+        first = datetime.strptime(start_date, '%d-%m-%Y').toordinal()
+        last = datetime.strptime(end_date, '%d-%m-%Y').toordinal()
+        with self.lock:
+            return self.stats_tree.query(first, last)
+
+    def get_temp_range_stats(self, start_date, end_date):
+        """Минимум, максимум, среднее и число значений температуры за период (по всем значениям, а не по средним дней)"""
+        digest = self.range_digest(start_date, end_date)
+        if not digest.count:
+            return {'status': "204", 'data': {}, 'from': "showcase1"}  # No Content
+
+        return {
+            'status': 'success', 'from': "showcase3",
+            'min': round(digest.min, self.accuracy),
+            'max': round(digest.max, self.accuracy),
+            'mean': round(digest.mean(), self.accuracy),
+            'count': int(digest.count),
+        }
+
+    def get_temp_range_quantile(self, start_date, end_date, quantiles):
+        """Квантили температуры за период по t-digest (приближенные, точнее всего у краев распределения)"""
+        quantiles = [float(q) for q in quantiles]
+        if any(not 0 <= q <= 1 for q in quantiles):
+            return {'status': '500', 'from': "showcaseX", 'message': 'Квантили должны быть от 0 до 1'}
+
+        digest = self.range_digest(start_date, end_date)
+        if not digest.count:
+            return {'status': "204", 'data': {}, 'from': "showcase1"}  # No Content
+
+        return {
+            'status': 'success', 'from': "showcase4", 'count': int(digest.count),
+            'quantiles': {str(q): round(digest.quantile(q), self.accuracy) for q in quantiles},
+        }
+
     def send_response(self, reply_to, response):
         """Отправка ответа клиенту"""
         self.channel.basic_publish(
@@ -0,0 +1,89 @@
+import math
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=100000)
+def parse_day(date_str):
+    """'%d-%m-%Y' -> datetime (формат date_parsed фиксирован, поэтому без strptime); повторы дат берутся из кэша"""
+    return datetime(int(date_str[6:10]), int(date_str[3:5]), int(date_str[0:2]))
+
+
+def column_values(rows, column, errors):
+    """Столбец пачки как массив float; пропуски (None, '', NaN) - NaN, непереводимые значения - NaN и ошибка"""
+    values = [row.get(column) for row in rows]
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        result = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            if value in (None, ''):
+                continue
+            try:
+                result[i] = float(value)
+            except (TypeError, ValueError) as e:
+                errors.append(f"{column}: {e}")
+        return result
+
+
+def make_extractor(columns):
+    """
+    Функция extract(rows, errors) -> (температуры, количества значений) для пачки строк с этим набором столбцов.
+    Схема файла (какие столбцы дают температуру) определяется здесь один раз, дальше считается векторно.
+    Строки без температуры получают NaN и в витрину не попадают.
+    """
+    if 'temp_max' in columns:
+        def extract(rows, errors):
+            # Среднее между минимальной и максимальной температурами
+            temperatures = (column_values(rows, 'temp_min', errors) + column_values(rows, 'temp_max', errors)) / 2
+            return temperatures, np.ones(len(rows), dtype=int)
+        return extract
+
+    for column in (' _tempm', 'Data.Temperature.Avg Temp'):
+        if column in columns:
+            def extract(rows, errors, column=column):
+                return column_values(rows, column, errors), np.ones(len(rows), dtype=int)
+            return extract
+
+    # Среднее из всех столбцов с суффиксом _temp_mean (BASEL_temp_mean и другие города)
+    mean_columns = [column for column in columns if column.endswith('_temp_mean')]
+    if not mean_columns:
+        print(f"Не найдены столбцы температуры в схеме: {sorted(columns)}")
+        return lambda rows, errors: (np.full(len(rows), np.nan), np.zeros(len(rows), dtype=int))
+
+    def extract(rows, errors):
+        values = np.column_stack([column_values(rows, column, errors) for column in mean_columns])
+        present = ~np.isnan(values)
+        counts = present.sum(axis=1)
+        sums = np.where(present, values, 0.0).sum(axis=1)
+        temperatures = np.divide(sums, counts, out=np.full(len(rows), np.nan), where=counts > 0)
+        return temperatures, counts
+    return extract
+
+
+class SchemaExtractors:
+    """Кэш функций извлечения температуры по набору столбцов строки"""
+
+    def __init__(self):
+        self.extractors = {}
+
+    def extract(self, rows):
+        """Возвращает ([(дата, температура, количество)], [ошибки]) для пачки строк, возможно из разных файлов"""
+        by_schema = {}
+        for row in rows:
+            by_schema.setdefault(tuple(row), []).append(row)  # строки одного файла имеют одинаковые ключи в одном порядке
+
+        updates, errors = [], []
+        for columns, schema_rows in by_schema.items():
+            extractor = self.extractors.get(columns)
+            if extractor is None:
+                extractor = self.extractors[columns] = make_extractor(columns)
+
+            temperatures, counts = extractor(schema_rows, errors)
+            for row, temperature, count in zip(schema_rows, temperatures.tolist(), counts.tolist()):
+                if not math.isnan(temperature):
+                    updates.append((parse_day(row['date_parsed']), temperature, count))
+
+        return updates, errors
@@ -0,0 +1,187 @@
+import os
+import struct
+from datetime import datetime
+
+import numpy as np
+
+from tdigest import TDigest
+
+from config import persistence_dir, persistence_fsync, showcase_persistence_enabled
+
+# Журнал и снимок витрины - двоичные блоки: заголовок (вид блока, длина) и данные.
+# Блок значений - пачка (день, температура, количество), как ее сливает merge_updates;
+# блок дней - скетчи дней целиком (порции REBUILD). Снимок - один блок дней со всеми днями витрины:
+# из скетча дня восстанавливаются и средняя, и количество, поэтому словарь витрины отдельно не пишется.
+snapshot_name = 'snapshot.bin'
+snapshot_magic = b'SHOWCAS1'
+block_header = struct.Struct('<BI')
+values_block = 1
+days_block = 2
+
+
+def log_name(generation):
+    return f'wal-{generation:08d}.log'
+
+
+def encode_values(updates):
+    """[(дата, температура, количество)] -> номера дней (int32), температуры (float64), количества (int32) подряд"""
+    ordinals = np.array([date.toordinal() for date, _, _ in updates], dtype='<i4')
+    temperatures = np.array([temperature for _, temperature, _ in updates], dtype='<f8')
+    counts = np.array([count for _, _, count in updates], dtype='<i4')
+    return struct.pack('<I', len(updates)) + ordinals.tobytes() + temperatures.tobytes() + counts.tobytes()
+
+
+def decode_values(payload):
+    (n,) = struct.unpack_from('<I', payload)
+    ordinals = np.frombuffer(payload, '<i4', n, 4).tolist()
+    temperatures = np.frombuffer(payload, '<f8', n, 4 + 4 * n).tolist()
+    counts = np.frombuffer(payload, '<i4', n, 4 + 12 * n).tolist()
+    return [(datetime.fromordinal(ordinal), temperature, count) for ordinal, temperature, count in zip(ordinals, temperatures, counts)]
+
+
+def encode_days(days):
+    """
+    [(дата, скетч)] -> номера дней, число центроидов каждого дня, (min, max, число, сумма) дней
+    и все центроиды (среднее, вес) одним массивом
+    """
+    sizes, stats, centroids = [], [], []
+    for _, digest in days:
+        message = digest.to_message()
+        sizes.append(len(message['centroids']))
+        stats.append((message['min'], message['max'], message['count'], message['total']))
+        centroids.extend(message['centroids'])
+
+    return b''.join([
+        struct.pack('<II', len(days), len(centroids)),
+        np.array([date.toordinal() for date, _ in days], dtype='<i4').tobytes(),
+        np.array(sizes, dtype='<i4').tobytes(),
+        np.array(stats, dtype='<f8').tobytes(),
+        np.array(centroids, dtype='<f8').tobytes(),
+    ])
+
+
+def decode_days(payload):
+    n, m = struct.unpack_from('<II', payload)
+    offset = 8
+    ordinals = np.frombuffer(payload, '<i4', n, offset).tolist()
+    offset += 4 * n
+    sizes = np.frombuffer(payload, '<i4', n, offset).tolist()
+    offset += 4 * n
+    stats = np.frombuffer(payload, '<f8', 4 * n, offset).reshape(n, 4).tolist()
+    offset += 32 * n
+    centroids = np.frombuffer(payload, '<f8', 2 * m, offset).reshape(m, 2).tolist()
+
+    days = []
+    position = 0
+    for ordinal, size, (low, high, count, total) in zip(ordinals, sizes, stats):
+        message = {'centroids': centroids[position:position + size], 'min': low, 'max': high, 'count': count, 'total': total}
+        days.append((datetime.fromordinal(ordinal), TDigest.from_message(message)))
+        position += size
+    return days
+
+
+def read_blocks(data, offset=0):
+    """(вид, данные) блоков подряд; обрезанный последний блок (падение при записи) пропускается"""
+    while offset + block_header.size <= len(data):
+        kind, length = block_header.unpack_from(data, offset)
+        offset += block_header.size
+        if offset + length > len(data):
+            return
+        yield kind, data[offset:offset + length]
+        offset += length
+
+
+class ShowcaseStore:
+    """
+    Сохранение витрины на диск, по образцу DurableStore хранителей: каждая принятая пачка сначала попадает
+    в журнал (append-only), а раз в showcase_snapshot_interval секунд скетчи всех дней уплотняются в снимок
+    и журнал начинается заново. При запуске витрина читает снимок и доигрывает журналы, записанные после него.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.snapshot_path = os.path.join(directory, snapshot_name)
+        self.log_generation = 0
+        self.log_file = None
+        self.blocks_since_snapshot = 0
+
+    def log_generations(self):
+        """Номера поколений журналов, лежащих в каталоге витрины, по возрастанию"""
+        return sorted(
+            int(name[4:-4]) for name in os.listdir(self.directory)
+            if name.startswith('wal-') and name.endswith('.log')
+        )
+
+    def load(self, showcase):
+        """Читает снимок в витрину, доигрывает журналы после него и открывает новый журнал"""
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as file:
+                data = file.read()
+            if data[:len(snapshot_magic)] != snapshot_magic:
+                raise ValueError(f"Неизвестный формат снимка витрины: {self.snapshot_path}")
+            (self.log_generation,) = struct.unpack_from('<I', data, len(snapshot_magic))
+            for _, payload in read_blocks(data, len(snapshot_magic) + 4):
+                showcase.replace_days(decode_days(payload))
+
+        for generation in self.log_generations():
+            if generation < self.log_generation:
+                continue
+            with open(os.path.join(self.directory, log_name(generation)), 'rb') as file:
+                data = file.read()
+            for kind, payload in read_blocks(data):
+                if kind == values_block:
+                    showcase.merge_updates(decode_values(payload))
+                elif kind == days_block:
+                    showcase.replace_days(decode_days(payload))
+
+            # Дописывать в доигранный журнал нельзя (в конце может быть обрезанный блок), начинаем следующий
+            self.log_generation = generation + 1
+
+        self.log_file = open(os.path.join(self.directory, log_name(self.log_generation)), 'ab')
+
+    def _log(self, kind, payload):
+        self.log_file.write(block_header.pack(kind, len(payload)) + payload)
+        self.log_file.flush()
+        if persistence_fsync:
+            os.fsync(self.log_file.fileno())
+
+        self.blocks_since_snapshot += 1
+
+    def log_values(self, updates):
+        if updates:
+            self._log(values_block, encode_values(updates))
+
+    def log_days(self, days):
+        if days:
+            self._log(days_block, encode_days(days))
+
+    def snapshot(self, days):
+        """Записывает снимок из скетчей всех дней витрины, начинает новый журнал и удаляет старые"""
+        self.log_file.close()
+        old_generation = self.log_generation
+        self.log_generation += 1
+        self.log_file = open(os.path.join(self.directory, log_name(self.log_generation)), 'ab')
+
+        payload = encode_days(days)
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(snapshot_magic + struct.pack('<I', self.log_generation))
+            file.write(block_header.pack(days_block, len(payload)) + payload)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self.blocks_since_snapshot = 0
+
+        for generation in self.log_generations():
+            if generation <= old_generation:
+                os.remove(os.path.join(self.directory, log_name(generation)))
+        return len(payload)
+
+
+def open_showcase_store():
+    """Хранилище витрины на диске, если включено showcase_persistence_enabled, иначе None (витрина только в памяти)"""
+    if showcase_persistence_enabled:
+        return ShowcaseStore(os.path.join(persistence_dir, 'showcase'))
+    return None
@@ -3,15 +3,28 @@ import time
 import pika
 import json
 import pandas as pd
+from datetime import datetime
+from collections import deque
 from multiprocessing import Process
 from replicaNode import ReplicaNode
-
-from config import num_storages, print_each_step, durability, print_only_if_dead, print_every_chunk
+from segment_store import open_store
+from bloom import BloomFilter
+from replication import ReplicationPipeline
+from hashing import ConsistentHashing
+from transfer import decode_rows, available_codecs
+from merkle import AntiEntropy
+from heartbeat import HeartbeatSender
+from showcase_ingest import SchemaExtractors
+from tdigest import TDigest
+
+from config import num_storages, print_each_step, durability, print_every_chunk, bloom_enabled
+from config import chunk_size, replication_max_lag_rows, replication_flush_interval, migration_step_interval, anti_entropy_enabled
+from config import heartbeat_interval, cache_change_heartbeats, rebuild_step_interval
 
 class StorageNode:
-    def __init__(self, node_id):
+    def __init__(self, node_id, store=None, promotion=None):
         self.node_id = node_id
-        self.data = {} # Здесь будем хранить строки (ключ - дата, значение - список записей)
+        self.data = store if store is not None else open_store(f'storage-{node_id}') # Здесь будем хранить строки (ключ - дата, значение - список записей) в столбцовом виде, при persistence_enabled - еще и на диске
         self.replica_queue = f'replica-{node_id}'
 
         # Подключение к RabbitMQ
@@ -23,12 +36,51 @@ class StorageNode:
         self.channel.queue_declare(queue=self.queue_name, durable=durability)
         self.channel.queue_declare(queue=self.replica_queue, durable=durability)
         self.channel.queue_declare(queue='manager_responses', durable=durability) # Очередь для ответов хранителей и реплик (просматриваем менеджером)
-        self.channel.queue_declare(queue='manager_pings', durable=durability) # Очередь для ответов хранителей на команду PING (просматриваем менеджером)
 
         self.channel.queue_declare(queue='showcase_data', durable=durability) # Очередь для передачи данных на процесс-витрину
 
         self.channel.basic_consume(queue=self.queue_name, on_message_callback=self.handle_request, auto_ack=True)
 
+        # Репликация пачками: реплика подтверждает номера пачек в отдельную очередь хранителя (конвейер сам забирает их оттуда)
+        self.replica_ack_queue = f'replica_acks-{node_id}'
+        self.channel.queue_declare(queue=self.replica_ack_queue, durable=durability)
+        self.replication = ReplicationPipeline(node_id, self.connection, self.channel, self.replica_queue, self.replica_ack_queue)
+
+        # Фоновая сверка с репликой по дереву хэшей (ответы реплики приходят в отдельную очередь хранителя)
+        self.anti_entropy = AntiEntropy(node_id, self.connection, self.channel, self.data, self.replication,
+                                        self.replica_queue, f'anti_entropy-{node_id}')
+        self.anti_entropy.paused = lambda: self.rebuild_pending is not None or self.migration is not None
+        if anti_entropy_enabled:
+            self.anti_entropy.schedule()
+
+        # Фильтр Блума по датам хранителя: менеджер по его копии сам отвечает на GET отсутствующих дат
+        self.bloom = BloomFilter() if bloom_enabled else None
+
+        # Версии дат для кэша GET менеджера: номер последней записи, затронувшей дату
+        self.incarnation = time.time() # отличает этот процесс от прежних: после перезапуска или повышения версии начинаются заново
+        self.version = 0 # номер последней записи
+        self.date_versions = {}
+        self.recent_changes = deque() # (версия, дата) изменений, которые повторяются в heartbeat
+        self.heartbeat_versions = deque([0], maxlen=cache_change_heartbeats) # self.version на момент последних heartbeat
+
+        self.rebuild_pending = None # (дата, строк) еще не отправленные новой реплике после повышения
+        self.rebuild_last_seq = 0 # номер пачки репликации, с подтверждением которой новая реплика догнала хранителя
+        self.applied_chunks = set() # (transfer_id, chunk_id) примененных порций LOAD_2, чтобы повторы не дублировали строки
+        self.migration = None # передача дат новому хранителю после JOIN: кому, кольцо с ним и что еще не отправлено
+        self.showcase_dump = None # передача витрине скетчей своих дат при REBUILD: куда и какие даты еще не отправлены
+        self.extractors = SchemaExtractors() # температура строк для REBUILD считается так же, как на самой витрине
+
+        if promotion is not None:
+            self.take_over(promotion)
+        elif len(self.data):
+            print(f"[Хранитель-{self.node_id}] Восстановил с диска {self.data.row_count()} строк за {len(self.data)} дат")
+            self.publish_new_dates(self.data.dates())
+
+        # heartbeat уходят менеджеру из отдельного потока и соединения, даже когда основной цикл занят загрузкой
+        self.heartbeat = HeartbeatSender(node_id, self.queue_name)
+        self.update_heartbeat_status()
+        self.heartbeat.start()
+
         print(f"[Хранитель-{self.node_id}] Запущен и ожидает запросов...")
 
     def handle_request(self, ch, method, properties, body):
@@ -42,20 +94,19 @@ class StorageNode:
             if command == 'LOAD':
                 row = request['data']
                 date = row['date_parsed']
-                if date not in self.data:
-                    self.data[date] = []
-                self.data[date].append(row) # Добавляем данные в словарь
+                new_dates = [date] if date not in self.data else []
+                self.data.append(row) # Добавляем данные в хранилище
+                self.publish_new_dates(new_dates)
+                self.touch_dates([date])
 
                 if print_each_step:
                     print(f"[Хранитель-{self.node_id}] Получил и сохранил данные за {date}: {row}")
 
                 load_request = {'command': 'LOAD', 'data': row}
 
-                # Отправляем данные в реплику
-                self.channel.basic_publish(
-                    exchange='', routing_key=self.replica_queue, 
-                    body=json.dumps(load_request)
-                )
+                # Ставим строку в очередь репликации (уйдет реплике пачкой)
+                self.replication.replicate([row])
+                self.forward_to_new_owner([row])
 
 
                 # Отправляем данные также в очередь витрины
@@ -71,70 +122,94 @@ class StorageNode:
                 # if date in self.data:
                 #     del self.data[date]  # Удаляем данные по дате для тестирования ответа реплики
 
-            elif command == 'LOAD_2': # Получена команда загрузки данных из реплики в случае падения одного из хранителей
-                received_data = request['data']
-                reply_to = request['reply_to']
-                replica_id = request['replica_id']
-                chunk_id = request['chunk_id']
-                total_chunks = request['total_chunks']
+            elif command == 'LOAD_BATCH': # Пачка строк от менеджера - сохраняем и пересылаем одним сообщением
+                rows = request['data']
+                new_dates = {row['date_parsed'] for row in rows if row['date_parsed'] not in self.data}
+                self.data.append_rows(rows)
+                self.publish_new_dates(new_dates)
+                self.touch_dates({row['date_parsed'] for row in rows})
 
-                last_chunk = chunk_id == total_chunks - 1
-
-
-                self.data.update(received_data)
-                
-                if chunk_id + 1 != total_chunks: # если не последний чанк
-                    if print_every_chunk:
-                        print(f"[Хранитель-{self.node_id}] Получил и восстановил чанк данных {chunk_id + 1}/{total_chunks} от реплики {replica_id}")
-                else:
-                    print(f"[Хранитель-{self.node_id}] Получил и восстановил все чанки данных {chunk_id + 1}/{total_chunks} от реплики {replica_id}")
+                if print_each_step:
+                    print(f"[Хранитель-{self.node_id}] Получил и сохранил пачку из {len(rows)} строк")
 
-                response = (f"[Хранитель-{self.node_id}] Получил и восстановил чанк данных {chunk_id + 1}/{total_chunks} от реплики {replica_id}")
+                # Реплике строки уходят через буфер репликации, а витрине тело сообщения
+                # {'command': 'LOAD_BATCH', 'data': [...]} пересылается без повторной сериализации
+                self.replication.replicate(rows)
+                self.channel.basic_publish(exchange='', routing_key='showcase_data', body=body)
+                self.forward_to_new_owner(rows)
 
-                # Добавляем дополнительные сведения
-                response_with_info = {
-                    'data': response,
-                    'node_id': self.node_id,
-                    'queue_name': self.queue_name
-                }
+                if print_each_step:
+                    print(f"[Хранитель-{self.node_id}] Поставил пачку из {len(rows)} строк в очередь репликации {self.replica_queue}")
 
-                # пересылаем ли ответ менеджеру, что успешно восстановили каждый чанк, или только последний (а значит, и все)
-                if print_every_chunk or last_chunk:
-                    self.channel.basic_publish(exchange='', routing_key=reply_to, body=json.dumps(response_with_info))
+            elif command == 'LOAD_2': # Порция данных от реплики упавшего хранителя (сжатая, с подтверждением)
+                replica_id = request['replica_id']
+                chunk_id = request['chunk_id']
+                chunk_key = (request['transfer_id'], chunk_id)
+
+                # Повтор уже примененной порции (подтверждение потерялось или опоздало) только подтверждаем
+                if chunk_key not in self.applied_chunks:
+                    rows = decode_rows(request)
+                    new_dates = {row['date_parsed'] for row in rows if row['date_parsed'] not in self.data}
+                    self.data.append_rows(rows)
+                    self.publish_new_dates(new_dates)
+                    self.touch_dates({row['date_parsed'] for row in rows})
+                    self.applied_chunks.add(chunk_key)
+
+                    # Реплике уходит та же сжатая порция, без повторного кодирования
+                    copy_2_request = {
+                        'command': 'COPY_2',
+                        'codec': request['codec'],
+                        'payload': request['payload'],
+                        'replica_id': replica_id,
+                        'chunk_id': chunk_id,
+                    }
+                    self.channel.basic_publish(exchange='', routing_key=self.replica_queue, body=json.dumps(copy_2_request))
 
-                copy_2_request = {
-                    'command': 'COPY_2',
-                    'data': received_data,  # Отправляем только одну часть данных
-                    'reply_to': request['reply_to'],
-                    'replica_id': replica_id,
-                    'chunk_id': chunk_id,  # Индекс чанка для восстановления
-                    'total_chunks': total_chunks  # Общее количество чанков
+                    if print_every_chunk:
+                        response = f"[Хранитель-{self.node_id}] Получил и восстановил порцию данных {chunk_id + 1} ({len(rows)} строк) от реплики {replica_id}"
+                        print(response)
+                        self.channel.basic_publish(exchange='', routing_key=request['reply_to'], body=json.dumps({
+                            'data': response, 'node_id': self.node_id, 'queue_name': self.queue_name
+                        }))
+
+                ack = {'transfer_id': request['transfer_id'], 'chunk_id': chunk_id, 'codecs': available_codecs()}
+                self.channel.basic_publish(exchange='', routing_key=request['ack_to'], body=json.dumps(ack))
+
+            elif command == 'MIGRATE': # В кольцо добавлен новый хранитель: отдаем ему даты, чьи дуги теперь его
+                ring = ConsistentHashing.from_message(request)
+                target = request['target']
+                moving = [date for date, owner in zip(self.data.dates(), ring.get_storage_many(self.data.dates()).tolist()) if owner == target]
+
+                # Строки, пришедшие после этого момента, новый хранитель получит сразу (forward_to_new_owner),
+                # поэтому для каждой даты запоминаем, сколько строк отправить из хранилища
+                self.migration = {
+                    'target': target, 'ring': ring, 'reply_to': request['reply_to'], 'rows': 0,
+                    'pending': [(date, self.data.date_row_count(date)) for date in moving],
                 }
+                print(f"[Хранитель-{self.node_id}] Передаю хранителю {target} {len(moving)} дат")
+                self.connection.call_later(migration_step_interval, self.migrate_step)
 
-                # Отправляем запрос реплике на копирование восстановленных данных
-                self.channel.basic_publish(exchange='', routing_key=self.replica_queue, body=json.dumps(copy_2_request))
+            elif command == 'MIGRATE_DATA': # Строки от прежнего владельца дат (без пересылки витрине - она их уже видела)
+                rows = request['data']
+                new_dates = {row['date_parsed'] for row in rows if row['date_parsed'] not in self.data}
+                self.data.append_rows(rows)
+                self.publish_new_dates(new_dates)
+                self.touch_dates({row['date_parsed'] for row in rows})
+                self.replication.replicate(rows)
 
-                if print_every_chunk:
-                    print(f"[Хранитель-{self.node_id}] Отправил восстановленную копию данных от реплики {replica_id} в {self.replica_queue}")
-            
-            elif command == 'PING':
+                if print_each_step:
+                    print(f"[Хранитель-{self.node_id}] Получил от хранителя {request['from']} {len(rows)} строк переехавших дат")
 
-                response = "Запрос PING был получен хранителем"
+            elif command == 'MIGRATE_DONE': # Менеджер переключился на новое кольцо: переехавшие даты больше не наши
+                self.finish_migration()
 
-                reply_to = request['reply_to']
-
-                # Добавляем дополнительные сведения
-                response_with_info = {
-                    'data': response,
-                    'node_id': self.node_id,
-                    'queue_name': self.queue_name,
-                    'answer': "PONG"
+            elif command == 'SHOWCASE_DUMP': # Витрина перестраивается: отдаем ей скетчи температур своих дат порциями
+                self.showcase_dump = {
+                    'rebuild_id': request['rebuild_id'], 'reply_to': request['reply_to'], 'days': 0,
+                    'pending': list(self.data.dates()),
                 }
-                if not print_only_if_dead:
-                    print(f"[Хранитель-{self.node_id}] Получен PING от менеджера")
-
-                # Отправляем ответ менеджеру
-                self.channel.basic_publish(exchange='', routing_key=reply_to, body=json.dumps(response_with_info))
+                print(f"[Хранитель-{self.node_id}] Передаю витрине {len(self.showcase_dump['pending'])} дат")
+                self.connection.call_later(rebuild_step_interval, self.showcase_dump_step)
 
             elif command == "KILL":
                 print(f"[Хранитель-{self.node_id}] Получен запрос на остановку. Завершаю работу (имитация, что отказал).")
@@ -144,18 +219,27 @@ class StorageNode:
                 # return
 
 
+            elif command == 'GET' and request.get('fresh') and self.replica_caught_up():
+                # GET FRESH: все записи, пришедшие раньше этого GET, уже обработаны, и реплика подтвердила их все - читает она.
+                # Версию даты реплика вернет в ответе: у нее те же строки, и менеджер обновит по ответу свой кэш
+                forwarded = {**request, 'fresh': False, 'forwarded_by': self.queue_name, 'cache_version': self.cache_version(request['date'], request)}
+                self.channel.basic_publish(exchange='', routing_key=self.replica_queue, body=json.dumps(forwarded))
+
             elif command == 'GET':
                 date = request['date']
                 reply_to = request['reply_to']
 
                 if date in self.data:
-                    response = self.data[date]
+                    response = self.data.get(date) # Строки собираются из столбцов только здесь
 
                     # Добавляем дополнительные сведения
                     response_with_info = {
+                        'command': 'GET',
+                        'date': date,
                         'data': response,
                         'node_id': self.node_id,
-                        'queue_name': self.queue_name
+                        'queue_name': self.queue_name,
+                        **self.cache_version(date, request)
                     }
 
                     # Отправляем ответ менеджеру
@@ -168,9 +252,12 @@ class StorageNode:
 
                     # Добавляем дополнительные сведения
                     response_with_info = {
+                        'command': 'GET',
+                        'date': date,
                         'data': response,
                         'node_id': self.node_id,
-                        'queue_name': self.queue_name
+                        'queue_name': self.queue_name,
+                        **self.cache_version(date, request)
                     }
 
                     # Отправляем ответ менеджеру
@@ -180,6 +267,39 @@ class StorageNode:
                     #     exchange='', routing_key=self.replica_queue, body=json.dumps({'command': 'GET', 'date': date, 'reply_to': reply_to})
                     # )
 
+            elif command == 'GET_RANGE': # Часть запроса по диапазону дат: отвечаем всеми своими датами из диапазона
+                start = datetime.strptime(request['date1'], '%d-%m-%Y')
+                end = datetime.strptime(request['date2'], '%d-%m-%Y')
+
+                # Упорядоченный индекс дат дает диапазон без обхода всего хранилища
+                dates = self.data.dates_in_range(start, end)
+                response = {date: self.data.get(date) for date in dates}
+
+                response_with_info = {
+                    'command': 'GET_RANGE',
+                    'request_id': request['request_id'],
+                    'data': response,
+                    'node_id': self.node_id,
+                    'queue_name': self.queue_name
+                }
+
+                self.channel.basic_publish(exchange='', routing_key=request['reply_to'], body=json.dumps(response_with_info))
+                print(f"[Хранитель {self.node_id}] Найдены данные за {len(dates)} дат из диапазона {request['date1']} - {request['date2']}, отправил менеджеру")
+
+            elif command == 'MGET': # Часть запроса MGET: только даты, которые менеджер отнес к этому хранителю
+                found = {date: self.data.get(date) for date in request['dates'] if date in self.data}
+
+                response_with_info = {
+                    'command': 'MGET',
+                    'request_id': request['request_id'],
+                    'data': found,
+                    'node_id': self.node_id,
+                    'queue_name': self.queue_name
+                }
+
+                self.channel.basic_publish(exchange='', routing_key=request['reply_to'], body=json.dumps(response_with_info))
+                print(f"[Хранитель {self.node_id}] MGET: найдены данные за {len(found)} из {len(request['dates'])} дат, отправил менеджеру")
+
             else: 
                 print(f"[Хранитель {self.node_id}] {request} Получил неизвестный запрос от менеджера")
 
@@ -187,6 +307,191 @@ class StorageNode:
             print(f"[Хранитель {self.node_id}], Ошибка: {e}")
 
 
+    def replication_status(self):
+        """Состояние репликации и сверки с репликой для менеджера"""
+        return {**self.replication.status(), 'rebuilding': self.rebuild_pending is not None, 'anti_entropy': self.anti_entropy.status()}
+
+    def replica_caught_up(self):
+        """Реплика подтвердила все строки, полученные хранителем (и не строится заново после повышения)"""
+        if self.rebuild_pending is not None:
+            return False
+        self.replication.poll_acks()
+        return self.replication.lag_rows() == 0
+
+    def update_heartbeat_status(self):
+        """
+        Обновляет состояние, которое поток heartbeat отправляет менеджеру (выполняется в основном цикле узла).
+        progress - отметка хода основного цикла: если цикл завис, поток heartbeat продолжает слать ее старой
+        """
+        self.heartbeat.set_status({'replication': self.replication_status(), 'cache': self.cache_changes(), 'progress': time.time()})
+        self.connection.call_later(heartbeat_interval, self.update_heartbeat_status)
+
+    def touch_dates(self, dates):
+        """Новая версия для измененных дат (по ней менеджер сбрасывает свой кэш GET)"""
+        self.version += 1
+        for date in dates:
+            self.date_versions[date] = self.version
+            self.recent_changes.append((self.version, date))
+
+    def cache_version(self, date, request):
+        """Поля ответа на GET для кэша менеджера: версия даты и поколение из запроса"""
+        return {'version': self.date_versions.get(date, 0), 'incarnation': self.incarnation, 'generation': request.get('generation')}
+
+    def cache_changes(self):
+        """Даты, измененные за последние cache_change_heartbeats heartbeat: since - версия, после которой перечислены все изменения"""
+        self.heartbeat_versions.append(self.version)
+        since = self.heartbeat_versions[0]
+        while self.recent_changes and self.recent_changes[0][0] <= since:
+            self.recent_changes.popleft()
+        changes = {date: version for version, date in self.recent_changes}
+        return {'incarnation': self.incarnation, 'version': self.version, 'since': since, 'changes': changes}
+
+    def take_over(self, promotion):
+        """
+        Бывшая реплика становится хранителем: сообщает менеджеру, что отвечает из storage-N,
+        запускает новую пустую реплику и в фоне отправляет ей свои данные через конвейер репликации.
+        """
+        # Пачки и подтверждения прежней пары хранитель-реплика новой реплике не нужны (нумерация начинается заново);
+        # все, что пришло в очередь реплики до повышения, она уже разобрала (ReplicaNode.drain)
+        self.channel.queue_purge(queue=self.replica_queue)
+        self.channel.queue_purge(queue=self.replica_ack_queue)
+
+        Process(target=run_replica, args=(self.node_id, f'replica-{self.node_id}.{promotion["epoch"]}')).start()
+
+        # Запоминаем число строк каждой даты: строки, пришедшие после повышения, реплика получит обычной репликацией
+        self.rebuild_pending = [(date, self.data.date_row_count(date)) for date in self.data.dates()]
+        self.connection.call_later(replication_flush_interval, self.rebuild_replica_step)
+
+        self.publish_new_dates(self.data.dates())
+
+        response = {'command': 'PROMOTED', 'node_id': self.node_id, 'queue_name': self.queue_name, 'rows': self.data.row_count()}
+        self.channel.basic_publish(exchange='', routing_key=promotion['reply_to'], body=json.dumps(response))
+        print(f"[Хранитель-{self.node_id}] Реплика заняла место хранителя ({self.data.row_count()} строк за {len(self.data)} дат), строю новую реплику")
+
+    def rebuild_replica_step(self):
+        """Отправляет новой реплике очередные chunk_size дат, если она успевает их подтверждать, и планирует следующий шаг"""
+        if self.replication.lag_rows() < replication_max_lag_rows // 2 and self.rebuild_pending:
+            rows = []
+            for date, count in self.rebuild_pending[:chunk_size]:
+                rows.extend(self.data.get(date, [])[:count])
+            del self.rebuild_pending[:chunk_size]
+            self.replication.replicate(rows)
+
+            if not self.rebuild_pending: # все старые данные отправлены, ждем подтверждения последней пачки
+                self.replication.flush()
+                self.rebuild_last_seq = self.replication.seq
+
+        if self.rebuild_pending or self.replication.acked_seq < self.rebuild_last_seq:
+            self.connection.call_later(replication_flush_interval, self.rebuild_replica_step)
+        else:
+            self.rebuild_pending = None
+            print(f"[Хранитель-{self.node_id}] Новая реплика построена и догнала хранителя")
+
+    def forward_to_new_owner(self, rows):
+        """Во время передачи дат новому хранителю свежие строки его дат сразу пересылаются ему"""
+        if self.migration is None:
+            return
+
+        ring = self.migration['ring']
+        owners = ring.get_storage_many([row['date_parsed'] for row in rows]).tolist()
+        moving = [row for row, owner in zip(rows, owners) if owner == self.migration['target']]
+        if moving:
+            request = {'command': 'MIGRATE_DATA', 'data': moving, 'from': self.node_id}
+            self.channel.basic_publish(exchange='', routing_key=f"storage-{self.migration['target']}", body=json.dumps(request))
+
+    def migrate_step(self):
+        """Отправляет новому хранителю очередные chunk_size дат; между шагами хранитель продолжает отвечать на запросы"""
+        migration = self.migration
+        if migration is None:
+            return
+
+        rows = []
+        for date, count in migration['pending'][:chunk_size]:
+            rows.extend(self.data.get(date, [])[:count])
+        del migration['pending'][:chunk_size]
+
+        if rows:
+            request = {'command': 'MIGRATE_DATA', 'data': rows, 'from': self.node_id}
+            self.channel.basic_publish(exchange='', routing_key=f"storage-{migration['target']}", body=json.dumps(request))
+            migration['rows'] += len(rows)
+
+        if migration['pending']:
+            self.connection.call_later(migration_step_interval, self.migrate_step)
+        else:
+            response = {'command': 'MIGRATED', 'node_id': self.node_id, 'queue_name': self.queue_name,
+                        'target': migration['target'], 'rows': migration['rows']}
+            self.channel.basic_publish(exchange='', routing_key=migration['reply_to'], body=json.dumps(response))
+            print(f"[Хранитель-{self.node_id}] Передал хранителю {migration['target']} {migration['rows']} строк")
+
+    def showcase_dump_step(self):
+        """
+        Отправляет витрине скетчи температур очередных chunk_size дат (по скетчу дня на дату, а не строки);
+        каждая порция собирается из текущих данных, между шагами хранитель продолжает отвечать на запросы
+        """
+        dump = self.showcase_dump
+        if dump is None:
+            return
+
+        rows = []
+        for date in dump['pending'][:chunk_size]:
+            rows.extend(self.data.get(date, []))
+        del dump['pending'][:chunk_size]
+
+        digests = {}
+        updates, _ = self.extractors.extract(rows) # ошибки строк витрина уже сообщила при их загрузке
+        for date, temperature, count in updates:
+            digests.setdefault(date, TDigest()).add(temperature, count)
+
+        if digests:
+            message = {
+                'command': 'REBUILD_CHUNK', 'rebuild_id': dump['rebuild_id'], 'node_id': self.node_id,
+                'days': {date.strftime('%d-%m-%Y'): digest.to_message() for date, digest in digests.items()},
+            }
+            self.channel.basic_publish(exchange='', routing_key=dump['reply_to'], body=json.dumps(message))
+            dump['days'] += len(digests)
+
+        if dump['pending']:
+            self.connection.call_later(rebuild_step_interval, self.showcase_dump_step)
+        else:
+            self.showcase_dump = None
+            message = {'command': 'REBUILD_DONE', 'rebuild_id': dump['rebuild_id'], 'node_id': self.node_id, 'days': dump['days']}
+            self.channel.basic_publish(exchange='', routing_key=dump['reply_to'], body=json.dumps(message))
+            print(f"[Хранитель-{self.node_id}] Передал витрине {dump['days']} дат")
+
+    def finish_migration(self):
+        """Удаляет у себя и у реплики даты, которые теперь принадлежат новому хранителю"""
+        migration, self.migration = self.migration, None
+        if migration is None:
+            return
+
+        dates = list(self.data.dates())
+        moved = [date for date, owner in zip(dates, migration['ring'].get_storage_many(dates).tolist()) if owner == migration['target']]
+        self.data.remove_dates(moved)
+        self.touch_dates(moved)
+
+        # Строки этих дат, еще лежащие в буфере репликации, должны дойти до реплики раньше удаления
+        self.replication.flush()
+        request = {'command': 'REMOVE_DATES', 'dates': moved, 'target': migration['target']}
+        self.channel.basic_publish(exchange='', routing_key=self.replica_queue, body=json.dumps(request))
+        print(f"[Хранитель-{self.node_id}] Даты ({len(moved)}) переехали к хранителю {migration['target']}, удалил их у себя")
+
+    def publish_new_dates(self, new_dates):
+        """Добавляет новые даты в фильтр Блума и, если они были, отправляет фильтр менеджеру"""
+        if self.bloom is None:
+            return
+
+        added = 0
+        for date in new_dates:
+            self.bloom.add(date)
+            added += 1
+
+        if added:
+            message = {'command': 'BLOOM', 'node_id': self.node_id, 'queue_name': self.queue_name, 'bloom': self.bloom.to_message()}
+            self.channel.basic_publish(exchange='', routing_key='manager_responses', body=json.dumps(message))
+
+            if print_each_step:
+                print(f"[Хранитель-{self.node_id}] Отправил менеджеру фильтр Блума (+{added} дат)")
+
     def start(self):
         """
         Запускает процесс ожидания сообщений.
@@ -225,11 +530,16 @@ def start_storage(node_id):
     storage.start()
 
 
-def run_replica(node_id):
+def run_replica(node_id, store_name=None):
     """Функция для запуска реплики"""
-    replica = ReplicaNode(node_id)
+    replica = ReplicaNode(node_id, store_name)
     replica.start()
 
+    # Реплику повысили: этот же процесс продолжает работать хранителем с ее данными
+    if replica.promotion is not None:
+        storage = StorageNode(node_id, store=replica.data, promotion=replica.promotion)
+        storage.start()
+
 if __name__ == "__main__":
 
     processes = {}
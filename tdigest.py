@@ -0,0 +1,118 @@
+import math
+
+from config import digest_compression
+
+
+class TDigest:
+    """
+    Скетч распределения (t-digest): значения собираются в центроиды (среднее, вес), у краев распределения
+    центроиды мельче, поэтому крайние квантили точнее средних. Центроидов не больше ~compression, скетчи
+    сливаются без исходных значений - так узлы дерева отрезков собираются из детей.
+    Вместе с центроидами ведутся точные min, max, число и сумма значений.
+    """
+
+    def __init__(self, compression=digest_compression):
+        self.compression = compression
+        self.centroids = []  # [(среднее, вес)] по возрастанию среднего
+        self.buffer = []  # еще не сжатые (значение, вес)
+        self.count = 0.0
+        self.total = 0.0  # сумма значений с весами
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, weight=1):
+        self.buffer.append((value, weight))
+        self.count += weight
+        self.total += value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.buffer) > 5 * self.compression:
+            self.compress()
+
+    def merge(self, other):
+        """Добавляет к себе другой скетч"""
+        if not other.count:
+            return
+        self.buffer.extend(other.centroids)
+        self.buffer.extend(other.buffer)
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if len(self.buffer) > 5 * self.compression:
+            self.compress()
+
+    @classmethod
+    def merged(cls, digests):
+        result = cls()
+        for digest in digests:
+            result.merge(digest)
+        result.compress()
+        return result
+
+    def to_message(self):
+        """Скетч для передачи и хранения: центроиды и точные min, max, число и сумма (пустой скетч не передается)"""
+        self.compress()
+        return {'centroids': self.centroids, 'min': self.min, 'max': self.max, 'count': self.count, 'total': self.total}
+
+    @classmethod
+    def from_message(cls, message):
+        digest = cls()
+        digest.centroids = [tuple(centroid) for centroid in message['centroids']]  # из JSON приходят списки, а compress сортирует кортежи
+        digest.min, digest.max = message['min'], message['max']
+        digest.count, digest.total = message['count'], message['total']
+        return digest
+
+    def scale(self, q):
+        """Шкала k1: центроид может занимать не больше единицы шкалы"""
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def compress(self):
+        if not self.buffer:
+            return
+        items = sorted(self.centroids + self.buffer)
+        self.buffer = []
+
+        centroids = []
+        mean, weight = items[0]
+        before = 0.0  # вес центроидов левее текущего
+        k_low = self.scale(0.0)
+        for item_mean, item_weight in items[1:]:
+            if self.scale((before + weight + item_weight) / self.count) - k_low <= 1:
+                weight += item_weight
+                mean += (item_mean - mean) * item_weight / weight
+            else:
+                centroids.append((mean, weight))
+                before += weight
+                k_low = self.scale(before / self.count)
+                mean, weight = item_mean, item_weight
+        centroids.append((mean, weight))
+        self.centroids = centroids
+
+    def quantile(self, q):
+        """Значение q-квантиля (0 <= q <= 1); None для пустого скетча"""
+        if not self.count:
+            return None
+        self.compress()
+        if len(self.centroids) == 1 or q <= 0:
+            return self.min if q <= 0 else self.centroids[0][0]
+        if q >= 1:
+            return self.max
+
+        # Вес центроида считается сосредоточенным в его середине; между серединами - линейная интерполяция,
+        # а до первой и после последней середины - интерполяция к точным min и max
+        target = q * self.count
+        previous_center, previous_mean = 0.0, self.min
+        cumulative = 0.0
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target < center:
+                return previous_mean + (mean - previous_mean) * (target - previous_center) / (center - previous_center)
+            previous_center, previous_mean = center, mean
+            cumulative += weight
+        if self.count == previous_center:
+            return self.max
+        return previous_mean + (self.max - previous_mean) * (target - previous_center) / (self.count - previous_center)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
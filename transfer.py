@@ -0,0 +1,166 @@
+import json
+import time
+import uuid
+import zlib
+import base64
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:  # необязательная зависимость: без нее передача идет через zlib
+    zstandard = None
+
+from config import (transfer_chunk_bytes, transfer_codecs, transfer_window, transfer_ack_timeout,
+                    transfer_max_retries, durability, print_every_chunk)
+
+# С этого кодека начинается любая передача: он есть в стандартной библиотеке, поэтому его понимает любой узел.
+# В подтверждении получатель перечисляет свои кодеки, и дальше отправитель берет лучший общий.
+baseline_codec = 'zlib'
+
+
+def available_codecs():
+    """Кодеки из transfer_codecs, которые есть на этом узле, в порядке предпочтения"""
+    return [codec for codec in transfer_codecs if codec != 'zstd' or zstandard is not None]
+
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, 6)
+    if codec == 'none':
+        return data
+    raise ValueError(f"Неизвестный кодек: {codec}")
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'none':
+        return data
+    raise ValueError(f"Неизвестный кодек: {codec}")
+
+
+def encode_payload(payload, codec):
+    """JSON-текст порции -> сжатая строка для поля 'payload'"""
+    return base64.b64encode(compress(payload.encode(), codec)).decode()
+
+
+def decode_rows(request):
+    """Строки из сообщения с полями 'codec' и 'payload'"""
+    return json.loads(decompress(base64.b64decode(request['payload']), request['codec']))
+
+
+def byte_chunks(store, dates, max_bytes=transfer_chunk_bytes):
+    """
+    Строки дат порциями примерно по max_bytes байт JSON (а не по числу дат), поэтому размер порции
+    не зависит от схемы и числа строк за дату; дата с большим числом строк делится между порциями.
+    Строки собираются из хранилища по мере отправки. Возвращает JSON-текст списка строк.
+    """
+    chunk = []
+    size = 0
+    for date in dates:
+        for row in store.get(date, []):
+            encoded = json.dumps(row)
+            if chunk and size + len(encoded) > max_bytes:
+                yield '[' + ','.join(chunk) + ']'
+                chunk, size = [], 0
+            chunk.append(encoded)
+            size += len(encoded) + 1
+    if chunk:
+        yield '[' + ','.join(chunk) + ']'
+
+
+class ChunkSender:
+    """
+    Отправка порций строк с подтверждениями: одновременно в пути не больше transfer_window порций,
+    неподтвержденная за transfer_ack_timeout порция отправляется заново (до transfer_max_retries раз).
+    Получатель применяет каждую порцию один раз (по transfer_id и chunk_id), так что повторы безопасны.
+    Подтверждения забираются из очереди через basic_get, а не подпиской: send вызывается из обработчика
+    сообщений (RELOCATE), а там BlockingConnection не вызывает обработчики других подписок.
+    """
+
+    def __init__(self, connection, channel, ack_queue):
+        self.connection = connection
+        self.channel = channel
+        self.ack_queue = ack_queue
+        self.in_flight = OrderedDict()  # (transfer_id, chunk_id) -> {'routing_key', 'body', 'sent', 'retries'}
+        self.codecs = {}  # очередь получателя -> согласованный с ним кодек
+
+        self.channel.queue_declare(queue=ack_queue, durable=durability)
+
+    def send(self, routing_key, fields, chunks):
+        """Отправляет порции одному получателю и ждет подтверждения всех. Возвращает статистику передачи"""
+        transfer_id = uuid.uuid4().hex
+        stats = {'chunks': 0, 'raw_bytes': 0, 'sent_bytes': 0, 'retries': 0, 'codec': None, 'seconds': 0.0}
+        started = time.time()
+
+        for chunk_id, payload in enumerate(chunks):
+            while len(self.in_flight) >= transfer_window:
+                stats['retries'] += self.wait()
+
+            codec = self.codecs.get(routing_key, baseline_codec)
+            body = json.dumps({
+                **fields, 'transfer_id': transfer_id, 'chunk_id': chunk_id,
+                'codec': codec, 'payload': encode_payload(payload, codec), 'ack_to': self.ack_queue,
+            })
+            self.channel.basic_publish(exchange='', routing_key=routing_key, body=body)
+            self.in_flight[(transfer_id, chunk_id)] = {'routing_key': routing_key, 'body': body, 'sent': time.time(), 'retries': 0}
+
+            stats['chunks'] += 1
+            stats['raw_bytes'] += len(payload)
+            stats['sent_bytes'] += len(body)
+            stats['codec'] = codec
+
+        while self.in_flight:
+            stats['retries'] += self.wait()
+
+        stats['seconds'] = round(time.time() - started, 3)
+        return stats
+
+    def wait(self):
+        """Обрабатывает подтверждения (если их нет - ждет немного) и переотправляет просроченные порции. Возвращает число переотправок"""
+        if not self.poll_acks():
+            self.connection.sleep(0.005)
+        return self.resend_expired()
+
+    def poll_acks(self):
+        """Применяет все подтверждения, лежащие в очереди. Возвращает их число"""
+        count = 0
+        while True:
+            method, _, body = self.channel.basic_get(queue=self.ack_queue, auto_ack=True)
+            if method is None:
+                return count
+            self.on_ack(body)
+            count += 1
+
+    def resend_expired(self):
+        now = time.time()
+        resent = 0
+        for key, entry in self.in_flight.items():
+            if now - entry['sent'] < transfer_ack_timeout:
+                continue
+            if entry['retries'] >= transfer_max_retries:
+                raise RuntimeError(f"{entry['routing_key']} не подтвердил порцию {key[1]} после {transfer_max_retries} повторов")
+
+            entry['retries'] += 1
+            entry['sent'] = now
+            self.channel.basic_publish(exchange='', routing_key=entry['routing_key'], body=entry['body'])
+            resent += 1
+
+            if print_every_chunk:
+                print(f"[Передача] Порция {key[1]} не подтверждена {entry['routing_key']}, отправляю повторно")
+        return resent
+
+    def on_ack(self, body):
+        """Подтверждение порции; по списку кодеков получателя выбираем лучший общий для следующих порций"""
+        ack = json.loads(body)
+        entry = self.in_flight.pop((ack['transfer_id'], ack['chunk_id']), None)
+        if entry is None:
+            return  # подтверждение повтора, уже учтено
+
+        common = [codec for codec in available_codecs() if codec in ack['codecs']]
+        if common:
+            self.codecs[entry['routing_key']] = common[0]